@@ -1,30 +1,43 @@
 import asyncio
-from bleak import BleakScanner, BleakClient
 
-SERVICE_UUID = "12345678-1234-5678-1234-56789abcdef0"
-CHAR_UUID = "12345678-1234-5678-1234-56789abcdef1"
+import sys
+import os
+sys.path.append(os.path.dirname(__file__))
 
-async def notification_handler(sender, data):
-    print(f"Received from {sender}: {data.decode()}")
+from ble_central import SlumberClient, ALERT
 
-async def main():
-    print("Scanning for PiBLE...")
-    devices = await BleakScanner.discover(timeout=10)
+# Seconds between two link statistics lines
+STATS_INTERVAL = 10
+
+async def print_records(client):
+    while True:
+        record = await client.get()
+        if record.kind == ALERT:
+            print(f"Alert from {record.sensor}: {record.alert}")
+        else:
+            print(f"Vitals: {record.sensor} {record.value}")
 
-    pi_device = next((d for d in devices if d.name == "PiBLE"), None)
-    if not pi_device:
-        print("PiBLE not found. Is it powered and running?")
-        return
+async def print_stats(client):
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        stats = client.stats.report()
+        latency = stats['latency_mean']
+        print(f"[link] {stats['notifications_per_s']:.1f} notifications/s, {stats['bytes_per_s']:.0f} B/s, "
+              f"latency {latency * 1000:.0f} ms" if latency is not None else "[link] idle")
 
-    async with BleakClient(pi_device.address) as client:
-        print(f"Connected to {pi_device.address}")
-        await client.start_notify(CHAR_UUID, notification_handler)
-        print("Receiving notifications... Press Ctrl+C to exit")
-        try:
-            while True:
-                await asyncio.sleep(1)
-        except KeyboardInterrupt:
-            await client.stop_notify(CHAR_UUID)
-            print("Stopped")
+async def main():
+    print("Scanning for PiBLE...")
+    client = SlumberClient()
+    tasks = [asyncio.ensure_future(print_records(client)), asyncio.ensure_future(print_stats(client))]
+    print("Receiving notifications... Press Ctrl+C to exit")
+    try:
+        await client.run()
+    finally:
+        client.stop()
+        for task in tasks:
+            task.cancel()
 
-asyncio.run(main())
+try:
+    asyncio.run(main())
+except KeyboardInterrupt:
+    print("Stopped")
@@ -0,0 +1,212 @@
+import asyncio
+import time
+from collections import namedtuple, deque
+
+try:
+    from bleak import BleakScanner, BleakClient
+except ImportError:
+    # only explicit scanner and client classes (e.g. fake_peripheral.FakePeripheral) can be used
+    BleakScanner = None
+    BleakClient = None
+
+import sys
+import os
+sys.path.append(os.path.dirname(__file__))
+
+import ble_wire
+
+SERVICE_UUID = "12345678-1234-5678-1234-56789abcdef0"
+CHAR_UUID = "12345678-1234-5678-1234-56789abcdef1"
+VITALS_CHAR_UUID = "12345678-1234-5678-1234-56789abcdef2"
+
+SCAN_TIMEOUT = 10            # seconds per scan
+RECONNECT_MIN_DELAY = 1      # seconds, doubled after every failed attempt
+RECONNECT_MAX_DELAY = 30     # seconds
+QUEUE_SIZE = 256             # records waiting for the consumer
+LATENCY_WINDOW = 1000        # latest latencies kept for the stats
+# A message numbered at most this far below the newest one seen in its
+# epoch is a duplicate (e.g. replayed again after a server restart)
+DEDUP_WINDOW = 1 << 20
+SEQ_WRAP = 1 << 32
+# Newest numbers kept for this many epochs (server starts); messages of
+# older ones, replayed from the server's store, are let through
+EPOCHS_KEPT = 8
+
+# Record kinds
+ALERT = 'alert'
+VITALS = 'vitals'
+
+# One decoded reading: kind (ALERT or VITALS), sensor name, value (a number,
+# or a dict for 'heart'), alert text (None for vitals), the message sequence
+# number, and the sender and receiver unix times
+Record = namedtuple('Record', ['kind', 'sensor', 'value', 'alert', 'seq', 'sent', 'received'])
+
+
+class LinkStats():
+    """
+    Counters of the BLE link since the last report().
+    Latency is receiver time minus sender timestamp, so it includes any
+    clock offset between the Pi and this machine.
+    """
+    def __init__(self):
+        self.connects = 0
+        self.lost_messages = 0
+        self.duplicates = 0
+        self.queue_dropped = 0
+        self._start_interval()
+
+    def _start_interval(self):
+        self.started = time.monotonic()
+        self.notifications = 0
+        self.bytes = 0
+        self.records = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def add_notification(self, nbytes):
+        self.notifications += 1
+        self.bytes += nbytes
+
+    def add_record(self, record):
+        self.records += 1
+        self.latencies.append(record.received - record.sent)
+
+    def report(self):
+        """
+        Rates and latency since the last report, as a dict; starts a new interval.
+        """
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        latencies = sorted(self.latencies)
+        report = {
+            'notifications_per_s': self.notifications / elapsed,
+            'bytes_per_s': self.bytes / elapsed,
+            'records_per_s': self.records / elapsed,
+            'latency_mean': sum(latencies) / len(latencies) if latencies else None,
+            'latency_p95': latencies[int(0.95 * (len(latencies) - 1))] if latencies else None,
+            'connects': self.connects,
+            'lost_messages': self.lost_messages,
+            'duplicates': self.duplicates,
+            'queue_dropped': self.queue_dropped,
+        }
+        self._start_interval()
+        return report
+
+
+class SlumberClient():
+    """
+    Receives alerts and vitals from the PiBLE server.
+
+    run() scans for the service UUID, connects, subscribes to both
+    characteristics and reconnects with exponential backoff whenever the
+    device is missing or the link drops, until stop(). Notifications are
+    decoded into Records and put into the bounded asyncio.Queue `records`,
+    skipping messages already received (the server replays what it stored
+    while no client was connected, see ble_store.py);
+    when the consumer falls behind, the oldest record is dropped
+    (counted in stats.queue_dropped) so the notification callback never blocks.
+
+    `scanner` and `client_class` default to bleak's BleakScanner and BleakClient.
+    """
+    def __init__(self, service_uuid=SERVICE_UUID, queue_size=QUEUE_SIZE, scan_timeout=SCAN_TIMEOUT,
+                 scanner=None, client_class=None):
+        self.service_uuid = service_uuid.lower()
+        self.scan_timeout = scan_timeout
+        self.scanner = scanner if scanner is not None else BleakScanner
+        self.client_class = client_class if client_class is not None else BleakClient
+        if self.scanner is None or self.client_class is None:
+            raise ImportError("bleak is not installed")
+        self.reconnect_min_delay = RECONNECT_MIN_DELAY
+        self.reconnect_max_delay = RECONNECT_MAX_DELAY
+
+        self.records = asyncio.Queue(queue_size)
+        self.stats = LinkStats()
+        self._stopping = False
+        self._disconnected = None
+        self._last_seq = {ALERT: {}, VITALS: {}}  # kind -> {epoch: newest seq}
+
+    async def find_device(self):
+        """
+        Scan until the first device advertising the service, or None after scan_timeout.
+        """
+        def advertises_service(device, advertisement):
+            return self.service_uuid in (uuid.lower() for uuid in advertisement.service_uuids)
+
+        return await self.scanner.find_device_by_filter(advertises_service, timeout=self.scan_timeout)
+
+    async def run(self):
+        delay = self.reconnect_min_delay
+        while not self._stopping:
+            device = await self.find_device()
+            if device is None:
+                print("PiBLE not found, scanning again in", delay, "s")
+            else:
+                try:
+                    await self._receive(device)
+                    delay = self.reconnect_min_delay
+                except Exception as e:
+                    print("BLE connection failed:", e)
+            if self._stopping:
+                break
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.reconnect_max_delay)
+
+    def stop(self):
+        self._stopping = True
+        if self._disconnected is not None:
+            self._disconnected.set()
+
+    async def get(self):
+        """
+        Next record, waiting for one if the queue is empty.
+        """
+        return await self.records.get()
+
+    async def _receive(self, device):
+        """
+        Connect to `device` and receive until the link drops or stop().
+        """
+        self._disconnected = asyncio.Event()
+        alerts = ble_wire.Reassembler()
+        vitals = ble_wire.Reassembler(decode=ble_wire.decode_snapshot)
+
+        async with self.client_class(device, disconnected_callback=lambda client: self._disconnected.set()) as client:
+            self.stats.connects += 1
+            print("Connected to", device.address)
+            # the server learns the negotiated MTU from these reads
+            await client.read_gatt_char(CHAR_UUID)
+            await client.read_gatt_char(VITALS_CHAR_UUID)
+            await client.start_notify(CHAR_UUID, lambda sender, data: self._on_notification(alerts, ALERT, data))
+            await client.start_notify(VITALS_CHAR_UUID, lambda sender, data: self._on_notification(vitals, VITALS, data))
+            await self._disconnected.wait()
+
+        self.stats.lost_messages += alerts.dropped + vitals.dropped
+        print("Disconnected from", device.address)
+
+    def _on_notification(self, reassembler, kind, data):
+        received = time.time()
+        self.stats.add_notification(len(data))
+        decoded = reassembler.feed(data)
+        if decoded is None:
+            return
+        messages = decoded if kind == VITALS else [decoded]
+        if not messages or self._is_duplicate(kind, messages[0]['epoch'], messages[0]['seq']):
+            return
+        for msg in messages:
+            record = Record(kind, msg['sensor'], msg['value'], msg['alert'], msg['seq'], msg['time'], received)
+            self.stats.add_record(record)
+            if self.records.full():
+                self.records.get_nowait()
+                self.stats.queue_dropped += 1
+            self.records.put_nowait(record)
+
+    def _is_duplicate(self, kind, epoch, seq):
+        last_seq = self._last_seq[kind]
+        last = last_seq.pop(epoch, None)
+        if last is not None and (last - seq) % SEQ_WRAP < DEDUP_WINDOW:
+            last_seq[epoch] = last
+            self.stats.duplicates += 1
+            return True
+        # the most recently seen epoch last, the least recently seen first out
+        last_seq[epoch] = seq
+        if len(last_seq) > EPOCHS_KEPT:
+            del last_seq[next(iter(last_seq))]
+        return False
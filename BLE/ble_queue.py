@@ -0,0 +1,108 @@
+import os
+import sys
+import threading
+import time
+from queue import Empty
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import metrics
+
+# Longest the consumer blocks on the queue before checking whether to stop
+QUEUE_TIMEOUT = 1.0  # seconds
+# Most messages handed to the main loop in one pass
+MAX_BATCH = 64
+
+
+def drain_queue(queue, timeout=QUEUE_TIMEOUT, max_batch=MAX_BATCH):
+    """
+    Block up to `timeout` seconds for a message, then take every message
+    that is already waiting (up to `max_batch`). Returns [] on timeout.
+    """
+    try:
+        batch = [queue.get(timeout=timeout)]
+    except Empty:
+        return []
+    while len(batch) < max_batch:
+        try:
+            batch.append(queue.get_nowait())
+        except Empty:
+            break
+    return batch
+
+
+def queue_depth(queue):
+    """
+    Approximate number of messages waiting in `queue`, 0 where the
+    platform cannot tell (multiprocessing queues on macOS).
+    """
+    try:
+        return queue.qsize()
+    except NotImplementedError:
+        return 0
+
+
+def send_batch(characteristic, batch):
+    """
+    Send every message of `batch` as a notification.
+    Runs on the GLib main loop; returns False so GLib.idle_add runs it once.
+    """
+    for msg in batch:
+        try:
+            print("BLE Sending:", msg)
+            start = time.perf_counter()
+            characteristic.send_notification(msg)
+            metrics.BLE_SEND_SECONDS.observe(time.perf_counter() - start)
+        except Exception as e:
+            metrics.BLE_SEND_ERRORS.inc()
+            print("Error sending BLE message:", e)
+    return False
+
+
+class VitalsBuffer():
+    """
+    Newest vitals message (one without an alert) per sensor. Updates that
+    arrive before the stream characteristic takes them are coalesced, so
+    a slow stream only ever sends the latest value of each sensor.
+    """
+    def __init__(self):
+        self.coalesced = 0
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def put(self, msg):
+        with self._lock:
+            if msg['sensor'] in self._latest:
+                self.coalesced += 1
+            self._latest[msg['sensor']] = msg
+
+    def take(self):
+        """
+        The pending messages in sensor order, leaving the buffer empty.
+        """
+        with self._lock:
+            latest, self._latest = self._latest, {}
+        return [latest[sensor] for sensor in sorted(latest)]
+
+
+def send_from_queue(queue, characteristic, schedule, stop=None, vitals=None):
+    """
+    Consumer thread: wait on the sensor queue and hand each batch of alerts
+    to the main loop with `schedule` (GLib.idle_add), so D-Bus signals are
+    only emitted from the main loop thread. Vitals messages go into the
+    `vitals` VitalsBuffer (dropped without one) for the stream characteristic.
+    Runs until `stop` (a threading.Event) is set.
+    """
+    while stop is None or not stop.is_set():
+        alerts = []
+        batch = drain_queue(queue)
+        metrics.QUEUE_DEPTH.set(queue_depth(queue))
+        if batch:
+            metrics.BLE_BATCH_SIZE.observe(len(batch))
+        for msg in batch:
+            if msg.get('alert'):
+                alerts.append(msg)
+            elif vitals is not None:
+                vitals.put(msg)
+        if alerts:
+            schedule(send_batch, characteristic, alerts)
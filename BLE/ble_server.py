@@ -0,0 +1,337 @@
+import dbus
+import dbus.mainloop.glib
+import dbus.service
+from gi.repository import GLib
+import threading
+import time
+import signal
+
+import sys
+import os
+sys.path.append(os.path.dirname(__file__))
+
+from ble_queue import send_from_queue, VitalsBuffer
+from ble_store import OfflineStore, FLUSH_INTERVAL
+import ble_wire
+import metrics
+
+BLUEZ_SERVICE_NAME = 'org.bluez'
+ADAPTER_IFACE = 'org.bluez.Adapter1'
+GATT_MANAGER_IFACE = 'org.bluez.GattManager1'
+LE_ADVERTISING_MANAGER_IFACE = 'org.bluez.LEAdvertisingManager1'
+DBUS_OM_IFACE = 'org.freedesktop.DBus.ObjectManager'
+GATT_CHRC_IFACE = 'org.bluez.GattCharacteristic1'
+
+SERVICE_UUID = '12345678-1234-5678-1234-56789abcdef0'
+CHAR_UUID = '12345678-1234-5678-1234-56789abcdef1'
+VITALS_CHAR_UUID = '12345678-1234-5678-1234-56789abcdef2'
+ADVERTISING_PATH = '/org/bluez/example/advertisement0'
+DEVICE_NAME = 'PiBLE'
+
+# Vitals snapshots per second on the streaming characteristic
+VITALS_RATE = 4
+
+# Messages that could not be sent (no client subscribed) are kept here
+# and replayed when the client subscribes again
+OFFLINE_STORE_PATH = 'logs/BLE/offline.db'
+# Seconds between two vitals snapshots kept while no client is subscribed
+OFFLINE_VITALS_INTERVAL = 10
+# Stored messages replayed per second after the client subscribes,
+# sent in batches every REPLAY_INTERVAL seconds
+REPLAY_RATE = 50
+REPLAY_INTERVAL = 0.1
+
+# Seconds between two heartbeats to the supervisor (see supervisor.py)
+HEARTBEAT_INTERVAL = 1
+
+mainloop = None
+
+class Advertisement(dbus.service.Object):
+    def __init__(self, bus, index):
+        self.path = f'/org/bluez/example/advertisement{index}'
+        self.bus = bus
+        self.ad_type = 'peripheral'
+        self.service_uuids = [SERVICE_UUID]
+        self.local_name = DEVICE_NAME
+        self.includes = ['tx-power']
+        dbus.service.Object.__init__(self, bus, self.path)
+
+    def get_path(self):
+        return dbus.ObjectPath(self.path)
+
+    def get_properties(self):
+        return {
+            'org.bluez.LEAdvertisement1': {
+                'Type': self.ad_type,
+                'ServiceUUIDs': self.service_uuids,
+                'LocalName': self.local_name,
+                'Includes': self.includes
+            }
+        }
+
+    @dbus.service.method('org.freedesktop.DBus.Properties', in_signature='ss', out_signature='v')
+    def Get(self, interface, prop):
+        return self.get_properties()[interface][prop]
+
+    @dbus.service.method('org.freedesktop.DBus.Properties', in_signature='s', out_signature='a{sv}')
+    def GetAll(self, interface):
+        return self.get_properties()[interface]
+
+    @dbus.service.method('org.bluez.LEAdvertisement1')
+    def Release(self):
+        print("Advertisement released")
+
+
+class Application(dbus.service.Object):
+    def __init__(self, bus):
+        self.path = '/org/bluez/example'
+        self.services = []
+        dbus.service.Object.__init__(self, bus, self.path)
+
+    def get_path(self):
+        return dbus.ObjectPath(self.path)
+
+    def add_service(self, service):
+        self.services.append(service)
+
+    @dbus.service.method(DBUS_OM_IFACE, out_signature='a{oa{sa{sv}}}')
+    def GetManagedObjects(self):
+        response = {}
+        for service in self.services:
+            response[service.get_path()] = service.get_properties()
+            for char in service.characteristics:
+                response[char.get_path()] = char.get_properties()
+        return response
+
+
+class Service(dbus.service.Object):
+    def __init__(self, bus, index):
+        self.path = f"/org/bluez/example/service{index}"
+        self.bus = bus
+        self.uuid = SERVICE_UUID
+        self.primary = True
+        self.characteristics = []
+        dbus.service.Object.__init__(self, bus, self.path)
+
+    def get_path(self):
+        return dbus.ObjectPath(self.path)
+
+    def add_characteristic(self, characteristic):
+        self.characteristics.append(characteristic)
+
+    def get_properties(self):
+        return {
+            'org.bluez.GattService1': {
+                'UUID': self.uuid,
+                'Primary': self.primary
+            }
+        }
+
+
+class Characteristic(dbus.service.Object):
+    """
+    Notifies messages while a client is subscribed. Otherwise they go to
+    `store` (an OfflineStore, in memory by default) and are replayed in
+    order, REPLAY_RATE per second, once a client subscribes again.
+    """
+    def __init__(self, bus, index, service, uuid=CHAR_UUID, store=None):
+        self.path = service.get_path() + f"/char{index}"
+        self.bus = bus
+        self.uuid = uuid
+        self.service = service
+        self.notifying = False
+        self.value = dbus.ByteArray(b'')
+        self.mtu = ble_wire.DEFAULT_MTU
+        self.frame_seq = 0  # frame sequence number of the next notification
+        self.store = store if store is not None else OfflineStore(':memory:', f'char{index}')
+        self.replay_timer = None
+        dbus.service.Object.__init__(self, bus, self.path)
+
+    def get_path(self):
+        return dbus.ObjectPath(self.path)
+
+    def get_properties(self):
+        return {
+            GATT_CHRC_IFACE: {
+                'UUID': self.uuid,
+                'Service': self.service.get_path(),
+                'Flags': ['read', 'notify'],
+                'Notifying': self.notifying
+            }
+        }
+
+    def send_notification(self, message):
+        """
+        Encode a message dict (see ble_wire.py) and deliver it.
+        """
+        self.deliver(ble_wire.encode_message(message, self.store.allocate_seq(), epoch=self.store.epoch))
+
+    def deliver(self, payload):
+        """
+        Notify a payload now, or store it while no client is subscribed or
+        older messages are still being replayed, so the order is kept.
+        """
+        if self.notifying and not len(self.store):
+            self.send_payload(payload)
+        else:
+            self.store.append(payload)
+
+    def send_payload(self, payload):
+        """
+        Notify a payload in as many frames as the ATT MTU needs.
+        """
+        frames = ble_wire.fragment(payload, self.mtu, self.frame_seq)
+        self.frame_seq += len(frames)
+        for frame in frames:
+            self.value = dbus.ByteArray(frame)
+            if self.notifying:
+                self.PropertiesChanged(
+                    GATT_CHRC_IFACE,
+                    {'Value': self.value}, [])
+
+    @dbus.service.method(GATT_CHRC_IFACE, in_signature='a{sv}', out_signature='ay')
+    def ReadValue(self, options):
+        # BlueZ passes the negotiated MTU with every read, so the client
+        # reads once after connecting to announce it
+        if 'mtu' in options:
+            self.mtu = int(options['mtu'])
+        return self.value
+
+    def replay(self):
+        """
+        Timer callback: send the next batch of stored messages.
+        """
+        if self.notifying:
+            batch = self.store.peek(max(1, int(REPLAY_RATE * REPLAY_INTERVAL)))
+            for _, payload in batch:
+                self.send_payload(payload)
+            if batch:
+                self.store.remove(batch[-1][0])
+            if len(self.store):
+                return True  # keep the timer running
+        self.replay_timer = None
+        return False
+
+    @dbus.service.method(GATT_CHRC_IFACE)
+    def StartNotify(self):
+        self.notifying = True
+        if len(self.store) and self.replay_timer is None:
+            # low priority, so replaying a long backlog can not starve the GLib loop
+            self.replay_timer = GLib.timeout_add(int(REPLAY_INTERVAL * 1000), self.replay,
+                                                 priority=GLib.PRIORITY_LOW)
+
+    @dbus.service.method(GATT_CHRC_IFACE)
+    def StopNotify(self):
+        self.notifying = False
+
+    @dbus.service.signal('org.freedesktop.DBus.Properties', signature='sa{sv}as')
+    def PropertiesChanged(self, interface, changed, invalidated):
+        pass
+
+
+class VitalsCharacteristic(Characteristic):
+    """
+    Streams the newest vitals of every sensor (from a VitalsBuffer) `rate`
+    times per second while the client is subscribed, and keeps one snapshot
+    every OFFLINE_VITALS_INTERVAL seconds while it is not. The timer runs at
+    low priority on the GLib loop, below alerts and D-Bus traffic, so a busy
+    stream can delay neither.
+    """
+    def __init__(self, bus, index, service, vitals, rate=VITALS_RATE, store=None):
+        Characteristic.__init__(self, bus, index, service, uuid=VITALS_CHAR_UUID, store=store)
+        self.vitals = vitals
+        self.rate = rate
+        self.last_stored = 0
+        self.timer = GLib.timeout_add(int(1000 / self.rate), self.send_snapshot,
+                                      priority=GLib.PRIORITY_LOW)
+
+    def send_snapshot(self):
+        messages = self.vitals.take()
+        if not messages:
+            return True  # keep the timer running
+        now = time.monotonic()
+        if self.notifying or now - self.last_stored >= OFFLINE_VITALS_INTERVAL:
+            self.deliver(ble_wire.encode_snapshot(messages, self.store.allocate_seq(),
+                                                   epoch=self.store.epoch))
+            if not self.notifying:
+                self.last_stored = now
+        return True
+
+
+def schedule_alerts(function, *args):
+    # Alerts go ahead of everything else on the GLib loop, including vitals
+    GLib.idle_add(function, *args, priority=GLib.PRIORITY_HIGH)
+
+
+def stop():
+    """
+    Quit main() from another thread.
+    """
+    if mainloop is not None:
+        GLib.idle_add(mainloop.quit)
+
+
+def main(queue, vitals_rate=VITALS_RATE, heartbeat=None):
+    global mainloop
+    metrics.attach()
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    bus = dbus.SystemBus()
+
+    adapter_path = '/org/bluez/hci0'
+    adapter_props = dbus.Interface(bus.get_object(BLUEZ_SERVICE_NAME, adapter_path), 'org.freedesktop.DBus.Properties')
+    adapter_props.Set(ADAPTER_IFACE, 'Powered', dbus.Boolean(1))
+
+    # Register GATT application
+    app = Application(bus)
+    service = Service(bus, 0)
+    os.makedirs(os.path.dirname(OFFLINE_STORE_PATH), exist_ok=True)
+    char = Characteristic(bus, 0, service, store=OfflineStore(OFFLINE_STORE_PATH, 'alerts'))
+    service.add_characteristic(char)
+    vitals = VitalsBuffer()
+    vitals_char = VitalsCharacteristic(bus, 1, service, vitals, vitals_rate,
+                                       store=OfflineStore(OFFLINE_STORE_PATH, 'vitals'))
+    service.add_characteristic(vitals_char)
+    app.add_service(service)
+
+    gatt_manager = dbus.Interface(bus.get_object(BLUEZ_SERVICE_NAME, adapter_path), GATT_MANAGER_IFACE)
+    gatt_manager.RegisterApplication(app.get_path(), {},
+        reply_handler=lambda: print("GATT app registered"),
+        error_handler=lambda e: print("Failed to register app:", e))
+
+    # Register advertisement
+    ad = Advertisement(bus, 0)
+    ad_manager = dbus.Interface(bus.get_object(BLUEZ_SERVICE_NAME, adapter_path), LE_ADVERTISING_MANAGER_IFACE)
+    ad_manager.RegisterAdvertisement(ad.get_path(), {},
+        reply_handler=lambda: print("Advertisement registered"),
+        error_handler=lambda e: print("Failed to register advertisement:", e))
+
+    # Start queue-based BLE notifications
+    threading.Thread(target=send_from_queue, args=(queue, char, schedule_alerts),
+                     kwargs={'vitals': vitals}, daemon=True).start()
+
+    # Write stored messages to disk even when no new ones arrive
+    def flush_stores():
+        char.store.flush()
+        vitals_char.store.flush()
+        return True
+    GLib.timeout_add_seconds(int(FLUSH_INTERVAL), flush_stores)
+
+    # Beats only while the main loop is running its callbacks
+    if heartbeat:
+        def beat():
+            heartbeat.beat()
+            return True
+        beat()
+        GLib.timeout_add_seconds(HEARTBEAT_INTERVAL, beat)
+
+    # Run BLE event loop
+    mainloop = GLib.MainLoop()
+    # Python signal handlers only run once the loop returns, so quit it from GLib
+    # (in the asyncio runtime this runs in a thread, which is stopped with stop())
+    if threading.current_thread() is threading.main_thread():
+        GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGTERM, mainloop.quit)
+    try:
+        mainloop.run()
+    finally:
+        char.store.close()
+        vitals_char.store.close()
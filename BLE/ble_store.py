@@ -0,0 +1,127 @@
+import os
+import sqlite3
+import time
+
+# Most payloads kept per store; the oldest are dropped beyond this
+MAX_RECORDS = 20000
+# Appends are written to disk in one transaction when this many are
+# pending, or when the oldest pending one is this old
+FLUSH_SIZE = 64
+FLUSH_INTERVAL = 5.0  # seconds
+
+SEQ_MASK = 0xFFFFFFFF
+# Sequence numbers are reserved on disk this many at a time, each
+# reservation synced (synchronous=FULL); after a restart numbering
+# continues after the reserved block
+SEQ_BLOCK = 1024
+
+
+class OfflineStore():
+    """
+    Bounded store-and-forward buffer of encoded notification payloads
+    (see ble_wire.py) in an SQLite database in WAL mode, one table per
+    characteristic (`name`). Payloads are kept in order until remove()d.
+
+    Appends only go to a list in memory; they are written in batches
+    (FLUSH_SIZE / FLUSH_INTERVAL), so recording costs almost nothing.
+    The store also hands out the message sequence numbers, reserving them
+    on disk in blocks so numbers are not reused after a restart, and a
+    random `epoch` per process they are sent with (see ble_wire.py), so a
+    client does not take reused numbers for old ones if the store is lost.
+
+    Use one store per thread; the BLE server only touches it from the GLib loop.
+    """
+    def __init__(self, path, name, max_records=MAX_RECORDS,
+                 flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.name = name
+        self.max_records = max_records
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        # a crash may lose the last flush, but never corrupts the database
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute(f'CREATE TABLE IF NOT EXISTS {name} (id INTEGER PRIMARY KEY, payload BLOB)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS seq (name TEXT PRIMARY KEY, next INTEGER)')
+        self.db.commit()
+
+        row = self.db.execute('SELECT next FROM seq WHERE name = ?', (name,)).fetchone()
+        self._next_seq = row[0] if row else 0
+        self._reserved = 0  # numbers left in the reserved block
+        self.epoch = int.from_bytes(os.urandom(2), 'big')
+        self._stored = self.db.execute(f'SELECT COUNT(*) FROM {name}').fetchone()[0]
+        self._pending = []
+        self._pending_since = None
+        self.dropped = 0
+
+    def allocate_seq(self):
+        """
+        Sequence number for the next message.
+        """
+        if self._reserved == 0:
+            # NORMAL may lose the last commits in a power cut, and with
+            # them the reservation; this one commit is synced
+            self.db.execute('PRAGMA synchronous=FULL')
+            try:
+                with self.db:
+                    self.db.execute('INSERT OR REPLACE INTO seq (name, next) VALUES (?, ?)',
+                                    (self.name, (self._next_seq + SEQ_BLOCK) & SEQ_MASK))
+            finally:
+                self.db.execute('PRAGMA synchronous=NORMAL')
+            self._reserved = SEQ_BLOCK
+        seq = self._next_seq
+        self._next_seq = (seq + 1) & SEQ_MASK
+        self._reserved -= 1
+        return seq
+
+    def __len__(self):
+        return self._stored + len(self._pending)
+
+    def append(self, payload):
+        if not self._pending:
+            self._pending_since = time.monotonic()
+        self._pending.append(bytes(payload))
+        if (len(self._pending) >= self.flush_size
+                or time.monotonic() - self._pending_since >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Write pending payloads in one transaction, dropping the oldest
+        payloads beyond max_records.
+        """
+        if not self._pending:
+            return
+        with self.db:
+            self.db.executemany(f'INSERT INTO {self.name} (payload) VALUES (?)',
+                                [(payload,) for payload in self._pending])
+            self._stored += len(self._pending)
+            self._pending = []
+
+            excess = self._stored - self.max_records
+            if excess > 0:
+                self.db.execute(f'DELETE FROM {self.name} WHERE id IN '
+                                f'(SELECT id FROM {self.name} ORDER BY id LIMIT ?)', (excess,))
+                self._stored -= excess
+                self.dropped += excess
+
+    def peek(self, count):
+        """
+        The oldest `count` payloads as (id, payload), oldest first.
+        """
+        self.flush()
+        return self.db.execute(f'SELECT id, payload FROM {self.name} ORDER BY id LIMIT ?',
+                               (count,)).fetchall()
+
+    def remove(self, last_id):
+        """
+        Remove the payloads up to and including `last_id` (from peek()).
+        """
+        with self.db:
+            removed = self.db.execute(f'DELETE FROM {self.name} WHERE id <= ?', (last_id,)).rowcount
+        self._stored -= removed
+
+    def close(self):
+        self.flush()
+        self.db.close()
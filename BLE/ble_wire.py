@@ -0,0 +1,246 @@
+import struct
+import time
+
+# Wire format of the notifications, shared by ble_server.py and ble_central.py
+#
+# Alert payload:
+#   sequence    uint32, message number per characteristic, for the client to
+#               skip messages it already has (see ble_store.py)
+#   epoch       uint16, random per start of the server; sequence numbers are
+#               only compared within an epoch, so numbers that are reused
+#               (a lost reservation, a deleted store) are not taken for old ones
+#   timestamp   uint32, sender time in ms since the epoch, modulo 2^32
+#   sensor id   uint8, see SENSOR_IDS
+#   value count uint8
+#   values      int16 each, big-endian, in hundredths (±327.67)
+#   alert       UTF-8, the rest of the payload (may be empty)
+#
+# Vitals snapshot payload: the sequence number, epoch and timestamp, then sensor id,
+# value count and values of each sensor back to back (no alert text).
+#
+# The payload is sent in one or more notifications (frames) that fit the ATT MTU,
+# each starting with a one-byte frame header:
+#   0x80 first frame of a message
+#   0x40 last frame of a message
+#   0x3F frame sequence number (counts up per frame, wraps at 64), to spot lost frames
+
+SENSOR_IDS = {
+    'temperature': 1,
+    'gyroscope': 2,
+    'heart': 3,
+}
+SENSOR_NAMES = {sensor_id: name for name, sensor_id in SENSOR_IDS.items()}
+
+# Sensors whose value is a dict, with its keys in wire order
+VALUE_FIELDS = {
+    'heart': ('hr', 'spo2'),
+}
+
+VALUE_SCALE = 100
+
+EPOCH_WRAP = 1 << 16
+
+# The timestamp wraps about every 49.7 days; the receiver takes the
+# time closest to its own clock
+TIMESTAMP_WRAP = 1 << 32  # ms
+
+# ATT MTU before the client negotiates a larger one, and the ATT header
+# (opcode + handle) that every notification spends of it
+DEFAULT_MTU = 23
+ATT_HEADER_LEN = 3
+
+FRAME_FIRST = 0x80
+FRAME_LAST = 0x40
+FRAME_SEQ_MASK = 0x3F
+FRAME_HEADER_LEN = 1
+
+_SEQ = struct.Struct('>I')
+_EPOCH = struct.Struct('>H')
+_TIMESTAMP = struct.Struct('>I')
+_HEADER = struct.Struct('>BB')
+
+
+def decode_seq(payload):
+    return _SEQ.unpack_from(payload)[0]
+
+
+def decode_epoch(payload):
+    return _EPOCH.unpack_from(payload, _SEQ.size)[0]
+
+
+def encode_timestamp(timestamp=None):
+    """
+    Unix time in seconds (default: now) to the 4-byte wire timestamp.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    return _TIMESTAMP.pack(round(timestamp * 1000) % TIMESTAMP_WRAP)
+
+
+def decode_timestamp(payload, now=None):
+    """
+    The wire timestamp of `payload` to unix time in seconds,
+    unwrapped around `now` (default: the receiver's clock).
+    """
+    if now is None:
+        now = time.time()
+    now_ms = round(now * 1000)
+    age = (now_ms - _TIMESTAMP.unpack_from(payload, _SEQ.size + _EPOCH.size)[0] + TIMESTAMP_WRAP // 2) % TIMESTAMP_WRAP - TIMESTAMP_WRAP // 2
+    return (now_ms - age) / 1000.0
+
+
+def _encode_values(msg):
+    sensor = msg['sensor']
+    if sensor not in SENSOR_IDS:
+        raise ValueError(f"unknown sensor: {sensor}")
+
+    value = msg['value']
+    if sensor in VALUE_FIELDS:
+        values = [value[field] for field in VALUE_FIELDS[sensor]]
+    else:
+        values = [value]
+
+    try:
+        packed = struct.pack(f'>{len(values)}h', *(round(v * VALUE_SCALE) for v in values))
+    except struct.error:
+        raise ValueError(f"{sensor} value out of range: {value}")
+    return _HEADER.pack(SENSOR_IDS[sensor], len(values)) + packed
+
+
+def _decode_values(payload, offset):
+    """
+    Sensor name and value at `offset`, and the offset after them.
+    """
+    sensor_id, count = _HEADER.unpack_from(payload, offset)
+    if sensor_id not in SENSOR_NAMES:
+        raise ValueError(f"unknown sensor id: {sensor_id}")
+    sensor = SENSOR_NAMES[sensor_id]
+
+    values = [v / VALUE_SCALE for v in struct.unpack_from(f'>{count}h', payload, offset + _HEADER.size)]
+    if sensor in VALUE_FIELDS:
+        value = dict(zip(VALUE_FIELDS[sensor], values))
+    else:
+        value = values[0]
+    return sensor, value, offset + _HEADER.size + 2 * count
+
+
+def encode_message(msg, seq=0, timestamp=None, epoch=0):
+    """
+    Message dict ({'sensor', 'value', 'alert'}) to payload bytes,
+    numbered `seq` in `epoch` and stamped with `timestamp` (default: now).
+    """
+    alert = (msg.get('alert') or '').encode('utf-8')
+    return _SEQ.pack(seq) + _EPOCH.pack(epoch) + encode_timestamp(timestamp) + _encode_values(msg) + alert
+
+
+def decode_message(payload, now=None):
+    """
+    Payload bytes to the message dict they were encoded from,
+    with the sequence number as 'seq', its epoch as 'epoch' and the sender
+    timestamp as 'time'.
+    """
+    sensor, value, end = _decode_values(payload, _SEQ.size + _EPOCH.size + _TIMESTAMP.size)
+    alert = bytes(payload[end:]).decode('utf-8')
+    return {'sensor': sensor, 'value': value, 'alert': alert or None, 'seq': decode_seq(payload),
+            'epoch': decode_epoch(payload), 'time': decode_timestamp(payload, now)}
+
+
+def encode_snapshot(messages, seq=0, timestamp=None, epoch=0):
+    """
+    Vitals messages (without alerts) to one payload, numbered `seq` in
+    `epoch` and stamped with `timestamp` (default: now).
+    """
+    payload = _SEQ.pack(seq) + _EPOCH.pack(epoch) + encode_timestamp(timestamp)
+    for msg in messages:
+        if msg.get('alert'):
+            raise ValueError("snapshot messages can not carry an alert")
+        payload += _encode_values(msg)
+    return payload
+
+
+def decode_snapshot(payload, now=None):
+    """
+    Payload from encode_snapshot() to the list of message dicts.
+    """
+    seq = decode_seq(payload)
+    epoch = decode_epoch(payload)
+    sent = decode_timestamp(payload, now)
+    messages = []
+    offset = _SEQ.size + _EPOCH.size + _TIMESTAMP.size
+    while offset < len(payload):
+        sensor, value, offset = _decode_values(payload, offset)
+        messages.append({'sensor': sensor, 'value': value, 'alert': None, 'seq': seq, 'epoch': epoch, 'time': sent})
+    return messages
+
+
+def max_frame_len(mtu):
+    """
+    Largest notification value for the ATT MTU.
+    """
+    return mtu - ATT_HEADER_LEN
+
+
+def fragment(payload, mtu=DEFAULT_MTU, frame_seq=0):
+    """
+    Split a payload into frames that each fit one notification, numbered
+    from `frame_seq`. The next payload continues at frame_seq + len(frames).
+    """
+    chunk = max_frame_len(mtu) - FRAME_HEADER_LEN
+    if chunk <= 0:
+        raise ValueError(f"MTU too small: {mtu}")
+
+    frames = []
+    for start in range(0, max(len(payload), 1), chunk):
+        header = (frame_seq + len(frames)) & FRAME_SEQ_MASK
+        if start == 0:
+            header |= FRAME_FIRST
+        if start + chunk >= len(payload):
+            header |= FRAME_LAST
+        frames.append(bytes((header,)) + payload[start:start + chunk])
+    return frames
+
+
+def encode_frames(msg, mtu=DEFAULT_MTU, frame_seq=0):
+    return fragment(encode_message(msg), mtu, frame_seq)
+
+
+class Reassembler():
+    """
+    Collects frames back into messages. A message with a lost frame is
+    dropped (counted in `dropped`) instead of being decoded wrongly.
+    `decode` turns the payload into the result, e.g. decode_snapshot.
+    """
+    def __init__(self, decode=decode_message):
+        self.decode = decode
+        self.dropped = 0
+        self._next_seq = None
+        self._parts = []
+
+    def feed(self, frame):
+        """
+        Add one notification value; returns the decoded message once its
+        last frame arrives, otherwise None.
+        """
+        header = frame[0]
+        seq = header & FRAME_SEQ_MASK
+        in_order = seq == self._next_seq
+        self._next_seq = (seq + 1) & FRAME_SEQ_MASK
+
+        if header & FRAME_FIRST:
+            if self._parts:
+                self.dropped += 1  # the previous message never got its last frame
+            self._parts = []
+        elif not in_order or not self._parts:
+            # a frame of this message was lost
+            if self._parts:
+                self.dropped += 1
+            self._parts = []
+            return None
+
+        self._parts.append(bytes(frame[FRAME_HEADER_LEN:]))
+        if not header & FRAME_LAST:
+            return None
+
+        payload = b''.join(self._parts)
+        self._parts = []
+        return self.decode(payload)
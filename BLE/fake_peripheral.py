@@ -0,0 +1,154 @@
+import asyncio
+import random
+
+import ble_wire
+from ble_central import SERVICE_UUID, CHAR_UUID, VITALS_CHAR_UUID
+
+
+class FakeDevice():
+    def __init__(self, name='PiBLE', address='FA:KE:00:00:00:01'):
+        self.name = name
+        self.address = address
+
+
+class FakeAdvertisement():
+    def __init__(self, local_name, service_uuids):
+        self.local_name = local_name
+        self.service_uuids = service_uuids
+
+
+class FakePeripheral():
+    """
+    Stand-in for the PiBLE GATT server, so ble_central.SlumberClient can run
+    off-device: pass the peripheral as `scanner` and its `client_class`.
+
+    While connected it notifies vitals snapshots at `vitals_rate` and alerts
+    at random times (`alert_rate` per second on average), framed with
+    ble_wire for `mtu` and delivered `latency` seconds after they are sent.
+    The link drops after `link_lifetime` seconds (None = never) and the
+    device is found again `scan_delay` seconds into the next scan.
+    """
+    def __init__(self, mtu=ble_wire.DEFAULT_MTU, vitals_rate=4, alert_rate=0.5,
+                 link_lifetime=None, latency=0.005, scan_delay=0.1, seed=0):
+        self.mtu = mtu
+        self.vitals_rate = vitals_rate
+        self.alert_rate = alert_rate
+        self.link_lifetime = link_lifetime
+        self.latency = latency
+        self.scan_delay = scan_delay
+        self.advertising = True
+        self.rng = random.Random(seed)
+
+        self.device = FakeDevice()
+        self.advertisement = FakeAdvertisement(self.device.name, [SERVICE_UUID])
+        self.connections = 0
+        self.sent_notifications = 0
+        # message sequence numbers, kept across connections like the server's store
+        self.message_seq = {CHAR_UUID: 0, VITALS_CHAR_UUID: 0}
+        self.epoch = self.rng.randrange(ble_wire.EPOCH_WRAP)
+
+    def restart(self):
+        """
+        As a server restart that lost its store: a new epoch, numbering from 0.
+        """
+        self.epoch = self.rng.randrange(ble_wire.EPOCH_WRAP)
+        self.message_seq = {CHAR_UUID: 0, VITALS_CHAR_UUID: 0}
+
+    async def find_device_by_filter(self, filterfunc, timeout=10.0):
+        if self.advertising and filterfunc(self.device, self.advertisement):
+            await asyncio.sleep(min(self.scan_delay, timeout))
+            return self.device
+        await asyncio.sleep(timeout)
+        return None
+
+    def client_class(self, device, disconnected_callback=None):
+        return FakeClient(self, device, disconnected_callback)
+
+    def vitals(self):
+        return [
+            {'sensor': 'gyroscope', 'value': round(self.rng.uniform(0, 10), 2)},
+            {'sensor': 'heart', 'value': {'hr': round(self.rng.gauss(72, 3), 1), 'spo2': round(self.rng.uniform(95, 100), 1)}},
+            {'sensor': 'temperature', 'value': round(self.rng.gauss(36.8, 0.1), 2)},
+        ]
+
+    def alert(self):
+        temp = round(self.rng.uniform(37.6, 38.9), 2)
+        return {'sensor': 'temperature', 'value': temp, 'alert': f'OVERHEAT ALERT: Temp {temp:.2f}°C > 37.6°C'}
+
+
+class FakeClient():
+    """
+    The part of bleak.BleakClient that SlumberClient uses.
+    """
+    def __init__(self, peripheral, device, disconnected_callback=None):
+        self.peripheral = peripheral
+        self.device = device
+        self.disconnected_callback = disconnected_callback
+        self.is_connected = False
+        self.mtu_size = peripheral.mtu
+        self._callbacks = {}
+        self._frame_seq = {CHAR_UUID: 0, VITALS_CHAR_UUID: 0}
+        self._tasks = []
+
+    async def __aenter__(self):
+        self.is_connected = True
+        self.peripheral.connections += 1
+        self._tasks = [asyncio.ensure_future(self._send_vitals()),
+                       asyncio.ensure_future(self._send_alerts())]
+        if self.peripheral.link_lifetime is not None:
+            self._tasks.append(asyncio.ensure_future(self._drop_link(self.peripheral.link_lifetime)))
+        return self
+
+    async def __aexit__(self, *exc):
+        for task in self._tasks:
+            task.cancel()
+        self.is_connected = False
+
+    async def read_gatt_char(self, uuid):
+        return bytearray()
+
+    async def start_notify(self, uuid, callback):
+        self._callbacks[uuid] = callback
+
+    async def stop_notify(self, uuid):
+        self._callbacks.pop(uuid, None)
+
+    def _next_message_seq(self, uuid):
+        seq = self.peripheral.message_seq[uuid]
+        self.peripheral.message_seq[uuid] += 1
+        return seq
+
+    def _notify(self, uuid, payload):
+        frames = ble_wire.fragment(payload, self.peripheral.mtu, self._frame_seq[uuid])
+        self._frame_seq[uuid] += len(frames)
+        callback = self._callbacks.get(uuid)
+        if callback is None:
+            return
+        loop = asyncio.get_running_loop()
+        for frame in frames:
+            self.peripheral.sent_notifications += 1
+            loop.call_later(self.peripheral.latency, self._deliver, callback, bytearray(frame))
+
+    def _deliver(self, callback, data):
+        if self.is_connected:
+            callback(None, data)
+
+    async def _send_vitals(self):
+        while True:
+            await asyncio.sleep(1.0 / self.peripheral.vitals_rate)
+            self._notify(VITALS_CHAR_UUID, ble_wire.encode_snapshot(self.peripheral.vitals(), self._next_message_seq(VITALS_CHAR_UUID),
+                                                                      epoch=self.peripheral.epoch))
+
+    async def _send_alerts(self):
+        if not self.peripheral.alert_rate:
+            return
+        while True:
+            await asyncio.sleep(self.peripheral.rng.expovariate(self.peripheral.alert_rate))
+            self._notify(CHAR_UUID, ble_wire.encode_message(self.peripheral.alert(), self._next_message_seq(CHAR_UUID),
+                                                             epoch=self.peripheral.epoch))
+
+    async def _drop_link(self, after):
+        await asyncio.sleep(after)
+        self.is_connected = False
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
@@ -0,0 +1,193 @@
+import ctypes
+from collections import deque
+
+from max30102 import (REG_INTR_STATUS_1, REG_INTR_STATUS_2, REG_INTR_ENABLE_1,
+                      REG_FIFO_WR_PTR, REG_OVF_COUNTER, REG_FIFO_RD_PTR, REG_FIFO_DATA,
+                      REG_FIFO_CONFIG, REG_MODE_CONFIG, FIFO_DEPTH, SAMPLE_RATE)
+from ppg_backends import synthetic_ppg
+
+# interrupt status 1 bits
+INTR_A_FULL = 0x80
+INTR_PPG_RDY = 0x40
+
+# time for one byte (8 bits + ACK) on a 400 kHz bus
+I2C_BYTE_TIME = 9 / 400000.0
+# start, address and stop around each transaction, counted as bytes
+I2C_TRANSACTION_OVERHEAD = 3
+
+
+class FakeSMBus():
+    """
+    Stand-in for smbus2.SMBus that emulates a MAX30102 in SpO2 mode,
+    so the driver can run and be benchmarked off-device.
+
+    Time is virtual: it moves forward on sleep() and by the bus time of every
+    transaction, and samples from `source` enter the FIFO at `sample_rate`.
+    Every call counts as one I2C transaction.
+    """
+    def __init__(self, source=None, sample_rate=SAMPLE_RATE, address=0x57):
+        self.address = address
+        self.source = iter(source if source is not None else synthetic_ppg(sample_rate=sample_rate))
+        self.sample_rate = sample_rate
+        self.registers = bytearray(256)
+
+        self.time = 0.0
+        self.transactions = 0
+        self.bytes_transferred = 0
+
+        self._fifo = deque()
+        self._produced = 0
+        self._data_bytes = deque()
+        self._ppg_ready = False
+        self._exhausted = False
+
+    # --- clock ---
+
+    def sleep(self, seconds):
+        self.time += max(seconds, 0.0)
+        self._fill_fifo()
+
+    def _fill_fifo(self):
+        due = int(self.time * self.sample_rate)
+        while self._produced < due and not self._exhausted:
+            try:
+                red, ir = next(self.source)
+            except StopIteration:
+                self._exhausted = True
+                break
+            self._produced += 1
+            if len(self._fifo) < FIFO_DEPTH:
+                self._fifo.append((red, ir))
+                self.registers[REG_FIFO_WR_PTR] = (self.registers[REG_FIFO_WR_PTR] + 1) % FIFO_DEPTH
+                self._ppg_ready = True
+            elif self.registers[REG_OVF_COUNTER] < 0x1F:
+                # FIFO rollover is off, so new samples are lost
+                self.registers[REG_OVF_COUNTER] += 1
+
+    def _transaction(self, nbytes):
+        self.transactions += 1
+        self.bytes_transferred += nbytes
+        self.sleep((nbytes + I2C_TRANSACTION_OVERHEAD) * I2C_BYTE_TIME)
+
+    @property
+    def exhausted(self):
+        """
+        True once the source has run out and the FIFO is empty.
+        """
+        return self._exhausted and not self._fifo and not self._data_bytes
+
+    # --- interrupt pin ---
+
+    def interrupt_asserted(self):
+        """
+        State of the active-low INT pin as a bool (True = asserted).
+        """
+        return bool(self._status_1() & self.registers[REG_INTR_ENABLE_1])
+
+    def _status_1(self):
+        status = 0
+        almost_full = FIFO_DEPTH - (self.registers[REG_FIFO_CONFIG] & 0x0F)
+        if len(self._fifo) >= almost_full:
+            status |= INTR_A_FULL
+        if self._ppg_ready:
+            status |= INTR_PPG_RDY
+        return status
+
+    # --- registers ---
+
+    def _read_register(self, reg):
+        if reg == REG_INTR_STATUS_1:
+            status = self._status_1()
+            self._ppg_ready = False  # cleared by reading
+            return status
+        if reg == REG_INTR_STATUS_2:
+            return 0
+        if reg == REG_FIFO_DATA:
+            if not self._data_bytes:
+                if not self._fifo:
+                    return 0
+                red, ir = self._fifo.popleft()
+                self.registers[REG_FIFO_RD_PTR] = (self.registers[REG_FIFO_RD_PTR] + 1) % FIFO_DEPTH
+                self._data_bytes.extend(red.to_bytes(3, 'big') + ir.to_bytes(3, 'big'))
+            return self._data_bytes.popleft()
+        return self.registers[reg]
+
+    def _read(self, reg, length):
+        self._fill_fifo()
+        data = []
+        for _ in range(length):
+            data.append(self._read_register(reg))
+            # the address pointer does not move while reading FIFO_DATA
+            if reg != REG_FIFO_DATA:
+                reg = (reg + 1) & 0xFF
+        return data
+
+    def _write(self, reg, values):
+        for value in values:
+            if reg == REG_MODE_CONFIG and value & 0x40:
+                # reset
+                self.registers = bytearray(256)
+                value = 0
+            if reg in (REG_FIFO_WR_PTR, REG_FIFO_RD_PTR):
+                self._fifo.clear()
+                self._data_bytes.clear()
+            self.registers[reg] = value
+            reg = (reg + 1) & 0xFF
+
+    # --- SMBus interface ---
+
+    def read_byte_data(self, i2c_addr, register):
+        self._transaction(1)
+        return self._read(register, 1)[0]
+
+    def write_byte_data(self, i2c_addr, register, value):
+        self._transaction(1)
+        self._write(register, [value])
+
+    def read_i2c_block_data(self, i2c_addr, register, length):
+        self._transaction(length)
+        return self._read(register, length)
+
+    def write_i2c_block_data(self, i2c_addr, register, data):
+        self._transaction(len(data))
+        self._write(register, list(data))
+
+    def i2c_rdwr(self, *i2c_msgs):
+        """
+        Combined transaction of smbus2.i2c_msg messages:
+        a write that sets the register, optionally followed by a read.
+        """
+        reg = None
+        nbytes = 0
+        for msg in i2c_msgs:
+            if msg.flags & 0x0001:  # I2C_M_RD
+                data = bytes(self._read(reg, msg.len))
+                ctypes.memmove(msg.buf, data, msg.len)
+                nbytes += msg.len
+            else:
+                values = list(msg)
+                reg = values[0]
+                if len(values) > 1:
+                    self._write(reg, values[1:])
+                nbytes += len(values)
+        self._transaction(nbytes)
+
+
+class FakeInterruptPin():
+    """
+    Simulated MAX30102 INT pin for a FakeSMBus, with the same wait(timeout)
+    as max30102.GPIOInterrupt. Waiting moves the bus clock forward one
+    sample period at a time.
+    """
+    def __init__(self, bus):
+        self.bus = bus
+        self.waits = 0
+
+    def wait(self, timeout):
+        self.waits += 1
+        deadline = self.bus.time + timeout
+        while not self.bus.interrupt_asserted():
+            if self.bus.time >= deadline or self.bus.exhausted:
+                return False
+            self.bus.sleep(min(1.0 / self.bus.sample_rate, deadline - self.bus.time))
+        return True
@@ -4,13 +4,20 @@ sys.path.append(os.path.dirname(__file__))
 
 import max30102
 import hrcalc
-import time
+import ppg_backends
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
 
 from logger import CSVLogger 
+import sensor_backend
+from shm_ring import SampleRing
+from binlog import BinaryLogger
+import metrics
 
 import json
+import time
+import asyncio
+import numpy as np
 
 # Set abnormal threshold values
 hr_high = 160
@@ -20,72 +27,227 @@ spo2_low = 90
 # Set time between alerts to prevent overcommunication
 time_between_alerts = 120
 
-sensor = max30102.MAX30102()
+# New samples between two HR/SpO2 estimates (25 samples = 1 second),
+# each estimate covers the latest 100 samples
+hop_size = 25
+
+# Raw samples are published to this shared-memory ring (see shm_ring.py)
+# when main.py has created it
+PPG_RING = 'slumber_ppg'
+PPG_DTYPE = [('time', 'f8'), ('red', 'u4'), ('ir', 'u4')]
+PPG_RING_CAPACITY = 60 * max30102.SAMPLE_RATE  # 1 minute
+
+# Raw samples are also kept in a binary log (see binlog.py)
+LOG_RAW = True
+RAW_LOG_DIR = 'logs/raw/HR_SpO2'
+
+# BCM GPIO wired to the MAX30102 INT pin to wait for the FIFO almost-full
+# interrupt instead of sleeping between reads, None if it is not connected
+interrupt_pin = None
+
+
+def open_sensor(kind=None, clock=None):
+    """
+    Create the pulse oximeter for the backend `kind` (default: SLUMBER_BACKEND),
+    see sensor_backend.py.
+    """
+    kind = kind or sensor_backend.backend_kind()
+    clock = clock or sensor_backend.make_clock(kind)
+
+    if kind == sensor_backend.SYNTHETIC:
+        return ppg_backends.SyntheticPulseOximeter(clock)
+    if kind == sensor_backend.REPLAY:
+        return ppg_backends.ReplayPulseOximeter(sensor_backend.replay_path(ppg_backends.REPLAY_FILE), clock)
+
+    interrupt = max30102.GPIOInterrupt(interrupt_pin) if interrupt_pin is not None else None
+    return max30102.MAX30102(sleep=clock.sleep, interrupt=interrupt)
+
+
+# Opened on first use by get_sensor(), once per process
+_sensor = None
+_clock = None
+_sensor_pid = None
+
+def get_sensor():
+    """
+    The (sensor, clock) of this process, opened on the first call,
+    so importing this module does not open the I2C bus or reset the device.
+    """
+    global _sensor, _clock, _sensor_pid
+    if _sensor is None or _sensor_pid != os.getpid():
+        _clock = sensor_backend.make_clock()
+        _sensor = open_sensor(clock=_clock)
+        _sensor_pid = os.getpid()
+    return _sensor, _clock
+
+
+class HrSpo2Monitor():
+    """
+    What the collector does with the samples and estimates: publishes the
+    raw samples (ring, binary log) and valid estimates (BLE vitals), and averages every
+    10 valid estimates into a logged value, which is checked against the
+    thresholds. Shared by collect_hr_spo2_data and its asyncio version.
+    """
+    def __init__(self, clock, queue=None, logger=None, ring=None, verbose=False, raw_log=None):
+        self.clock = clock
+        self.raw_log = raw_log
+        self.queue = queue
+        self.logger = logger
+        self.ring = ring
+        self.verbose = verbose
+
+        self.last_alert_time = 0
+        self.recent_hrs = []
+        self.recent_spo2s = []
+
+        self.records = np.zeros(hop_size, dtype=PPG_DTYPE)
+        # sample times going back from the newest sample
+        self.sample_ages = np.arange(hop_size - 1, -1, -1) / float(max30102.SAMPLE_RATE)
+
+    def add_samples(self, red, ir):
+        """
+        Handle hop_size new samples from the FIFO.
+        """
+        if self.ring is not None or self.raw_log is not None:
+            self.records['time'] = self.clock.time() - self.sample_ages
+            self.records['red'] = red
+            self.records['ir'] = ir
+            if self.ring is not None:
+                self.ring.write(self.records)
+            if self.raw_log is not None:
+                self.raw_log.write(self.records)
+
+    def add_estimate(self, result):
+        """
+        Handle an estimate of hrcalc.HrSpo2Stream.update() (None if there is none yet).
+        """
+        if result is None:
+            return
+        hr, hr_is_valid, spo2, spo2_is_valid = result
+        queue = self.queue
+
+        metrics.HR_ESTIMATES.inc()
+        if not hr_is_valid:
+            metrics.HR_INVALID.inc()
+        if not spo2_is_valid:
+            metrics.SPO2_INVALID.inc()
 
-def collect_hr_spo2_data(queue=None, verbose=False):
-    last_alert_time = 0
-    recent_hrs = []
-    recent_spo2s = []
+        current_time = self.clock.time()
 
-    logger = CSVLogger(log_dir='logs/HR_SpO2', field_name='Value')
+        if hr_is_valid and spo2_is_valid:
+            self.recent_hrs.append(hr)
+            self.recent_spo2s.append(spo2)
+
+            # Live values for the BLE vitals stream
+            if queue:
+                queue.put({'sensor': 'heart', 'value': {'hr': round(hr, 1), 'spo2': round(spo2, 1)}, 'alert': None})
+        else:
+            if self.verbose:
+                print("Poor reading")
+
+        # Average and evaluate every 10 readings
+        if len(self.recent_hrs) == 10:
+            avg_hr = sum(self.recent_hrs) / len(self.recent_hrs)
+            avg_spo2 = sum(self.recent_spo2s) / len(self.recent_spo2s)
+            self.recent_hrs = []
+            self.recent_spo2s = []
+
+            if self.verbose:
+                print(f"HR: {avg_hr:.0f} BPM")
+                print(f"SpO2: {avg_spo2:.0f}%")
+
+            if self.logger:
+                self.logger.log(json.dumps({'hr': round(avg_hr, 1), 'spo2': round(avg_spo2, 1)}))
+
+            alert = None
+            if avg_hr > hr_high:
+                alert = f"High heart rate of {avg_hr:.0f} BPM!"
+            elif avg_hr < hr_low:
+                alert = f"Low heart rate of {avg_hr:.0f} BPM!"
+            elif avg_spo2 < spo2_low:
+                alert = f"Low blood oxygen level of {avg_spo2:.0f}%"
+
+            if alert and current_time - self.last_alert_time >= time_between_alerts:
+                if queue:
+                    message = {
+                        'sensor': 'heart',
+                        'value': {
+                            'hr': round(avg_hr, 1),
+                            'spo2': round(avg_spo2, 1)
+                        },
+                        'alert': alert
+                    }
+                    queue.put(message)
+
+                self.last_alert_time = current_time
+
+
+def collect_hr_spo2_data(queue=None, verbose=False, heartbeat=None):
+    metrics.attach()
+    sensor, clock = get_sensor()
+    logger = CSVLogger(log_dir='logs/HR_SpO2', field_name='Value', clock=clock)
+    estimator = hrcalc.HrSpo2Stream(hop_size=hop_size)
+    raw_log = BinaryLogger(RAW_LOG_DIR, PPG_DTYPE, clock=clock) if LOG_RAW else None
+    monitor = HrSpo2Monitor(clock, queue, logger, SampleRing.attach(PPG_RING, PPG_DTYPE), verbose, raw_log)
 
     try:
 
         while True:
             # Read data
-            red, ir = sensor.read_sequential()
-            # Calculate HR and SpO2
-            hr, hr_is_valid, spo2, spo2_is_valid = hrcalc.calc_hr_and_spo2(ir, red)
-
-            current_time = time.time()
-
-            if hr_is_valid and spo2_is_valid:
-                recent_hrs.append(hr)
-                recent_spo2s.append(spo2)
-            else:
-                if verbose:
-                    print("Poor reading")
-
-            # Average and evaluate every 10 readings
-            if len(recent_hrs) == 10:
-                avg_hr = sum(recent_hrs) / len(recent_hrs)
-                avg_spo2 = sum(recent_spo2s) / len(recent_spo2s)
-                recent_hrs = []
-                recent_spo2s = []
-
-                if verbose:
-                    print(f"HR: {avg_hr:.0f} BPM")
-                    print(f"SpO2: {avg_spo2:.0f}%")
-                
-                if logger:
-                    logger.log(json.dumps({'hr': round(avg_hr, 1), 'spo2': round(avg_spo2, 1)}))
-                
-                alert = None
-                if avg_hr > hr_high:
-                    alert = f"High heart rate of {avg_hr:.0f} BPM!"
-                elif avg_hr < hr_low:
-                    alert = f"Low heart rate of {avg_hr:.0f} BPM!"
-                elif avg_spo2 < spo2_low:
-                    alert = f"Low blood oxygen level of {avg_spo2:.0f}%"
-
-                if alert and current_time - last_alert_time >= time_between_alerts:
-                    if queue:
-                        message = {
-                            'sensor': 'heart',
-                            'value': {
-                                'hr': round(avg_hr, 1),
-                                'spo2': round(avg_spo2, 1)
-                            },
-                            'alert': alert
-                        }
-                        queue.put(message)
-
-                    last_alert_time = current_time
-
-            time.sleep(1)
+            start = time.perf_counter()
+            red, ir = sensor.read_sequential(hop_size)
+            read_done = time.perf_counter()
+            metrics.PPG_READ_SECONDS.observe(read_done - start)
+            metrics.PPG_SAMPLES.inc(len(red))
+            if heartbeat:
+                heartbeat.beat()
+            monitor.add_samples(red, ir)
+            # Update HR and SpO2 over the sliding window
+            result = estimator.update(red, ir)
+            metrics.HR_ESTIMATE_SECONDS.observe(time.perf_counter() - read_done)
+            monitor.add_estimate(result)
+
+    except EOFError:
+        pass  # end of replayed data
     
     finally:
         logger.close()
+        if raw_log:
+            raw_log.close()
+
+
+async def collect_hr_spo2_data_async(queue=None, verbose=False, io_pool=None, compute_pool=None):
+    """
+    collect_hr_spo2_data as a coroutine for async_runtime.py: FIFO reads
+    run in `io_pool` and the HR/SpO2 estimates in `compute_pool`.
+    """
+    metrics.attach()
+    loop = asyncio.get_running_loop()
+    sensor, clock = get_sensor()
+    logger = CSVLogger(log_dir='logs/HR_SpO2', field_name='Value', clock=clock)
+    estimator = hrcalc.HrSpo2Stream(hop_size=hop_size)
+    raw_log = BinaryLogger(RAW_LOG_DIR, PPG_DTYPE, clock=clock) if LOG_RAW else None
+    monitor = HrSpo2Monitor(clock, queue, logger, SampleRing.attach(PPG_RING, PPG_DTYPE), verbose, raw_log)
+
+    try:
+        while True:
+            start = time.perf_counter()
+            red, ir = await loop.run_in_executor(io_pool, sensor.read_sequential, hop_size)
+            read_done = time.perf_counter()
+            metrics.PPG_READ_SECONDS.observe(read_done - start)
+            metrics.PPG_SAMPLES.inc(len(red))
+            monitor.add_samples(red, ir)
+            result = await loop.run_in_executor(compute_pool, estimator.update, red, ir)
+            metrics.HR_ESTIMATE_SECONDS.observe(time.perf_counter() - read_done)
+            monitor.add_estimate(result)
+
+    except EOFError:
+        pass  # end of replayed data
+
+    finally:
+        logger.close()
+        if raw_log:
+            raw_log.close()
 
 
 # Test function for unit testing
@@ -8,6 +8,12 @@ MA_SIZE = 4
 # sampling frequency * 4 (in algorithm.h)
 BUFFER_SIZE = 100
 
+# arguments passed to find_peaks (in algorithm.h)
+MIN_PEAK_DIST = 4
+MAX_NUM_PEAKS = 15
+# at most this many beat-to-beat ratios go into the SpO2 median
+MAX_RATIO_COUNT = 5
+
 
 # this assumes ir_data and red_data as np.array
 def calc_hr_and_spo2(ir_data, red_data):
@@ -15,90 +21,322 @@ def calc_hr_and_spo2(ir_data, red_data):
     By detecting  peaks of PPG cycle and corresponding AC/DC
     of red/infra-red signal, the an_ratio for the SPO2 is computed.
     """
+    ir_data = np.asarray(ir_data, dtype=np.int64)
+    red_data = np.asarray(red_data, dtype=np.int64)
+
+    x = _inverted_moving_average(ir_data)
+    n_th = _valley_threshold(x)
+    ir_valley_locs, n_peaks = find_peaks(x, BUFFER_SIZE, n_th, MIN_PEAK_DIST, MAX_NUM_PEAKS)
+
+    hr, hr_valid = _hr_from_valleys(ir_valley_locs, n_peaks)
+    spo2, spo2_valid = _spo2_from_valleys(ir_data, red_data, ir_valley_locs, n_peaks)
+
+    return hr, hr_valid, spo2, spo2_valid
+
+
+def calc_hr_and_spo2_batch(ir_2d, red_2d):
+    """
+    Run calc_hr_and_spo2 over every row of ir_2d / red_2d (one window per row).
+    Returns four arrays (hr, hr_valid, spo2, spo2_valid) with one entry per row,
+    each entry identical to what calc_hr_and_spo2 returns for that row.
+    """
+    ir_2d = np.atleast_2d(np.asarray(ir_2d, dtype=np.int64))
+    red_2d = np.atleast_2d(np.asarray(red_2d, dtype=np.int64))
+    if ir_2d.shape != red_2d.shape:
+        raise ValueError("ir_2d and red_2d must have the same shape")
+
+    n_windows = ir_2d.shape[0]
+    hr = np.full(n_windows, -999, dtype=np.int64)
+    hr_valid = np.zeros(n_windows, dtype=bool)
+    spo2 = np.full(n_windows, -999.0)
+    spo2_valid = np.zeros(n_windows, dtype=bool)
+
+    # moving average, threshold and peak candidates are done for all windows at once
+    x = _inverted_moving_average(ir_2d)
+    n_th = _valley_threshold(x)
+    candidates = _peak_candidates(x, BUFFER_SIZE, n_th, MAX_NUM_PEAKS)
+
+    # what is left per window works on at most MAX_NUM_PEAKS valleys
+    for w in range(n_windows):
+        ir_valley_locs, n_peaks = remove_close_peaks(
+            len(candidates[w]), candidates[w], x[w], MIN_PEAK_DIST)
+        hr[w], hr_valid[w] = _hr_from_valleys(ir_valley_locs, n_peaks)
+        spo2[w], spo2_valid[w] = _spo2_from_valleys(ir_2d[w], red_2d[w], ir_valley_locs, n_peaks)
+
+    return hr, hr_valid, spo2, spo2_valid
+
+
+class HrSpo2Stream():
+    """
+    Sliding-window HR/SpO2 estimator.
+
+    Samples are fed in as they come out of the FIFO, and every `hop_size` new
+    samples the estimate for the latest BUFFER_SIZE samples is produced. Each
+    estimate is identical to calc_hr_and_spo2 on that window, but the DC sum
+    and the moving-average sums come from a running prefix sum, and the
+    beat-to-beat ratios of valley pairs seen in earlier windows are reused.
+    """
+    def __init__(self, hop_size=SAMPLE_FREQ):
+        if not 0 < hop_size <= BUFFER_SIZE:
+            raise ValueError(f"hop_size must be in 1..{BUFFER_SIZE}")
+        self.hop_size = hop_size
+        self.reset()
+
+    def reset(self):
+        """
+        Drop all buffered samples, e.g. after the finger was lifted.
+        """
+        self._ir = _Ring(BUFFER_SIZE)
+        self._red = _Ring(BUFFER_SIZE)
+        # _ir_prefix.view()[k] is the sum of every ir sample before the k-th sample of the window
+        self._ir_prefix = _Ring(BUFFER_SIZE + 1)
+        self._ir_prefix.extend([0])
+        self._ir_total = 0
+        self._since_estimate = 0
+        # (first valley, second valley) in absolute sample numbers -> beat ratio
+        self._beat_ratios = {}
+
+    @property
+    def n_samples(self):
+        return self._ir.count
+
+    def update(self, red, ir):
+        """
+        Add new samples (sequences, as returned by MAX30102.read_sequential).
+        Returns (hr, hr_valid, spo2, spo2_valid) for the latest window once
+        `hop_size` samples have arrived since the previous estimate, else None.
+        If several hops arrived at once, only the newest window is evaluated.
+        """
+        red = np.asarray(red, dtype=np.int64)
+        ir = np.asarray(ir, dtype=np.int64)
+        if red.shape != ir.shape:
+            raise ValueError("red and ir must have the same length")
+        if ir.shape[0] == 0:
+            return None
+
+        self._red.extend(red)
+        self._ir.extend(ir)
+        prefix = self._ir_total + np.cumsum(ir)
+        self._ir_total = int(prefix[-1])
+        self._ir_prefix.extend(prefix)
+
+        self._since_estimate += ir.shape[0]
+        if self._ir.count < BUFFER_SIZE or self._since_estimate < self.hop_size:
+            return None
+        self._since_estimate %= self.hop_size
+
+        return self._estimate()
+
+    def _estimate(self):
+        ir_data = self._ir.view()
+        red_data = self._red.view()
+        prefix = self._ir_prefix.view()
+        window_start = self._ir.count - BUFFER_SIZE
+
+        # same as _inverted_moving_average, with every sum taken from the prefix sums
+        ir_mean = int((prefix[-1] - prefix[0]) / BUFFER_SIZE)
+        x = ir_mean - ir_data
+        n_avg = BUFFER_SIZE - MA_SIZE
+        x[:n_avg] = (MA_SIZE * ir_mean - (prefix[MA_SIZE:MA_SIZE + n_avg] - prefix[:n_avg])) / MA_SIZE
+
+        n_th = _valley_threshold(x)
+        ir_valley_locs, n_peaks = find_peaks(x, BUFFER_SIZE, n_th, MIN_PEAK_DIST, MAX_NUM_PEAKS)
+        hr, hr_valid = _hr_from_valleys(ir_valley_locs, n_peaks)
+
+        # forget ratios of beats that have left the window
+        self._beat_ratios = {pair: r for pair, r in self._beat_ratios.items() if pair[0] >= window_start}
+
+        pairs = [(window_start + a, window_start + b) for a, b in zip(ir_valley_locs[:n_peaks - 1], ir_valley_locs[1:n_peaks])]
+        missing = [k for k, pair in enumerate(pairs) if pair not in self._beat_ratios]
+        if missing:
+            # normally only the newest valley pair is missing, which is cheaper in plain Python
+            ir_list = ir_data.tolist()
+            red_list = red_data.tolist()
+            for k in missing:
+                a, b = ir_valley_locs[k], ir_valley_locs[k + 1]
+                self._beat_ratios[pairs[k]] = _beat_ratio(ir_list, red_list, a, b)
+
+        spo2, spo2_valid = _spo2_from_ratios([self._beat_ratios[pair] for pair in pairs])
+
+        return hr, hr_valid, spo2, spo2_valid
+
+
+class _Ring():
+    """
+    Fixed-size ring buffer of int64 that keeps every value twice,
+    so the newest `size` values are always one contiguous view.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self._buf = np.zeros(2 * size, dtype=np.int64)
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=np.int64)
+        skipped = max(values.shape[0] - self.size, 0)
+        values = values[skipped:]
+        self.count += skipped
+
+        # write in at most two pieces, wrapping around at the end of the ring
+        while values.shape[0] > 0:
+            pos = self.count % self.size
+            n = min(values.shape[0], self.size - pos)
+            self._buf[pos:pos + n] = values[:n]
+            self._buf[pos + self.size:pos + self.size + n] = values[:n]
+            self.count += n
+            values = values[n:]
+
+    def view(self):
+        start = self.count % self.size
+        return self._buf[start:start + self.size]
+
+
+def _inverted_moving_average(ir_data):
+    """
+    Remove the DC mean and invert the signal (this lets peak detecter detect valley),
+    then apply the MA_SIZE point moving average along the last axis.
+    """
     # get dc mean
-    ir_mean = int(np.mean(ir_data))
+    ir_mean = np.mean(ir_data, axis=-1, keepdims=True).astype(np.int64)
 
     # remove DC mean and inver signal
-    # this lets peak detecter detect valley
-    x = -1 * (np.array(ir_data) - ir_mean)
+    x = -1 * (ir_data - ir_mean)
 
     # 4 point moving average
-    # x is np.array with int values, so automatically casted to int
-    for i in range(x.shape[0] - MA_SIZE):
-        x[i] = np.sum(x[i:i+MA_SIZE]) / MA_SIZE
-
-    # calculate threshold
-    n_th = int(np.mean(x))
-    n_th = 30 if n_th < 30 else n_th  # min allowed
-    n_th = 60 if n_th > 60 else n_th  # max allowed
-
-    ir_valley_locs, n_peaks = find_peaks(x, BUFFER_SIZE, n_th, 4, 15)
-    # print(ir_valley_locs[:n_peaks], ",", end="")
-    peak_interval_sum = 0
+    # the original loop updates x in place, but x[i] only ever reads x[i:i+MA_SIZE],
+    # which has not been overwritten yet, so every window sums the unfiltered values.
+    # the last MA_SIZE samples are left untouched, as in algorithm.h
+    n_avg = x.shape[-1] - MA_SIZE
+    if n_avg > 0:
+        window_sum = x[..., 0:n_avg].copy()
+        for k in range(1, MA_SIZE):
+            window_sum += x[..., k:k + n_avg]
+        # x is np.array with int values, so automatically casted to int
+        x[..., :n_avg] = window_sum / MA_SIZE
+
+    return x
+
+
+def _valley_threshold(x):
+    """
+    Mean of the filtered signal, clamped to [30, 60].
+    """
+    if x.ndim == 1:
+        n_th = int(np.mean(x))
+        n_th = 30 if n_th < 30 else n_th  # min allowed
+        n_th = 60 if n_th > 60 else n_th  # max allowed
+        return n_th
+    return np.clip(np.mean(x, axis=-1).astype(np.int64), 30, 60)
+
+
+def _hr_from_valleys(ir_valley_locs, n_peaks):
+    """
+    Heart rate from the mean distance between consecutive valleys.
+    """
     if n_peaks >= 2:
-        for i in range(1, n_peaks):
-            peak_interval_sum += (ir_valley_locs[i] - ir_valley_locs[i-1])
+        # the sum of consecutive intervals telescopes to last - first
+        peak_interval_sum = ir_valley_locs[n_peaks - 1] - ir_valley_locs[0]
         peak_interval_sum = int(peak_interval_sum / (n_peaks - 1))
         hr = int(SAMPLE_FREQ * 60 / peak_interval_sum)
-        hr_valid = True
-    else:
-        hr = -999  # unable to calculate because # of peaks are too small
-        hr_valid = False
+        return hr, True
 
-    # ---------spo2---------
+    return -999, False  # unable to calculate because # of peaks are too small
 
+
+def _spo2_from_valleys(ir_data, red_data, ir_valley_locs, n_peaks):
+    """
+    Find ir-red DC and ir-red AC between each pair of valleys
+    and turn the median AC/DC ratio into SpO2.
+    """
     # find precise min near ir_valley_locs (???)
-    exact_ir_valley_locs_count = n_peaks
+    locs = np.asarray(ir_valley_locs[:n_peaks], dtype=np.int64)
+
+    # FIXME: needed??
+    if np.any(locs > BUFFER_SIZE):
+        return -999, False  # do not use SPO2 since valley loc is out of range
+
+    return _spo2_from_ratios(_beat_ratios(ir_data, red_data, locs))
+
+
+def _beat_ratios(ir_data, red_data, locs):
+    """
+    AC/DC ratio between red and ir for each pair of consecutive valleys in locs,
+    or -1 where the pair can not be used. Each ratio only depends on the raw
+    samples between its two valleys.
+    """
+    if locs.shape[0] < 2:
+        return []
+
+    start = locs[:-1]
+    end = locs[1:]
+    width = end - start
 
-    # find ir-red DC and ir-red AC for SPO2 calibration ratio
     # find AC/DC maximum of raw
+    # index of the first maximum of each [start, end) segment,
+    # computed for every segment between the first and last valley at once
+    ir_dc_max_index = _segment_argmax(ir_data, locs)
+    red_dc_max_index = _segment_argmax(red_data, locs)
+    ir_dc_max = ir_data[ir_dc_max_index]
+    red_dc_max = red_data[red_dc_max_index]
 
-    # FIXME: needed??
-    for i in range(exact_ir_valley_locs_count):
-        if ir_valley_locs[i] > BUFFER_SIZE:
-            spo2 = -999  # do not use SPO2 since valley loc is out of range
-            spo2_valid = False
-            return hr, hr_valid, spo2, spo2_valid
-
-    i_ratio_count = 0
-    ratio = []
-
-    # find max between two valley locations
-    # and use ratio between AC component of Ir and Red DC component of Ir and Red for SpO2
-    red_dc_max_index = -1
-    ir_dc_max_index = -1
-    for k in range(exact_ir_valley_locs_count-1):
-        red_dc_max = -16777216
-        ir_dc_max = -16777216
-        if ir_valley_locs[k+1] - ir_valley_locs[k] > 3:
-            for i in range(ir_valley_locs[k], ir_valley_locs[k+1]):
-                if ir_data[i] > ir_dc_max:
-                    ir_dc_max = ir_data[i]
-                    ir_dc_max_index = i
-                if red_data[i] > red_dc_max:
-                    red_dc_max = red_data[i]
-                    red_dc_max_index = i
-
-            red_ac = int((red_data[ir_valley_locs[k+1]] - red_data[ir_valley_locs[k]]) * (red_dc_max_index - ir_valley_locs[k]))
-            red_ac = red_data[ir_valley_locs[k]] + int(red_ac / (ir_valley_locs[k+1] - ir_valley_locs[k]))
-            red_ac = red_data[red_dc_max_index] - red_ac  # subtract linear DC components from raw
-
-            ir_ac = int((ir_data[ir_valley_locs[k+1]] - ir_data[ir_valley_locs[k]]) * (ir_dc_max_index - ir_valley_locs[k]))
-            ir_ac = ir_data[ir_valley_locs[k]] + int(ir_ac / (ir_valley_locs[k+1] - ir_valley_locs[k]))
-            ir_ac = ir_data[ir_dc_max_index] - ir_ac  # subtract linear DC components from raw
-
-            nume = red_ac * ir_dc_max
-            denom = ir_ac * red_dc_max
-            if (denom > 0 and i_ratio_count < 5) and nume != 0:
-                # original cpp implementation uses overflow intentionally.
-                # but at 64-bit OS, Pyhthon 3.X uses 64-bit int and nume*100/denom does not trigger overflow
-                # so using bit operation ( &0xffffffff ) is needed
-                ratio.append(int(((nume * 100) & 0xffffffff) / denom))
-                i_ratio_count += 1
+    red_ac = (red_data[end] - red_data[start]) * (red_dc_max_index - start)
+    red_ac = red_data[start] + (red_ac / width).astype(np.int64)
+    red_ac = red_dc_max - red_ac  # subtract linear DC components from raw
+
+    ir_ac = (ir_data[end] - ir_data[start]) * (ir_dc_max_index - start)
+    ir_ac = ir_data[start] + (ir_ac / width).astype(np.int64)
+    ir_ac = ir_dc_max - ir_ac  # subtract linear DC components from raw
+
+    nume = red_ac * ir_dc_max
+    denom = ir_ac * red_dc_max
+    # segments of 3 samples or less are skipped
+    usable = (width > 3) & (denom > 0) & (nume != 0)
+
+    # original cpp implementation uses overflow intentionally.
+    # but at 64-bit OS, Pyhthon 3.X uses 64-bit int and nume*100/denom does not trigger overflow
+    # so using bit operation ( &0xffffffff ) is needed
+    ratio = (((nume * 100) & 0xffffffff) / np.where(usable, denom, 1)).astype(np.int64)
+
+    return np.where(usable, ratio, -1).tolist()
+
+
+def _beat_ratio(ir_data, red_data, a, b):
+    """
+    Scalar version of _beat_ratios for the single valley pair (a, b),
+    for data given as lists of ints.
+    """
+    if b - a <= 3:
+        return -1
+
+    ir_dc_max_index = max(range(a, b), key=ir_data.__getitem__)
+    red_dc_max_index = max(range(a, b), key=red_data.__getitem__)
+    ir_dc_max = ir_data[ir_dc_max_index]
+    red_dc_max = red_data[red_dc_max_index]
+
+    red_ac = int((red_data[b] - red_data[a]) * (red_dc_max_index - a))
+    red_ac = red_data[a] + int(red_ac / (b - a))
+    red_ac = red_dc_max - red_ac  # subtract linear DC components from raw
+
+    ir_ac = int((ir_data[b] - ir_data[a]) * (ir_dc_max_index - a))
+    ir_ac = ir_data[a] + int(ir_ac / (b - a))
+    ir_ac = ir_dc_max - ir_ac  # subtract linear DC components from raw
+
+    nume = red_ac * ir_dc_max
+    denom = ir_ac * red_dc_max
+    if denom > 0 and nume != 0:
+        return int(((nume * 100) & 0xffffffff) / denom)
+    return -1
+
+
+def _spo2_from_ratios(beat_ratios):
+    """
+    SpO2 from the median of the first MAX_RATIO_COUNT usable beat ratios.
+    """
+    ratio = [r for r in beat_ratios if r >= 0][:MAX_RATIO_COUNT]
 
     # choose median value since PPG signal may vary from beat to beat
     ratio = sorted(ratio)  # sort to ascending order
-    mid_index = int(i_ratio_count / 2)
+    mid_index = int(len(ratio) / 2)
 
     ratio_ave = 0
     if mid_index > 1:
@@ -112,12 +350,24 @@ def calc_hr_and_spo2(ir_data, red_data):
     if ratio_ave > 2 and ratio_ave < 184:
         # -45.060 * ratioAverage * ratioAverage / 10000 + 30.354 * ratioAverage / 100 + 94.845
         spo2 = -45.060 * (ratio_ave**2) / 10000.0 + 30.054 * ratio_ave / 100.0 + 94.845
-        spo2_valid = True
-    else:
-        spo2 = -999
-        spo2_valid = False
+        return spo2, True
 
-    return hr, hr_valid, spo2, spo2_valid
+    return -999, False
+
+
+def _segment_argmax(data, bounds):
+    """
+    For each segment data[bounds[k]:bounds[k+1]], return the index (into data)
+    of its first maximum. bounds must be strictly increasing.
+    """
+    seg = data[bounds[0]:bounds[-1]]
+    offsets = bounds[:-1] - bounds[0]
+    seg_max = np.maximum.reduceat(seg, offsets)
+
+    # position of every sample equal to its segment max, everything else pushed past the end
+    at_max = seg == np.repeat(seg_max, np.diff(bounds))
+    positions = np.where(at_max, np.arange(seg.shape[0]), seg.shape[0])
+    return np.minimum.reduceat(positions, offsets) + bounds[0]
 
 
 def find_peaks(x, size, min_height, min_dist, max_num):
@@ -136,58 +386,67 @@ def find_peaks_above_min_height(x, size, min_height, max_num):
     """
     Find all peaks above MIN_HEIGHT
     """
+    ir_valley_locs = _peak_candidates(np.asarray(x)[np.newaxis], size, min_height, max_num)[0]
+    return ir_valley_locs, len(ir_valley_locs)
 
-    i = 0
-    n_peaks = 0
-    ir_valley_locs = []  # [0 for i in range(max_num)]
-    while i < size - 1:
-        if x[i] > min_height and x[i] > x[i-1]:  # find the left edge of potential peaks
-            n_width = 1
-            # original condition i+n_width < size may cause IndexError
-            # so I changed the condition to i+n_width < size - 1
-            while i + n_width < size - 1 and x[i] == x[i+n_width]:  # find flat peaks
-                n_width += 1
-            if x[i] > x[i+n_width] and n_peaks < max_num:  # find the right edge of peaks
-                # ir_valley_locs[n_peaks] = i
-                ir_valley_locs.append(i)
-                n_peaks += 1  # original uses post increment
-                i += n_width + 1
-            else:
-                i += n_width
-        else:
-            i += 1
 
-    return ir_valley_locs, n_peaks
+def _peak_candidates(x, size, min_height, max_num):
+    """
+    Vectorized form of the algorithm.h peak scan over the rows of a 2-D array.
+    Returns one list of peak locations (first max_num, ascending) per row.
+
+    The scan moves i forward and, at each left edge (x[i] > x[i-1], which at
+    i == 0 wraps to the last sample), skips over the flat top. Positions it skips
+    can never be left edges themselves, so testing every i in [0, size - 1) gives
+    the same peaks. The flat top ends at the first change after i, capped at size - 1.
+    """
+    min_height = np.asarray(min_height).reshape(-1, 1)
+
+    value = x[:, 0:size - 1]
+    left = x[:, np.arange(-1, size - 2)]
+    right = x[:, 1:size]
+
+    is_edge = (value > min_height) & (value > left)
+    is_peak = is_edge & (value > right)
+
+    flat = is_edge & (value == right)
+    if flat.any():
+        # flat tops compare against the first sample after the run that differs,
+        # i.e. x at the first r > i with x[r] != x[r-1], or size - 1 if there is none
+        change = np.where(x[:, 1:size] != x[:, 0:size - 1], np.arange(1, size), size - 1)
+        next_change = np.minimum.accumulate(change[:, ::-1], axis=1)[:, ::-1]
+        right = x[np.arange(x.shape[0])[:, np.newaxis], next_change]
+        is_peak |= flat & (value > right)
+
+    # only the first max_num peaks are recorded
+    is_peak &= np.cumsum(is_peak, axis=1) <= max_num
+
+    return [np.flatnonzero(row).tolist() for row in is_peak]
 
 
 def remove_close_peaks(n_peaks, ir_valley_locs, x, min_dist):
     """
     Remove peaks separated by less than MIN_DISTANCE
     """
+    locs = np.asarray(ir_valley_locs[:n_peaks], dtype=np.int64)
+    if locs.shape[0] == 0:
+        return [], 0
 
     # should be equal to maxim_sort_indices_descend
-    # order peaks from large to small
-    # should ignore index:0
-    sorted_indices = sorted(ir_valley_locs, key=lambda i: x[i])
-    sorted_indices.reverse()
-
-    # this "for" loop expression does not check finish condition
-    # for i in range(-1, n_peaks):
-    i = -1
-    while i < n_peaks:
-        old_n_peaks = n_peaks
-        n_peaks = i + 1
-        # this "for" loop expression does not check finish condition
-        # for j in (i + 1, old_n_peaks):
-        j = i + 1
-        while j < old_n_peaks:
-            n_dist = (sorted_indices[j] - sorted_indices[i]) if i != -1 else (sorted_indices[j] + 1)  # lag-zero peak of autocorr is at index -1
-            if n_dist > min_dist or n_dist < -1 * min_dist:
-                sorted_indices[n_peaks] = sorted_indices[j]
-                n_peaks += 1  # original uses post increment
-            j += 1
-        i += 1
-
-    sorted_indices[:n_peaks] = sorted(sorted_indices[:n_peaks])
-
-    return sorted_indices, n_peaks
+    # order peaks from large to small, ties broken by the later location first
+    # (stable sort followed by reverse)
+    sorted_indices = locs[np.lexsort((locs, np.asarray(x)[locs]))[::-1]]
+
+    # the first pass measures against the lag-zero peak of autocorr at index -1,
+    # which drops every peak at location < min_dist
+    keep = sorted_indices + 1 > min_dist
+
+    # then, from the largest peak down, drop every smaller peak that is too close
+    too_close = np.abs(sorted_indices[:, np.newaxis] - sorted_indices[np.newaxis, :]) <= min_dist
+    for i in range(sorted_indices.shape[0]):
+        if keep[i]:
+            keep[i + 1:] &= ~too_close[i, i + 1:]
+
+    ir_valley_locs = np.sort(sorted_indices[keep]).tolist()
+
+    return ir_valley_locs, len(ir_valley_locs)
@@ -1,7 +1,18 @@
-# this code is currently for python 2.7
-from __future__ import print_function
+# MAX30102 driver; needs python 3 (the burst FIFO reads use bytes and array.frombytes)
+from array import array
 from time import sleep
-import smbus
+import sys
+
+try:
+    from smbus2 import SMBus, i2c_msg
+except ImportError:
+    # python-smbus can not do block reads longer than 32 bytes,
+    # so burst reads fall back to 30-byte chunks (5 samples)
+    try:
+        from smbus import SMBus
+    except ImportError:
+        SMBus = None  # only an explicit bus (e.g. fake_smbus.FakeSMBus) can be used
+    i2c_msg = None
 
 # register addresses
 REG_INTR_STATUS_1 = 0x00
@@ -32,18 +43,45 @@ REG_PROX_INT_THRESH = 0x30
 REG_REV_ID = 0xFE
 REG_PART_ID = 0xFF
 
+# FIFO is 32 samples deep, 3 bytes per LED, 2 LEDs in SpO2 mode
+FIFO_DEPTH = 32
+BYTES_PER_SAMPLE = 6
+# setup(): FIFO_A_FULL = 15, so A_FULL triggers with 32 - 15 = 17 samples in the FIFO
+FIFO_A_FULL_SAMPLES = 17
+# setup(): 100 Hz sample rate averaged over 4 samples
+SAMPLE_RATE = 25
+# largest read_i2c_block_data transfer, kept to whole samples
+MAX_BLOCK_READ = 30
+
+# the RESET bit in REG_MODE_CONFIG clears itself once the reset is done
+RESET_POLL_INTERVAL = 0.001
+RESET_TIMEOUT = 1.0
+
+# typecode for unsigned 32-bit array items
+_WORD = 'I' if array('I').itemsize == 4 else 'L'
+# keeps bits [17:16] of the MSB of each 3-byte sample
+_MASK_MSB = bytes(b & 0x03 for b in range(256))
+
 
 class MAX30102():
     # by default, this assumes that the device is at 0x57 on channel 1
-    def __init__(self, channel=1, address=0x57):
+    # bus and sleep can be replaced, e.g. by fake_smbus.FakeSMBus and its sleep
+    # with `interrupt` (e.g. GPIOInterrupt), reads wait for the FIFO almost-full interrupt
+    def __init__(self, channel=1, address=0x57, bus=None, sleep=sleep, interrupt=None):
         #print("Channel: {0}, address: {1}".format(channel, address))
         self.address = address
         self.channel = channel
-        self.bus = smbus.SMBus(self.channel)
+        self.bus = bus if bus is not None else SMBus(self.channel)
+        self.sleep = sleep
+        self.interrupt = interrupt
+        self.sample_rate = SAMPLE_RATE
 
-        self.reset()
+        # samples drained from the FIFO but not returned yet
+        self._red_pending = array(_WORD)
+        self._ir_pending = array(_WORD)
 
-        sleep(1)  # wait 1 sec
+        self.reset()
+        self.wait_for_reset()
 
         # read & clear interrupt register (read 1 byte)
         reg_data = self.bus.read_i2c_block_data(self.address, REG_INTR_STATUS_1, 1)
@@ -64,6 +102,18 @@ class MAX30102():
         """
         self.bus.write_i2c_block_data(self.address, REG_MODE_CONFIG, [0x40])
 
+    def wait_for_reset(self, timeout=RESET_TIMEOUT):
+        """
+        Poll until the RESET bit clears, which takes well under a millisecond,
+        instead of sleeping a fixed second.
+        """
+        for _ in range(int(timeout / RESET_POLL_INTERVAL)):
+            mode = self.bus.read_i2c_block_data(self.address, REG_MODE_CONFIG, 1)[0]
+            if not mode & 0x40:
+                return
+            self.sleep(RESET_POLL_INTERVAL)
+        raise IOError("MAX30102 did not come out of reset")
+
     def setup(self, led_mode=0x03):
         """
         This will setup the device with the values written in sample Arduino code.
@@ -71,7 +121,9 @@ class MAX30102():
         # INTR setting
         # 0xc0 : A_FULL_EN and PPG_RDY_EN = Interrupt will be triggered when
         # fifo almost full & new fifo data ready
-        self.bus.write_i2c_block_data(self.address, REG_INTR_ENABLE_1, [0xc0])
+        # 0x80 : A_FULL_EN only, when the interrupt pin is used to wait for data
+        intr_enable = 0x80 if self.interrupt is not None else 0xc0
+        self.bus.write_i2c_block_data(self.address, REG_INTR_ENABLE_1, [intr_enable])
         self.bus.write_i2c_block_data(self.address, REG_INTR_ENABLE_2, [0x00])
 
         # FIFO_WR_PTR[4:0]
@@ -104,15 +156,23 @@ class MAX30102():
         self.bus.write_i2c_block_data(self.address, reg, value)
 
     def get_data_present(self):
-        read_ptr = self.bus.read_byte_data(self.address, REG_FIFO_RD_PTR)
-        write_ptr = self.bus.read_byte_data(self.address, REG_FIFO_WR_PTR)
+        """
+        Return the number of samples waiting in the FIFO.
+        The interrupt status, pointer and overflow registers (0x00 - 0x06)
+        are read in one transaction, which also clears the interrupts.
+        """
+        status = self.bus.read_i2c_block_data(self.address, REG_INTR_STATUS_1, REG_FIFO_RD_PTR + 1)
+        write_ptr = status[REG_FIFO_WR_PTR]
+        ovf_counter = status[REG_OVF_COUNTER]
+        read_ptr = status[REG_FIFO_RD_PTR]
         if read_ptr == write_ptr:
-            return 0
+            # equal pointers with lost samples means the FIFO is full
+            return FIFO_DEPTH if ovf_counter else 0
         else:
             num_samples = write_ptr - read_ptr
             # account for pointer wrap around
             if num_samples < 0:
-                num_samples += 32
+                num_samples += FIFO_DEPTH
             return num_samples
 
     def read_fifo(self):
@@ -135,22 +195,115 @@ class MAX30102():
 
         return red_led, ir_led
 
+    def read_fifo_burst(self, num_samples):
+        """
+        Read `num_samples` samples from the data register in one block read
+        (chunks of MAX_BLOCK_READ bytes without smbus2).
+        Returns red-led and ir-led values as two array('I').
+        """
+        length = num_samples * BYTES_PER_SAMPLE
+        if i2c_msg is not None and hasattr(self.bus, 'i2c_rdwr'):
+            write = i2c_msg.write(self.address, [REG_FIFO_DATA])
+            read = i2c_msg.read(self.address, length)
+            self.bus.i2c_rdwr(write, read)
+            d = bytes(read)
+        else:
+            d = bytearray()
+            while len(d) < length:
+                chunk = min(length - len(d), MAX_BLOCK_READ)
+                d += bytes(self.bus.read_i2c_block_data(self.address, REG_FIFO_DATA, chunk))
+
+        return decode_samples(d)
+
     def read_sequential(self, amount=100):
         """
         This function will read the red-led and ir-led `amount` times.
         This works as blocking function.
+        The FIFO is drained in bursts. In between, it waits for the
+        almost-full interrupt if there is one, otherwise it sleeps until
+        enough samples (up to the almost-full level) are waiting.
+        Samples drained beyond `amount` are returned by the next call.
         """
-        red_buf = []
-        ir_buf = []
-        count = amount
-        while count > 0:
-            num_bytes = self.get_data_present()
-            while num_bytes > 0:
-                red, ir = self.read_fifo()
+        red_buf = array(_WORD, [0]) * amount
+        ir_buf = array(_WORD, [0]) * amount
+
+        count = min(len(self._red_pending), amount)
+        red_buf[:count] = self._red_pending[:count]
+        ir_buf[:count] = self._ir_pending[:count]
+        del self._red_pending[:count]
+        del self._ir_pending[:count]
 
-                red_buf.append(red)
-                ir_buf.append(ir)
-                num_bytes -= 1
-                count -= 1
+        while count < amount:
+            # reading the status also releases the interrupt pin
+            num_samples = self.get_data_present()
+            remaining = amount - count
+            if num_samples < remaining:
+                if self.interrupt is not None:
+                    # the timeout wakes us up before the FIFO can overflow if the edge was missed
+                    self.interrupt.wait((FIFO_DEPTH - 1 - num_samples) / float(self.sample_rate))
+                    num_samples = self.get_data_present()
+                elif num_samples < min(remaining, FIFO_A_FULL_SAMPLES):
+                    self.sleep((min(remaining, FIFO_A_FULL_SAMPLES) - num_samples) / float(self.sample_rate))
+                    continue
+            if num_samples == 0:
+                continue
+
+            red, ir = self.read_fifo_burst(num_samples)
+            used = min(num_samples, remaining)
+            red_buf[count:count + used] = red[:used]
+            ir_buf[count:count + used] = ir[:used]
+            self._red_pending.extend(red[used:])
+            self._ir_pending.extend(ir[used:])
+            count += used
 
         return red_buf, ir_buf
+
+
+class GPIOInterrupt():
+    """
+    Waits for the MAX30102 INT pin (active low, open drain) through RPi.GPIO.
+    Any object with the same wait(timeout) method can be passed to MAX30102,
+    e.g. fake_smbus.FakeInterruptPin.
+    """
+    def __init__(self, pin):
+        import RPi.GPIO as GPIO
+        self.gpio = GPIO
+        self.pin = pin
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+
+    def wait(self, timeout):
+        """
+        Block until the pin is asserted or `timeout` seconds passed.
+        Returns True if the pin is asserted.
+        """
+        # still low from an edge that happened before we started waiting
+        if self.gpio.input(self.pin) == self.gpio.LOW:
+            return True
+        channel = self.gpio.wait_for_edge(self.pin, self.gpio.FALLING, timeout=max(int(timeout * 1000), 1))
+        return channel is not None
+
+    def close(self):
+        self.gpio.cleanup(self.pin)
+
+
+def decode_samples(d):
+    """
+    Decode raw FIFO bytes (3 bytes red, 3 bytes ir per sample, MSB first)
+    into two array('I') of 18-bit values.
+    """
+    d = bytes(d)
+    num_samples = len(d) // BYTES_PER_SAMPLE
+
+    # widen every 3-byte value to a big-endian 4-byte word, masking MSB [23:18]
+    words = bytearray(4 * 2 * num_samples)
+    words[1::4] = d[0::3].translate(_MASK_MSB)
+    words[2::4] = d[1::3]
+    words[3::4] = d[2::3]
+
+    samples = array(_WORD)
+    samples.frombytes(bytes(words))
+    if sys.byteorder == 'little':
+        samples.byteswap()
+
+    return samples[0::2], samples[1::2]
@@ -0,0 +1,87 @@
+import os
+import sys
+import math
+import random
+import itertools
+from array import array
+
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import sensor_backend
+from max30102 import SAMPLE_RATE
+
+# Replay file with one raw sample per row: Time (unix seconds), Red, IR
+REPLAY_FILE = 'ppg.csv'
+
+
+def synthetic_ppg(hr=72, sample_rate=SAMPLE_RATE, ir_dc=100000, red_dc=80000, ir_ac=1000, red_ac=600):
+    """
+    Endless clean PPG signal as (red, ir) tuples with the given heart rate.
+    """
+    n = 0
+    while True:
+        phase = 2 * math.pi * hr / 60.0 * n / sample_rate
+        # sharp systolic rise, slow diastolic decay
+        pulse = math.sin(phase) + 0.3 * math.sin(2 * phase)
+        yield int(red_dc + red_ac * pulse), int(ir_dc + ir_ac * pulse)
+        n += 1
+
+
+class SyntheticPulseOximeter():
+    """
+    Same read_sequential() as max30102.MAX30102, over a synthetic PPG
+    signal with noise, delivered at the sensor's sample rate on `clock`.
+    """
+    def __init__(self, clock, hr=72, noise=20, seed=0):
+        self.clock = clock
+        self.sample_rate = SAMPLE_RATE
+        self.noise = noise
+        self._signal = synthetic_ppg(hr, self.sample_rate)
+        self._rng = random.Random(seed)
+        self._next_time = clock.time()
+
+    def read_sequential(self, amount=100):
+        red_buf = array('I')
+        ir_buf = array('I')
+        for _ in range(amount):
+            red, ir = next(self._signal)
+            red_buf.append(max(int(red + self._rng.gauss(0, self.noise)), 0))
+            ir_buf.append(max(int(ir + self._rng.gauss(0, self.noise)), 0))
+
+        # the last of these samples is ready amount / sample_rate after the previous read
+        self._next_time += amount / float(self.sample_rate)
+        sensor_backend.wait_until(self.clock, self._next_time)
+        return red_buf, ir_buf
+
+
+class ReplayPulseOximeter():
+    """
+    Same read_sequential() as max30102.MAX30102, over raw samples recorded
+    in a CSV file (Time, Red, IR), paced by the recorded timestamps on `clock`.
+    Raises EOFError at the end of the file.
+    """
+    def __init__(self, path, clock):
+        self.path = path
+        self.clock = clock
+        rows = sensor_backend.read_csv(path)
+        first = next(rows, None)
+        if first is not None and hasattr(clock, 'restart'):
+            clock.restart(first[0])
+        self._rows = itertools.chain([first] if first is not None else [], rows)
+
+    def read_sequential(self, amount=100):
+        red_buf = array('I')
+        ir_buf = array('I')
+        timestamp = None
+        for _ in range(amount):
+            row = next(self._rows, None)
+            if row is None:
+                raise EOFError(f"end of replay file {self.path}")
+            timestamp, red, ir = row[0:3]
+            red_buf.append(int(red))
+            ir_buf.append(int(ir))
+
+        sensor_backend.wait_until(self.clock, timestamp)
+        return red_buf, ir_buf
+
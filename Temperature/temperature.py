@@ -1,133 +1,331 @@
 import os
 import glob
 import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 import sys
+sys.path.append(os.path.dirname(__file__))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
 
 from logger import CSVLogger
+import sensor_backend
+import temperature_backends
+from shm_ring import SampleRing
+from binlog import BinaryLogger
+import metrics
 
-# Load kernel modules to interface with sensor
-os.system('modprobe w1-gpio')
-os.system('modprobe w1-therm')
-
-# Set up paths and filenames for reading temp data
+# Set up paths for reading temp data
 base_dir = '/sys/bus/w1/devices/'
-# Search for folders that start with "28"
-device_folder = glob.glob(base_dir + '28*')[0]
-device_folder2 = glob.glob(base_dir + '28*')[1]
-# Files containing raw temperature data
-device_file = device_folder + '/w1_slave'
-device_file2 = device_folder2 + '/w1_slave'
+
+
+# Every probe reading is published to this shared-memory ring
+# (see shm_ring.py) when main.py has created it
+TEMP_RING = 'slumber_temperature'
+TEMP_DTYPE = [('time', 'f8'), ('probe', 'u1'), ('temp', 'f4')]
+TEMP_RING_CAPACITY = 3600
+
+# Every probe reading is also kept in a binary log (see binlog.py)
+LOG_RAW = True
+RAW_LOG_DIR = 'logs/raw/Temperature'
+
+# therm_bulk_read polling; a 12-bit conversion takes up to 750 ms
+BULK_POLL_INTERVAL = 0.05
+BULK_CONVERSION_TIMEOUT = 2.0
+
+
+def read_sysfs(path):
+    with open(path, 'r') as f:
+        return f.read().strip()
 
 
 # Get temp readings from file and return list
-def read_temp_raw():
+def read_temp_raw(device_file):
     f = open(device_file, 'r')
     lines = f.readlines()
     f.close()
     return lines
 
-def read_temp_raw2():
-    f = open(device_file2, 'r')
-    lines = f.readlines()
-    f.close()
-    return lines
-
 
 # Read temperature data and return Celsius value
-def read_temp():
-    lines = read_temp_raw()
+def read_temp(device_file):
+    lines = read_temp_raw(device_file)
     # Check for valid data
     while lines[0].strip()[-3:] != 'YES':
         time.sleep(0.2)
-        lines = read_temp_raw()
+        lines = read_temp_raw(device_file)
     equals_pos = lines[1].find('t=')
     if equals_pos != -1:
         temp_string = lines[1][equals_pos + 2:]
         temp_c = float(temp_string) / 1000.0
         return temp_c
 
-def read_temp2():
-    lines = read_temp_raw2()
-    # Check for valid data
-    while lines[0].strip()[-3:] != 'YES':
-        time.sleep(0.2)
-        lines = read_temp_raw2()
-    equals_pos = lines[1].find('t=')
-    if equals_pos != -1:
-        temp_string = lines[1][equals_pos + 2:]
-        temp_c = float(temp_string) / 1000.0
-        return temp_c
 
+class HardwareThermometer():
+    """
+    All DS18B20 probes on the 1-Wire bus. Each reading converts on every
+    probe at once, through the bus master's therm_bulk_read trigger when
+    the w1_therm driver has it, otherwise with one reader thread per probe,
+    so a reading takes one conversion time at any probe count.
+    """
+    def __init__(self):
+        # Load kernel modules to interface with sensor,
+        # unless an earlier process already did
+        if not glob.glob(base_dir + '28*'):
+            os.system('modprobe w1-gpio')
+            os.system('modprobe w1-therm')
 
-# Main function to be called by main.py
+        # Search for folders that start with "28"
+        device_folders = sorted(glob.glob(base_dir + '28*'))
+        # Files containing raw temperature data
+        self.device_files = [folder + '/w1_slave' for folder in device_folders]
+        if not self.device_files:
+            print(f"No DS18B20 probes found in {base_dir}, readings will be empty")
+        # Bulk conversion triggers, one per bus master (kernel 5.10+)
+        self.bulk_read_files = glob.glob(base_dir + 'w1_bus_master*/therm_bulk_read')
+
+        self._pool = None
+        if not self.bulk_read_files and len(self.device_files) > 1:
+            self._pool = ThreadPoolExecutor(max_workers=len(self.device_files))
+
+    def read_all(self):
+        """
+        Read every probe and return the values in °C.
+        """
+        if self.bulk_read_files:
+            self._bulk_convert()
+            # the conversions are done, so these reads return right away
+            return [read_temp(device_file) for device_file in self.device_files]
+        if self._pool is not None:
+            return list(self._pool.map(read_temp, self.device_files))
+        return [read_temp(device_file) for device_file in self.device_files]
+
+    def _bulk_convert(self):
+        """
+        Start a conversion on all probes of every bus and wait for them.
+        """
+        for bulk_read_file in self.bulk_read_files:
+            with open(bulk_read_file, 'w') as f:
+                f.write('trigger\n')
+
+        deadline = time.time() + BULK_CONVERSION_TIMEOUT
+        for bulk_read_file in self.bulk_read_files:
+            # -1 while a conversion is still running
+            while read_sysfs(bulk_read_file) == '-1' and time.time() < deadline:
+                time.sleep(BULK_POLL_INTERVAL)
+
+
+def open_thermometer(kind=None, clock=None):
+    """
+    Create the thermometer for the backend `kind` (default: SLUMBER_BACKEND),
+    see sensor_backend.py.
+    """
+    kind = kind or sensor_backend.backend_kind()
+    clock = clock or sensor_backend.make_clock(kind)
+
+    if kind == sensor_backend.SYNTHETIC:
+        return temperature_backends.SyntheticThermometer(clock)
+    if kind == sensor_backend.REPLAY:
+        return temperature_backends.ReplayThermometer(
+            sensor_backend.replay_path(temperature_backends.REPLAY_FILE), clock)
+    return HardwareThermometer()
+
+
+# Opened on first use by get_thermometer(), once per process
+_thermometer = None
+_clock = None
+_thermometer_pid = None
 
-def collect_temperature_data(queue=None, verbose=False):
-    interval_len = 60
+def get_thermometer():
+    """
+    The (thermometer, clock) of this process, opened on the first call,
+    so importing this module does not load kernel modules.
+    """
+    global _thermometer, _clock, _thermometer_pid
+    if _thermometer is None or _thermometer_pid != os.getpid():
+        _clock = sensor_backend.make_clock()
+        _thermometer = open_thermometer(clock=_clock)
+        _thermometer_pid = os.getpid()
+    return _thermometer, _clock
 
-    # Set temperature thresholds
-    very_cold_bound = 35.0
-    cold_bound = 36.4
-    hot_bound = 37.6
-    very_hot_bound = 38.9
 
-    logger = CSVLogger(log_dir='logs/Temperature', field_name='Temperature (°C)')
+class TemperatureMonitor():
+    """
+    What the collector does with each reading: publishes it (ring, binary
+    log, BLE vitals) and averages interval_len readings into a logged value,
+    which is checked against the thresholds.
+    Shared by collect_temperature_data and its asyncio version.
+    """
+    def __init__(self, clock, queue=None, logger=None, ring=None, verbose=False, raw_log=None):
+        self.interval_len = 60
+        self.reading_interval = 1  # seconds between the starts of two readings
+
+        # Set temperature thresholds
+        self.very_cold_bound = 35.0
+        self.cold_bound = 36.4
+        self.hot_bound = 37.6
+        self.very_hot_bound = 38.9
+
+        self.queue = queue
+        self.logger = logger
+        self.ring = ring
+        self.raw_log = raw_log
+        self.verbose = verbose
+        self.clock = clock
+        self._start_interval()
+
+    def _start_interval(self):
+        self.temp_sum = 0
+        self.num_readings = 0
+        self.readings = 0
+
+    def add(self, temps):
+        """
+        Handle one reading (°C of every probe).
+        """
+        self.temp_sum += sum(temps)
+        self.num_readings += len(temps)
+        self.readings += 1
+
+        if self.ring is not None or self.raw_log is not None:
+            now = self.clock.time()
+            records = [(now, probe, temp) for probe, temp in enumerate(temps)]
+            if self.ring is not None:
+                self.ring.write(records)
+            if self.raw_log is not None:
+                self.raw_log.write(records)
+
+        # Live value for the BLE vitals stream
+        if self.queue and temps:
+            self.queue.put({'sensor': 'temperature', 'value': round(sum(temps) / len(temps), 2), 'alert': None})
+
+        # Frequency of readings: 1 second
+        # Frequency of messaging: 1 minute
+        # Take 1-minute average (60 temp readings) of all temperature sensors
+        if self.readings == self.interval_len:
+            num_readings = self.num_readings
+            avg_temp = round(self.temp_sum / num_readings, 2) if num_readings else None
+            self._start_interval()
+            if avg_temp is None:
+                # no probes answered (or none are connected): nothing to log or check
+                if self.verbose:
+                    print("No temperature readings in this interval")
+            else:
+                self._check(avg_temp)
+
+    def _check(self, avg_temp):
+        verbose = self.verbose
+        if verbose:
+            print(f"Temperature: {avg_temp:.2f}°C")
+
+        if self.logger:
+            self.logger.log(avg_temp)
+
+        alert = None
+
+        # Alert if abnormal temperature reading
+        if avg_temp <= self.very_cold_bound:
+            alert = f'CRITICAL COLD WARNING: Temp {avg_temp:.2f}°C < {self.very_cold_bound}°C'
+            if verbose:
+                print(alert)
+        elif avg_temp <= self.cold_bound:
+            alert = f'COLD WARNING: Temp {avg_temp:.2f}°C < {self.cold_bound}°C'
+            if verbose:
+                print(alert)
+        elif avg_temp >= self.very_hot_bound:
+            alert = f'CRITICAL OVERHEAT ALERT: Temp {avg_temp:.2f}°C > {self.very_hot_bound}°C'
+            if verbose:
+                print(alert)
+        elif avg_temp >= self.hot_bound:
+            alert = f'OVERHEAT ALERT: Temp {avg_temp:.2f}°C > {self.hot_bound}°C'
+            if verbose:
+                print(alert)
+
+        # Send to BLE queue
+        if alert and self.queue:
+            message = {
+                'sensor': 'temperature',
+                'value': avg_temp,
+                'alert': alert
+            }
+            self.queue.put(message)
+
+
+# Main function to be called by main.py
+
+def collect_temperature_data(queue=None, verbose=False, heartbeat=None):
+    metrics.attach()
+    thermometer, clock = get_thermometer()
+    logger = CSVLogger(log_dir='logs/Temperature', field_name='Temperature (°C)', clock=clock)
+    raw_log = BinaryLogger(RAW_LOG_DIR, TEMP_DTYPE, clock=clock) if LOG_RAW else None
+    monitor = TemperatureMonitor(clock, queue, logger, SampleRing.attach(TEMP_RING, TEMP_DTYPE), verbose, raw_log)
 
     try:
+        next_reading = clock.time()
         while True:
-            temp_sum = 0
+            start = time.perf_counter()
+            temps = thermometer.read_all()
+            metrics.TEMPERATURE_READ_SECONDS.observe(time.perf_counter() - start)
+            metrics.TEMPERATURE_SAMPLES.inc(len(temps))
+            monitor.add(temps)
+            if heartbeat:
+                heartbeat.beat()
+
+            # Delay until the next reading; the conversion time is part
+            # of the interval, so readings start once a second
+            next_reading += monitor.reading_interval
+            delay = next_reading - clock.time()
+            if delay > 0:
+                clock.sleep(delay)
+            else:
+                # a slow reading (e.g. a CRC retry) moves the schedule
+                # instead of bunching up the next readings
+                next_reading = clock.time()
+
+    except EOFError:
+        pass  # end of replayed data
 
-            # Frequency of readings: 1 second
-            # Frequency of messaging: 1 minute
-            # Take 1-minute average (60 temp readings) of two temperature sensors
-            for i in range(interval_len):
-                temperature_celsius = read_temp()
-                temperature_celsius2 = read_temp2()
-                temp_sum += temperature_celsius + temperature_celsius2
+    finally:
+        logger.close()
+        if raw_log:
+            raw_log.close()
 
-                # Delay between each temperature reading
-                time.sleep(1)
 
-            avg_temp = round(temp_sum / (interval_len * 2), 2)
+async def collect_temperature_data_async(queue=None, verbose=False, io_pool=None, compute_pool=None):
+    """
+    collect_temperature_data as a coroutine for async_runtime.py; the
+    1-Wire conversions run in `io_pool`.
+    """
+    metrics.attach()
+    loop = asyncio.get_running_loop()
+    thermometer, clock = get_thermometer()
+    logger = CSVLogger(log_dir='logs/Temperature', field_name='Temperature (°C)', clock=clock)
+    raw_log = BinaryLogger(RAW_LOG_DIR, TEMP_DTYPE, clock=clock) if LOG_RAW else None
+    monitor = TemperatureMonitor(clock, queue, logger, SampleRing.attach(TEMP_RING, TEMP_DTYPE), verbose, raw_log)
 
-            if verbose:
-                print(f"Temperature: {avg_temp:.2f}°C")
-
-            if logger:
-                logger.log(avg_temp)
-
-            alert = None
-
-            # Alert if abnormal temperature reading
-            if avg_temp <= very_cold_bound:
-                alert = f'CRITICAL COLD WARNING: Temp {avg_temp:.2f}°C < {very_cold_bound}°C'
-                if verbose:
-                    print(alert)
-            elif avg_temp <= cold_bound:
-                alert = f'COLD WARNING: Temp {avg_temp:.2f}°C < {cold_bound}°C'
-                if verbose:
-                    print(alert)
-            elif avg_temp >= very_hot_bound:
-                alert = f'CRITICAL OVERHEAT ALERT: Temp {avg_temp:.2f}°C > {very_hot_bound}°C'
-                if verbose:
-                    print(alert)
-            elif avg_temp >= hot_bound:
-                alert = f'OVERHEAT ALERT: Temp {avg_temp:.2f}°C > {hot_bound}°C'
-                if verbose:
-                    print(alert)
-
-            # Send to BLE queue
-            if alert and queue:
-                message = {
-                    'sensor': 'temperature',
-                    'value': avg_temp,
-                    'alert': alert
-                }
-                queue.put(message)
+    try:
+        next_reading = clock.time()
+        while True:
+            start = time.perf_counter()
+            temps = await loop.run_in_executor(io_pool, thermometer.read_all)
+            metrics.TEMPERATURE_READ_SECONDS.observe(time.perf_counter() - start)
+            metrics.TEMPERATURE_SAMPLES.inc(len(temps))
+            monitor.add(temps)
+
+            next_reading += monitor.reading_interval
+            delay = next_reading - clock.time()
+            if delay > 0:
+                await sensor_backend.sleep_async(clock, delay)
+            else:
+                next_reading = clock.time()
+
+    except EOFError:
+        pass  # end of replayed data
 
     finally:
         logger.close()
+        if raw_log:
+            raw_log.close()
 
 
 # Test function for unit testing
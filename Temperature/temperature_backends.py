@@ -0,0 +1,56 @@
+import os
+import sys
+import random
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import sensor_backend
+
+# Replay file with one row per reading: Time (unix seconds), then °C for each probe
+REPLAY_FILE = 'temperature.csv'
+
+# DS18B20 conversion time at 12-bit resolution
+CONVERSION_TIME = 0.75  # seconds
+
+
+class SyntheticThermometer():
+    """
+    Same read_all() as temperature.HardwareThermometer for `probes` probes
+    around `mean` °C with a slow random walk, taking CONVERSION_TIME on `clock`.
+    """
+    def __init__(self, clock, probes=2, mean=36.8, noise=0.05, drift=0.01, seed=0):
+        self.clock = clock
+        self.noise = noise
+        self.drift = drift
+        self._rng = random.Random(seed)
+        self._temps = [mean] * probes
+
+    def read_all(self):
+        self.clock.sleep(CONVERSION_TIME)
+        self._temps = [t + self._rng.gauss(0, self.drift) for t in self._temps]
+        # the DS18B20 reports in 1/16 °C steps
+        return [round((t + self._rng.gauss(0, self.noise)) * 16) / 16.0 for t in self._temps]
+
+
+class ReplayThermometer():
+    """
+    Same read_all() as temperature.HardwareThermometer over readings recorded
+    in a CSV file, paced by the recorded timestamps on `clock`.
+    Raises EOFError at the end of the file.
+    """
+    def __init__(self, path, clock):
+        self.path = path
+        self.clock = clock
+        self._rows = sensor_backend.read_csv(path)
+        self._started = False
+
+    def read_all(self):
+        row = next(self._rows, None)
+        if row is None:
+            raise EOFError(f"end of replay file {self.path}")
+        timestamp = row[0]
+        if not self._started and hasattr(self.clock, 'restart'):
+            self.clock.restart(timestamp)
+        self._started = True
+        sensor_backend.wait_until(self.clock, timestamp)
+        return row[1:]
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import signal
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from supervisor import RESTART_MIN_DELAY, RESTART_MAX_DELAY, STABLE_TIME, process_cpu_time
+
+# Threads for blocking sensor reads (1-Wire conversions, FIFO reads), one
+# per sensor so a 750 ms temperature conversion never delays the FIFOs
+IO_THREADS = 3
+# Threads for the HR/SpO2 estimates
+COMPUTE_THREADS = 1
+
+
+class AsyncRuntime():
+    """
+    The alternative to supervisor.Supervisor: every collector runs as a
+    coroutine on one asyncio event loop in a single process, which saves
+    an interpreter (and its memory) per sensor and the pickling of queue
+    messages. Blocking sensor reads go to the `io_pool` threads and the
+    HR/SpO2 estimates to the `compute_pool` thread, both passed to every
+    coroutine function as keyword arguments. Functions that run their own
+    loop (the BLE server) run in a thread of their own.
+
+    As with the Supervisor, a task that fails is restarted after an
+    exponential backoff, one that returns is not, and run() returns when
+    no task is left, or on SIGTERM or Ctrl+C.
+    """
+    def __init__(self, io_threads=IO_THREADS, compute_threads=COMPUTE_THREADS):
+        self.io_pool = ThreadPoolExecutor(io_threads, thread_name_prefix='io')
+        self.compute_pool = ThreadPoolExecutor(compute_threads, thread_name_prefix='compute')
+        self.tasks = []
+        self.restarts = {}
+
+    def add(self, name, function, args=(), kwargs=None):
+        """
+        Run the coroutine function(*args, **kwargs, io_pool=..., compute_pool=...) as `name`.
+        """
+        kwargs = dict(kwargs or {}, io_pool=self.io_pool, compute_pool=self.compute_pool)
+        self.tasks.append((name, lambda: function(*args, **kwargs)))
+
+    def add_thread(self, name, function, args=(), stop=None):
+        """
+        Run the blocking function(*args) in a thread of its own as `name`;
+        stop() is called from the loop to make it return.
+        """
+        async def run_thread():
+            done = asyncio.get_running_loop().create_future()
+
+            def finish(setter, *result):
+                try:
+                    done.get_loop().call_soon_threadsafe(setter, *result)
+                except RuntimeError:
+                    pass  # the loop has already been closed
+
+            def target():
+                try:
+                    function(*args)
+                except BaseException as e:
+                    finish(done.set_exception, e)
+                else:
+                    finish(done.set_result, None)
+
+            threading.Thread(target=target, name=name, daemon=True).start()
+            try:
+                await done
+            except asyncio.CancelledError:
+                if stop is not None:
+                    stop()
+                raise
+
+        self.tasks.append((name, run_thread))
+
+    def run(self):
+        try:
+            asyncio.run(self._main())
+        finally:
+            self.io_pool.shutdown(wait=False, cancel_futures=True)
+            self.compute_pool.shutdown(wait=False, cancel_futures=True)
+            self.print_stats()
+
+    def report(self):
+        """
+        Restarts per task, and the CPU seconds of the whole process.
+        """
+        return {'restarts': dict(self.restarts), 'cpu_seconds': process_cpu_time(os.getpid())}
+
+    def print_stats(self):
+        stats = self.report()
+        for name, restarts in stats['restarts'].items():
+            print(f"[runtime] {name}: {restarts} restarts")
+        print(f"[runtime] CPU {stats['cpu_seconds']:.1f} s")
+
+    async def _main(self):
+        loop = asyncio.get_running_loop()
+        tasks = [asyncio.ensure_future(self._supervise(name, factory)) for name, factory in self.tasks]
+        everything = asyncio.gather(*tasks)
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, everything.cancel)
+        try:
+            await everything
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(sig)
+
+    async def _supervise(self, name, factory):
+        self.restarts[name] = 0
+        delay = RESTART_MIN_DELAY
+        while True:
+            started = time.monotonic()
+            try:
+                await factory()
+                print(f"[runtime] {name} finished")
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+                if time.monotonic() - started >= STABLE_TIME:
+                    delay = RESTART_MIN_DELAY
+                print(f"[runtime] {name} failed, restarting in {delay} s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RESTART_MAX_DELAY)
+                self.restarts[name] += 1
@@ -0,0 +1,118 @@
+"""
+Loading a night of raw samples: the binary logs of binlog.py against CSV
+text with the same columns.
+
+Writes `hours` of PPG (25 Hz) and IMU (100 Hz) records with BinaryLogger,
+then times opening each log and reading every column, and one hour out
+of the middle. The CSV is written and parsed for one hour and scaled to
+the whole night, as parsing all of it takes too long to wait for.
+
+    python benchmarks/bench_binlog.py [hours] [directory]
+"""
+import csv
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'MAX30102')]
+
+from binlog import BinaryLogger, BinaryLog
+from max30102 import SAMPLE_RATE
+
+PPG_DTYPE = [('time', 'f8'), ('red', 'u4'), ('ir', 'u4')]
+IMU_DTYPE = [('time', 'f8')] + [(field, 'f4') for field in ('ax', 'ay', 'az', 'temp', 'gx', 'gy', 'gz')]
+SENSORS = [('ppg', PPG_DTYPE, SAMPLE_RATE), ('imu', IMU_DTYPE, 100)]
+START = 1.7e9
+CHUNK = 25  # records per write, as the collectors write them
+
+
+def make_records(dtype, rate, seconds, start=START):
+    rng = np.random.default_rng(0)
+    records = np.zeros(int(seconds * rate), dtype=dtype)
+    records['time'] = start + np.arange(len(records)) / float(rate)
+    for name in records.dtype.names[1:]:
+        if records.dtype[name].kind == 'u':
+            records[name] = rng.integers(60000, 120000, len(records))
+        else:
+            records[name] = rng.standard_normal(len(records))
+    return records
+
+
+def write_binary(directory, dtype, records):
+    logger = BinaryLogger(directory, dtype, fsync=False)
+    for i in range(0, len(records), CHUNK):
+        logger.write(records[i:i + CHUNK])
+    logger.close()
+    return logger.log_path
+
+
+def write_csv(path, records):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(records.dtype.names)
+        writer.writerows(records.tolist())
+
+
+def load_csv(path):
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        names = next(reader)
+        columns = list(zip(*reader))
+    return {name: np.array(column, dtype=float) for name, column in zip(names, columns)}
+
+
+def drop_cache(path):
+    # make the kernel read the file from disk again where that is allowed
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+    base = sys.argv[2] if len(sys.argv) > 2 else None
+    seconds = hours * 3600
+
+    print(f"{hours:g} h of raw samples")
+    print(f"{'':<6}{'rows':>10}{'binary MB':>11}{'open+read s':>13}{'1 h s':>8}{'CSV MB':>9}{'CSV parse s':>13}")
+    with tempfile.TemporaryDirectory(dir=base) as directory:
+        for name, dtype, rate in SENSORS:
+            records = make_records(dtype, rate, seconds)
+            path = write_binary(os.path.join(directory, name), dtype, records)
+
+            drop_cache(path)
+            start = time.perf_counter()
+            log = BinaryLog(path)
+            columns = log.read()
+            read_time = time.perf_counter() - start
+            assert np.array_equal(columns['time'], records['time'])
+
+            middle = START + seconds / 2
+            start = time.perf_counter()
+            hour = log.read(middle, middle + 3600)
+            hour_time = time.perf_counter() - start
+            assert len(hour['time']) == min(int(3600 * rate), len(records) - int(seconds / 2 * rate))
+            del columns, hour
+
+            csv_path = os.path.join(directory, name + '.csv')
+            hour_records = records[:int(min(seconds, 3600) * rate)]
+            write_csv(csv_path, hour_records)
+            drop_cache(csv_path)
+            start = time.perf_counter()
+            load_csv(csv_path)
+            scale = len(records) / float(len(hour_records))
+            csv_time = (time.perf_counter() - start) * scale
+            csv_size = os.path.getsize(csv_path) * scale
+
+            print(f"{name:<6}{len(records):>10}{os.path.getsize(path) / 1e6:>11.1f}{read_time:>13.3f}"
+                  f"{hour_time:>8.3f}{csv_size / 1e6:>9.1f}{csv_time:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
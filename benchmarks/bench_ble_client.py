@@ -0,0 +1,56 @@
+"""
+Run the async BLE client (BLE/ble_central.py) against a fake peripheral
+that drops the link every few seconds: notifications/s, bytes/s,
+records/s and end-to-end latency per second, reconnects and records
+dropped by a slow consumer.
+
+    python benchmarks/bench_ble_client.py [seconds] [consumer delay s]
+"""
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../BLE')))
+
+from ble_central import SlumberClient
+from fake_peripheral import FakePeripheral
+
+
+async def consume(client, delay):
+    while True:
+        await client.get()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+async def bench(seconds, consumer_delay):
+    peripheral = FakePeripheral(vitals_rate=20, alert_rate=2, link_lifetime=2.0)
+    client = SlumberClient(queue_size=64, scanner=peripheral, client_class=peripheral.client_class)
+    client.reconnect_min_delay = 0.1
+
+    tasks = [asyncio.ensure_future(client.run()), asyncio.ensure_future(consume(client, consumer_delay))]
+    print(f"{'s':>3}{'notif/s':>10}{'bytes/s':>10}{'records/s':>11}{'lat ms':>9}{'p95 ms':>9}"
+          f"{'connects':>10}{'lost':>6}{'q drops':>9}")
+    client.stats.report()
+    for second in range(1, seconds + 1):
+        await asyncio.sleep(1)
+        r = client.stats.report()
+        latency = f"{r['latency_mean'] * 1000:>9.1f}{r['latency_p95'] * 1000:>9.1f}" if r['records_per_s'] else f"{'-':>9}{'-':>9}"
+        print(f"{second:>3}{r['notifications_per_s']:>10.1f}{r['bytes_per_s']:>10.0f}{r['records_per_s']:>11.1f}"
+              f"{latency}{r['connects']:>10}{r['lost_messages']:>6}{r['queue_dropped']:>9}")
+
+    client.stop()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    print("notifications sent by the peripheral:", peripheral.sent_notifications)
+
+
+def main():
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    consumer_delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    asyncio.run(bench(seconds, consumer_delay))
+
+
+if __name__ == "__main__":
+    main()
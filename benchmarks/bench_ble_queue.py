@@ -0,0 +1,142 @@
+"""
+Latency from queue.put in a sensor process to the notification on a stub
+D-Bus characteristic, for the old 1 s polling loop and the blocking,
+batched consumer in BLE/ble_queue.py. The sensors send bursts of three
+alerts (one per sensor) at random times.
+
+    python benchmarks/bench_ble_queue.py [bursts]
+
+Batches are handed to a GLib main loop when PyGObject is installed,
+otherwise to a plain thread that runs the scheduled callbacks in order.
+"""
+import contextlib
+import io
+import random
+import statistics
+import sys
+import os
+import threading
+import time
+from multiprocessing import Process, Queue
+from queue import SimpleQueue
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../BLE')))
+
+import ble_queue
+
+try:
+    from gi.repository import GLib
+except ImportError:
+    GLib = None
+
+SENSORS = ('temperature', 'gyroscope', 'hr_spo2')
+
+
+class StubCharacteristic():
+    """
+    Records when each notification is emitted and on which thread,
+    instead of sending a PropertiesChanged signal.
+    """
+    def __init__(self, expected, main_thread=None):
+        self.expected = expected
+        self.main_thread = main_thread
+        self.latencies = []
+        self.foreign_thread_emits = 0
+        self.done = threading.Event()
+
+    def send_notification(self, message):
+        now = time.monotonic()
+        if self.main_thread is not None and threading.current_thread() is not self.main_thread:
+            self.foreign_thread_emits += 1
+        self.latencies.append(now - message['sent'])
+        if len(self.latencies) >= self.expected:
+            self.done.set()
+
+
+def produce(queue, bursts, seed):
+    rng = random.Random(seed)
+    for _ in range(bursts):
+        time.sleep(rng.uniform(0.2, 1.5))
+        for sensor in SENSORS:
+            queue.put({'sensor': sensor, 'value': 0, 'alert': 'benchmark', 'sent': time.monotonic()})
+
+
+def legacy_send_from_queue(queue, characteristic):
+    """
+    The consumer as it was: poll, send one message, sleep 1 s.
+    """
+    while True:
+        if not queue.empty():
+            msg = queue.get()
+            ble_queue.send_batch(characteristic, [msg])
+        time.sleep(1)
+
+
+class ThreadLoop():
+    """
+    Runs scheduled callbacks in order on its own thread, like GLib.idle_add.
+    """
+    def __init__(self):
+        self.callbacks = SimpleQueue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def schedule(self, function, *args):
+        self.callbacks.put((function, args))
+
+    def run(self):
+        while True:
+            function, args = self.callbacks.get()
+            function(*args)
+
+
+def run(name, bursts, seed=0):
+    queue = Queue()
+    expected = bursts * len(SENSORS)
+
+    if name == 'legacy':
+        characteristic = StubCharacteristic(expected, main_thread=threading.main_thread())
+        consumer = threading.Thread(target=legacy_send_from_queue, args=(queue, characteristic), daemon=True)
+        loop = None
+    elif GLib is not None:
+        loop = GLib.MainLoop()
+        characteristic = StubCharacteristic(expected, main_thread=threading.current_thread())
+        consumer = threading.Thread(target=ble_queue.send_from_queue,
+                                    args=(queue, characteristic, GLib.idle_add), daemon=True)
+    else:
+        thread_loop = ThreadLoop()
+        thread_loop.thread.start()
+        characteristic = StubCharacteristic(expected, main_thread=thread_loop.thread)
+        consumer = threading.Thread(target=ble_queue.send_from_queue,
+                                    args=(queue, characteristic, thread_loop.schedule), daemon=True)
+        loop = None
+
+    producer = Process(target=produce, args=(queue, bursts, seed))
+    with contextlib.redirect_stdout(io.StringIO()):
+        consumer.start()
+        producer.start()
+        if loop is not None:
+            def quit_when_done():
+                characteristic.done.wait()
+                GLib.idle_add(loop.quit)
+            threading.Thread(target=quit_when_done, daemon=True).start()
+            loop.run()
+        else:
+            characteristic.done.wait()
+    producer.join()
+
+    latencies = sorted(l * 1000 for l in characteristic.latencies)
+    p95 = latencies[int(0.95 * (len(latencies) - 1))]
+    print(f"{name:<10}{len(latencies):>6}{statistics.mean(latencies):>12.1f}{statistics.median(latencies):>12.1f}"
+          f"{p95:>12.1f}{latencies[-1]:>12.1f}{characteristic.foreign_thread_emits:>16}")
+
+
+def main():
+    bursts = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f"main loop: {'GLib' if GLib is not None else 'thread (PyGObject not installed)'}")
+    print(f"{'':<10}{'msgs':>6}{'mean ms':>12}{'p50 ms':>12}{'p95 ms':>12}{'max ms':>12}{'foreign emits':>16}")
+    run('legacy', bursts)
+    run('batched', bursts)
+
+
+if __name__ == "__main__":
+    main()
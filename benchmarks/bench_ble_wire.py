@@ -0,0 +1,84 @@
+"""
+Bytes per alert and encode/decode throughput of the BLE wire format
+(BLE/ble_wire.py) against the JSON text it replaces, and the number of
+notifications per alert at common ATT MTUs. JSON alerts longer than
+MTU - 3 bytes did not fit one notification and were cut off.
+
+    python benchmarks/bench_ble_wire.py [iterations]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../BLE')))
+
+import ble_wire
+
+# one alert per sensor, as the collectors send them
+ALERTS = [
+    {'sensor': 'temperature', 'value': 38.95, 'alert': 'CRITICAL OVERHEAT ALERT: Temp 38.95°C > 38.9°C'},
+    {'sensor': 'gyroscope', 'value': 47.12, 'alert': 'Y Tilt Warning: Y tilt = 47.12 deg'},
+    {'sensor': 'heart', 'value': {'hr': 165.3, 'spo2': 88.0}, 'alert': 'High HR: 165.3 BPM'},
+]
+
+MTUS = (23, 185, 247)
+
+
+def per_second(function, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return iterations / (time.perf_counter() - start)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print(f"{'':<13}{'json B':>8}{'wire B':>8}" + ''.join(f"{'frames@' + str(m):>12}" for m in MTUS))
+    for msg in ALERTS:
+        json_len = len(json.dumps(msg).encode('utf-8'))
+        wire_len = len(ble_wire.encode_message(msg))
+        frames = []
+        for mtu in MTUS:
+            json_fits = json_len <= ble_wire.max_frame_len(mtu)
+            wire_frames = len(ble_wire.encode_frames(msg, mtu))
+            frames.append(f"{wire_frames} ({'1' if json_fits else 'cut'})")
+        print(f"{msg['sensor']:<13}{json_len:>8}{wire_len:>8}" + ''.join(f"{f:>12}" for f in frames))
+    print("frames: wire format (JSON in parentheses)\n")
+
+    def encode_json():
+        for msg in ALERTS:
+            json.dumps(msg).encode('utf-8')
+
+    def decode_json():
+        for payload in json_payloads:
+            json.loads(payload)
+
+    def encode_wire():
+        seq = 0
+        for msg in ALERTS:
+            seq += len(ble_wire.encode_frames(msg, ble_wire.DEFAULT_MTU, seq))
+
+    def decode_wire():
+        reassembler = ble_wire.Reassembler()
+        for frames in wire_frames:
+            for frame in frames:
+                reassembler.feed(frame)
+
+    json_payloads = [json.dumps(msg).encode('utf-8') for msg in ALERTS]
+    wire_frames = []
+    seq = 0
+    for msg in ALERTS:
+        wire_frames.append(ble_wire.encode_frames(msg, ble_wire.DEFAULT_MTU, seq))
+        seq += len(wire_frames[-1])
+
+    print(f"{'alerts/s':<13}{'encode':>12}{'decode':>12}")
+    for name, encode, decode in (('json', encode_json, decode_json),
+                                 (f'wire@{ble_wire.DEFAULT_MTU}', encode_wire, decode_wire)):
+        print(f"{name:<13}{per_second(encode, iterations) * len(ALERTS):>12.0f}"
+              f"{per_second(decode, iterations) * len(ALERTS):>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+The buffered CSVLogger (logger.py) against the previous one, which
+formatted the time and flushed the file for every row.
+
+Throughput: rows/s seen by the caller of log(), and write syscalls per row.
+
+Write amplification: bytes that reach the storage device per byte of CSV
+(write_bytes from /proc/self/io), at the rates the collectors log. The
+kernel writes a dirty page back once it is about 30 s old, so the old
+logger's rows reach the SD card in groups of up to 30 s (on a best-effort
+basis); the new one writes and fsyncs a batch every FLUSH_INTERVAL
+seconds or FLUSH_ROWS rows. Both are modelled with an fsync at those
+points, so the benchmark does not have to run in real time. Every
+write-back rewrites at least a whole 4 KiB page.
+
+    python benchmarks/bench_logger.py [rows] [directory]
+
+Run it with a directory on the SD card for the Pi's numbers.
+"""
+import csv
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import logger
+
+WRITEBACK_INTERVAL = 30.0  # seconds, /proc/sys/vm/dirty_expire_centisecs
+# rows per second: 1-minute temperature averages, HR/SpO2 averages, raw IMU samples
+RATES = [('temperature', 1 / 60.0), ('hr_spo2', 0.4), ('raw imu', 100.0)]
+RATE_ROWS = 600
+
+
+class OldCSVLogger:
+    """
+    logger.CSVLogger before buffering.
+    """
+    def __init__(self, log_dir, field_name="Value"):
+        os.makedirs(log_dir, exist_ok=True)
+        timestamp_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        self.log_path = os.path.join(log_dir, f"log_{timestamp_str}.csv")
+        self.file = open(self.log_path, mode='w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(['Time', field_name])
+
+    def log(self, value):
+        time_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.writer.writerow([time_now, value])
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def io_counters():
+    counters = {}
+    with open('/proc/self/io') as f:
+        for line in f:
+            name, value = line.split(':')
+            counters[name] = int(value)
+    return counters
+
+
+def throughput(make_logger, rows):
+    log = make_logger()
+    before = io_counters()
+    start = time.perf_counter()
+    for n in range(rows):
+        log.log(36.5 + n % 100 / 100.0)
+    elapsed = time.perf_counter() - start
+    log.close()
+    after = io_counters()
+    return rows / elapsed, (after['syscw'] - before['syscw']) / rows
+
+
+def amplification(log_dir, rate, rows):
+    """
+    (old, new) device bytes per CSV byte at `rate` rows per second.
+    """
+    results = []
+    for batch in (max(int(WRITEBACK_INTERVAL * rate), 1),
+                  min(max(int(logger.FLUSH_INTERVAL * rate), 1), logger.FLUSH_ROWS)):
+        log = logger.CSVLogger(log_dir, flush_rows=rows + 1, flush_interval=1e9, fsync=False)
+        os.fsync(log.file.fileno())
+        before = io_counters()['write_bytes']
+        for n in range(rows):
+            log.log(36.5 + n % 100 / 100.0)
+            if (n + 1) % batch == 0:
+                log.flush()
+                os.fsync(log.file.fileno())
+        log.flush()
+        os.fsync(log.file.fileno())
+        written = io_counters()['write_bytes'] - before
+        results.append(written / float(log.bytes))
+        log.close()
+    return results
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    base = sys.argv[2] if len(sys.argv) > 2 else None
+
+    with tempfile.TemporaryDirectory(dir=base) as log_dir:
+        print(f"{'':<8}{'rows/s':>12}{'syscalls/row':>14}")
+        for name, make_logger in (('old', lambda: OldCSVLogger(log_dir)),
+                                  ('new', lambda: logger.CSVLogger(log_dir))):
+            rate, syscalls = throughput(make_logger, rows)
+            print(f"{name:<8}{rate:>12.0f}{syscalls:>14.3f}")
+
+        print(f"\n{'device bytes per CSV byte':<28}{'old':>8}{'new':>8}")
+        for name, rate in RATES:
+            old, new = amplification(log_dir, rate, RATE_ROWS)
+            print(f"{name + f' ({rate:.3g}/s)':<28}{old:>8.1f}{new:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Range queries over a night of raw logs (logquery.py): from the rollups
+that BinaryLogger writes, against the raw rows of the binary logs and a
+scan of CSV text with the same columns.
+
+Writes `hours` of IMU records (100 Hz) with and without rollups, timing
+the writes, then times the statistics of one field over an hour out of
+the middle and over the whole night, and a series of about 500 points over the whole night, each
+with the files dropped from the page cache first. The CSV
+scan is done for one hour of rows and scaled to the night, as in
+bench_binlog.py: answering a query from CSV means reading every row.
+
+    python benchmarks/bench_logquery.py [hours] [directory]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+from binlog import BinaryLogger, ROLLUPS
+from logquery import RawLogs
+from bench_binlog import IMU_DTYPE, START, CHUNK, make_records, write_csv, load_csv, drop_cache
+
+RATE = 100
+FIELD = 'az'
+
+
+def write(directory, records, rollups):
+    logger = BinaryLogger(directory, IMU_DTYPE, fsync=False, rollups=rollups)
+    start = time.perf_counter()
+    for i in range(0, len(records), CHUNK):
+        logger.write(records[i:i + CHUNK])
+    logger.close()
+    return time.perf_counter() - start, logger.log_path
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def drop_caches(directory):
+    for path, _, names in os.walk(directory):
+        for name in names:
+            drop_cache(os.path.join(path, name))
+
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(path, name)) for path, _, names in os.walk(directory) for name in names)
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+    base = sys.argv[2] if len(sys.argv) > 2 else None
+    seconds = hours * 3600
+    records = make_records(IMU_DTYPE, RATE, seconds)
+    middle = START + seconds / 2
+    ranges = [('stats of 1 h', (middle, middle + 3600)), ('stats of the night', (START, START + seconds))]
+
+    with tempfile.TemporaryDirectory(dir=base) as directory:
+        plain_dir = os.path.join(directory, 'plain')
+        rolled_dir = os.path.join(directory, 'rolled')
+        plain_time, _ = write(plain_dir, records, ())
+        rolled_time, _ = write(rolled_dir, records, ROLLUPS)
+        print(f"{hours:g} h of IMU records ({len(records)} rows)")
+        print(f"write: {len(records) / plain_time:,.0f} rows/s without rollups, "
+              f"{len(records) / rolled_time:,.0f} rows/s with; "
+              f"files {directory_size(plain_dir) / 1e6:.1f} MB, {directory_size(rolled_dir) / 1e6:.1f} MB")
+
+        logs = RawLogs(rolled_dir)
+        results = []
+        for label, (start, end) in ranges:
+            drop_caches(rolled_dir)
+            stats_time, stats = timed(logs.stats, FIELD, start, end)
+            drop_caches(rolled_dir)
+            raw_time, (times, values) = timed(logs.raw, FIELD, start, end)
+            assert stats['count'] == len(values)
+            assert np.isclose(stats['mean'], values.astype(np.float64).mean())
+            results.append((label, stats_time, raw_time))
+            del times, values
+
+        drop_caches(rolled_dir)
+        series_time, series = timed(logs.series, FIELD)
+        def downsample():
+            # the same series from the raw rows
+            times, values = logs.raw(FIELD)
+            resolution = series['time'][2] - series['time'][1]
+            edges = np.flatnonzero(np.diff(np.floor(times / resolution))) + 1
+            return np.add.reduceat(values.astype(np.float64), np.r_[0, edges])
+        drop_caches(rolled_dir)
+        raw_series_time, _ = timed(downsample)
+
+        csv_path = os.path.join(directory, 'imu.csv')
+        hour_records = records[:int(min(seconds, 3600) * RATE)]
+        write_csv(csv_path, hour_records)
+        drop_cache(csv_path)
+        csv_time, _ = timed(load_csv, csv_path)
+        csv_time *= len(records) / float(len(hour_records))
+
+        print(f"\n{'':<24}{'rollups s':>11}{'raw rows s':>12}{'CSV scan s':>12}")
+        for label, stats_time, raw_time in results:
+            print(f"{label:<24}{stats_time:>11.4f}{raw_time:>12.4f}{csv_time:>12.2f}")
+        label = f"series, {len(series['time'])} points"
+        print(f"{label:<24}{series_time:>11.4f}{raw_series_time:>12.4f}{csv_time:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Compare the per-sample FIFO read loop with the burst read path of the
+MAX30102 driver on a fake SMBus, polled and interrupt driven: I2C
+transactions, bytes on the bus, host wake-ups and CPU time per
+100-sample window.
+
+    python benchmarks/bench_max30102_fifo.py [windows]
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../MAX30102')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import max30102
+from fake_smbus import FakeSMBus, FakeInterruptPin
+
+
+def legacy_read_sequential(sensor, amount=100):
+    """
+    The read loop as it was before burst reads: busy-poll both pointers,
+    then two status reads and one 6-byte read per sample.
+    """
+    bus, address = sensor.bus, sensor.address
+    red_buf = []
+    ir_buf = []
+    count = amount
+    while count > 0:
+        read_ptr = bus.read_byte_data(address, max30102.REG_FIFO_RD_PTR)
+        write_ptr = bus.read_byte_data(address, max30102.REG_FIFO_WR_PTR)
+        num_samples = (write_ptr - read_ptr) % max30102.FIFO_DEPTH
+        while num_samples > 0:
+            bus.read_i2c_block_data(address, max30102.REG_INTR_STATUS_1, 1)
+            bus.read_i2c_block_data(address, max30102.REG_INTR_STATUS_2, 1)
+            d = bus.read_i2c_block_data(address, max30102.REG_FIFO_DATA, 6)
+            red_buf.append((d[0] << 16 | d[1] << 8 | d[2]) & 0x03FFFF)
+            ir_buf.append((d[3] << 16 | d[4] << 8 | d[5]) & 0x03FFFF)
+            num_samples -= 1
+            count -= 1
+    return red_buf, ir_buf
+
+
+def run(name, read, windows, use_interrupt=False):
+    bus = FakeSMBus()
+    wakeups = [0]
+
+    def sleep(seconds):
+        wakeups[0] += 1
+        bus.sleep(seconds)
+
+    pin = FakeInterruptPin(bus) if use_interrupt else None
+    sensor = max30102.MAX30102(bus=bus, sleep=sleep, interrupt=pin)
+    start_transactions = bus.transactions
+    start_bytes = bus.bytes_transferred
+    start_time = bus.time
+    wakeups[0] = 0
+
+    cpu_start = time.process_time()
+    for _ in range(windows):
+        red, ir = read(sensor)
+        assert len(red) == len(ir) == 100
+    cpu = time.process_time() - cpu_start
+
+    if pin is not None:
+        wakeups[0] += pin.waits
+    transactions = (bus.transactions - start_transactions) / float(windows)
+    nbytes = (bus.bytes_transferred - start_bytes) / float(windows)
+    elapsed = bus.time - start_time
+    print(f"{name:8s} {transactions:10.1f} {nbytes:10.1f} {wakeups[0] / float(windows):10.1f} "
+          f"{1000 * cpu / windows:12.3f} {elapsed:10.1f}")
+
+
+def main():
+    windows = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    print(f"{'':8s} {'trans/win':>10s} {'bytes/win':>10s} {'wakes/win':>10s} {'cpu ms/win':>12s} {'device s':>10s}")
+    run("legacy", legacy_read_sequential, windows)
+    run("burst", lambda sensor: sensor.read_sequential(100), windows)
+    run("irq", lambda sensor: sensor.read_sequential(100), windows, use_interrupt=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Cost of the metrics (metrics.py) on the HR/SpO2 path: CPU time per hop
+of the collector loop (FIFO read on a fake SMBus, estimate, monitor)
+with the metrics bound to a shared-memory block and as no-ops, and the
+time of the metric updates alone that each hop makes.
+
+The loop body is that of hr_spo2.collect_hr_spo2_data, without the
+heartbeat and the logs. Runs alternate between the two modes and the
+fastest of each is kept, as the differences are small next to the
+run-to-run noise.
+
+    python benchmarks/bench_metrics.py [hops] [runs]
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'MAX30102')]
+
+import metrics
+import hrcalc
+import hr_spo2
+import max30102
+from fake_smbus import FakeSMBus
+
+# not the block of a running main.py
+METRICS_SHM = 'slumber_metrics_bench'
+
+
+class BusClock():
+    def __init__(self, bus):
+        self.bus = bus
+
+    def time(self):
+        return self.bus.time
+
+
+def hop_loop(hops):
+    """
+    CPU seconds per hop of the collector loop over `hops` hops.
+    """
+    bus = FakeSMBus()
+    sensor = max30102.MAX30102(bus=bus, sleep=bus.sleep)
+    estimator = hrcalc.HrSpo2Stream(hop_size=hr_spo2.hop_size)
+    monitor = hr_spo2.HrSpo2Monitor(BusClock(bus))
+
+    cpu_start = time.process_time()
+    for _ in range(hops):
+        start = time.perf_counter()
+        red, ir = sensor.read_sequential(hr_spo2.hop_size)
+        read_done = time.perf_counter()
+        metrics.PPG_READ_SECONDS.observe(read_done - start)
+        metrics.PPG_SAMPLES.inc(len(red))
+        monitor.add_samples(red, ir)
+        result = estimator.update(red, ir)
+        metrics.HR_ESTIMATE_SECONDS.observe(time.perf_counter() - read_done)
+        monitor.add_estimate(result)
+    return (time.process_time() - cpu_start) / hops
+
+
+def updates(hops):
+    """
+    Seconds per hop of the metric updates alone: the collector's and its monitor's.
+    """
+    start = time.perf_counter()
+    for _ in range(hops):
+        t0 = time.perf_counter()
+        t1 = time.perf_counter()
+        metrics.PPG_READ_SECONDS.observe(t1 - t0)
+        metrics.PPG_SAMPLES.inc(hr_spo2.hop_size)
+        metrics.HR_ESTIMATE_SECONDS.observe(time.perf_counter() - t1)
+        metrics.HR_ESTIMATES.inc()
+    return (time.perf_counter() - start) / hops
+
+
+def main():
+    hops = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    loop = {'no-op': [], 'bound': []}
+    alone = {'no-op': [], 'bound': []}
+    try:
+        for _ in range(runs):
+            for mode in ('no-op', 'bound'):
+                if mode == 'bound':
+                    metrics.create(METRICS_SHM)
+                loop[mode].append(hop_loop(hops))
+                alone[mode].append(updates(hops * 10))
+                metrics.close()
+    finally:
+        metrics.close()
+
+    print(f"{hops} hops of {hr_spo2.hop_size} samples, best of {runs} runs")
+    print(f"{'':<8}{'loop us/hop':>13}{'updates us/hop':>16}{'of the loop':>13}")
+    for mode in ('no-op', 'bound'):
+        per_hop = min(loop[mode])
+        cost = min(alone[mode])
+        print(f"{mode:<8}{per_hop * 1e6:>13.1f}{cost * 1e6:>16.2f}{cost / per_hop:>13.2%}")
+    print(f"loop time bound / no-op: {min(loop['bound']) / min(loop['no-op']):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Cost of the on-demand profiler (profiler.py) on the HR/SpO2 path: CPU
+time per hop of the collector loop (see bench_metrics.py) without the
+profiler, with it installed but idle, and while it samples every thread.
+
+First checks that a sample records the stack of a thread that burns CPU
+and leaves out one that waits.
+
+    python benchmarks/bench_profiler.py [hops] [runs]
+"""
+import os
+import sys
+import tempfile
+import threading
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'MAX30102'), os.path.dirname(os.path.abspath(__file__))]
+
+import profiler
+from bench_metrics import hop_loop
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def wait(stop):
+    stop.wait()
+
+
+def check_sampler():
+    """
+    A busy thread's stack is in the profile, an idle thread's is not.
+    """
+    stop = threading.Event()
+    threads = [threading.Thread(target=spin, args=(stop,), name='busy'),
+               threading.Thread(target=wait, args=(stop,), name='idle')]
+    for thread in threads:
+        thread.start()
+    sampler = profiler.StackSampler('check')
+    try:
+        sampler.run(0.5)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    busy = [stack for stack in sampler.stacks if stack.startswith('check;busy;')]
+    assert busy and all('spin (bench_profiler.py:' in stack for stack in busy), sampler.stacks
+    assert not any(stack.startswith('check;idle;') for stack in sampler.stacks), sampler.stacks
+    print(f"sampler: {sampler.samples} samples, {sum(sampler.stacks[stack] for stack in busy)} us "
+          f"in the busy thread, none in the idle one")
+
+
+def main():
+    hops = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    check_sampler()
+
+    loop = {'off': [], 'installed': [], 'sampling': []}
+    hop_loop(hops)  # warm-up
+    for _ in range(runs):
+        loop['off'].append(hop_loop(hops))
+    with tempfile.TemporaryDirectory() as directory:
+        # the signal handler and the control socket thread, idle
+        profiler.install('bench', sock_dir=directory)
+        for _ in range(runs):
+            loop['installed'].append(hop_loop(hops))
+        # a profile that outlasts the loop
+        seconds = 2 * min(loop['off']) * hops + 0.1
+        for _ in range(runs):
+            sampling = threading.Thread(target=profiler.profile, args=(seconds, directory))
+            sampling.start()
+            loop['sampling'].append(hop_loop(hops))
+            sampling.join()
+
+    print(f"\n{hops} hops, best of {runs} runs")
+    print(f"{'':<11}{'loop us/hop':>13}{'vs off':>9}")
+    for mode, times in loop.items():
+        print(f"{mode:<11}{min(times) * 1e6:>13.1f}{min(times) / min(loop['off']):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
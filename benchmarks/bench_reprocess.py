@@ -0,0 +1,143 @@
+"""
+Offline reprocessing (reprocess.py) of synthetic raw logs with 1, 2, 4 ...
+worker processes, up to the number of CPUs.
+
+Writes `hours` of PPG, IMU and temperature raw logs from the synthetic
+backends, checks that the HR/SpO2 averages and the alerts of a
+reprocessing run are those of a single pass of the collectors' monitors
+over the same samples, then times a run per worker count. The serial
+part (building the task list, calibration, the HR/SpO2 averaging in the
+parent) and the longest task bound the speedup.
+
+    python benchmarks/bench_reprocess.py [hours] [max workers]
+"""
+import os
+import sys
+import json
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path[:0] = [ROOT] + [os.path.join(ROOT, folder) for folder in ('Temperature', 'mpu9250', 'MAX30102')]
+
+import reprocess
+import sensor_backend
+import temperature_backends
+import imu_backends
+import ppg_backends
+import hrcalc
+import hr_spo2
+import accel_gyro
+import temperature
+from binlog import BinaryLogger
+from logquery import RAW_LOG_DIRS
+from max30102 import SAMPLE_RATE
+
+START = 1.7e9
+IMU_RATE = 100
+CHUNK = 25
+
+
+def write_raw_logs(logs_dir, seconds):
+    clock = sensor_backend.ScaledClock(0, START)
+    oximeter = ppg_backends.SyntheticPulseOximeter(clock)
+    log = BinaryLogger(os.path.join(logs_dir, RAW_LOG_DIRS['ppg']), hr_spo2.PPG_DTYPE, clock=clock, rollups=(), fsync=False)
+    records = np.zeros(hr_spo2.hop_size, dtype=hr_spo2.PPG_DTYPE)
+    for n in range(int(seconds * SAMPLE_RATE) // hr_spo2.hop_size):
+        records['red'], records['ir'] = oximeter.read_sequential(hr_spo2.hop_size)
+        records['time'] = START + (n * hr_spo2.hop_size + np.arange(hr_spo2.hop_size)) / float(SAMPLE_RATE)
+        log.write(records)
+    log.close()
+
+    clock = sensor_backend.ScaledClock(0, START)
+    stream = imu_backends.SyntheticImu(clock).stream(IMU_RATE)
+    log = BinaryLogger(os.path.join(logs_dir, RAW_LOG_DIRS['imu']), accel_gyro.IMU_DTYPE, clock=clock, rollups=(), fsync=False)
+    for _ in range(int(seconds * IMU_RATE) // CHUNK):
+        log.write([(timestamp,) + tuple(sample) for timestamp, sample in accel_gyro.take(stream, CHUNK)])
+    log.close()
+
+    clock = sensor_backend.ScaledClock(0, START)
+    thermometer = temperature_backends.SyntheticThermometer(clock)
+    log = BinaryLogger(os.path.join(logs_dir, RAW_LOG_DIRS['temperature']), temperature.TEMP_DTYPE, clock=clock,
+                       rollups=(), fsync=False)
+    for n in range(int(seconds)):
+        log.write([(START + n, probe, temp) for probe, temp in enumerate(thermometer.read_all())])
+    log.close()
+
+
+def single_pass(logs_dir):
+    """
+    HR/SpO2 averages and heart and tilt alerts of one pass of the
+    collectors' estimator and monitors over the PPG and IMU logs.
+    """
+    (path, _, _), = reprocess.RawLogs(os.path.join(logs_dir, RAW_LOG_DIRS['imu'])).files()
+    log = reprocess.BinaryLog(path)
+    calibration = reprocess.calibrate_imu(log)
+    length = len(log)
+    log.close()
+    tilt_alerts = [item for item in reprocess.tilt_window(path, 1, length, 0, calibration) if item[1]['alert']]
+
+    (path, _, _), = reprocess.RawLogs(os.path.join(logs_dir, RAW_LOG_DIRS['ppg'])).files()
+    log = reprocess.BinaryLog(path)
+    times, red, ir = (np.array(log.rows(name)) for name in ('time', 'red', 'ir'))
+    log.close()
+    clock = reprocess._Clock()
+    queue = reprocess._Sink(clock)
+    logger = reprocess._Sink(clock)
+    monitor = hr_spo2.HrSpo2Monitor(clock, queue, logger)
+    estimator = hrcalc.HrSpo2Stream(hop_size=hr_spo2.hop_size)
+    for n in range(0, len(times), hr_spo2.hop_size):
+        clock.now = times[n + hr_spo2.hop_size - 1]
+        monitor.add_estimate(estimator.update(red[n:n + hr_spo2.hop_size], ir[n:n + hr_spo2.hop_size]))
+    return logger.items, [item for item in queue.items if item[1]['alert']], tilt_alerts
+
+
+def read_csv(path):
+    with open(path) as f:
+        return f.read().splitlines()[1:]
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    with tempfile.TemporaryDirectory() as directory:
+        logs_dir = os.path.join(directory, 'logs')
+        write_raw_logs(logs_dir, hours * 3600)
+
+        start = time.perf_counter()
+        tasks = reprocess.make_tasks(logs_dir)
+        tasks_time = time.perf_counter() - start
+        task_times = []
+        for _, _, task in tasks:
+            start = time.perf_counter()
+            reprocess._run(task)
+            task_times.append(time.perf_counter() - start)
+        print(f"{hours:g} h of raw logs: {len(tasks)} tasks, {sum(task_times):.1f} s of work "
+              f"(longest {max(task_times):.2f} s), task list {tasks_time:.2f} s, {os.cpu_count()} CPUs")
+
+        print(f"\n{'workers':>8}{'s':>8}{'speedup':>9}")
+        workers = 1
+        base = None
+        while workers <= max_workers:
+            out_dir = os.path.join(directory, f'out_{workers}')
+            start = time.perf_counter()
+            rows = reprocess.reprocess(logs_dir, out_dir, workers=workers)
+            elapsed = time.perf_counter() - start
+            base = base or elapsed
+            print(f"{workers:>8}{elapsed:>8.2f}{base / elapsed:>9.2f}")
+            workers *= 2
+
+        averages, heart_alerts, tilt_alerts = single_pass(logs_dir)
+        derived = read_csv(os.path.join(out_dir, 'hr_spo2.csv'))
+        alerts = read_csv(os.path.join(out_dir, 'alerts.csv'))
+        assert [row.split(',')[1] for row in derived] == [str(json.loads(value)['hr']) for _, value in averages]
+        assert len([row for row in alerts if ',heart,' in row]) == len(heart_alerts)
+        assert [row.split(',')[-1] for row in alerts if ',gyroscope,' in row] == [m['alert'] for _, m in tilt_alerts]
+        print(f"\noutput: {rows}; HR/SpO2 averages and alerts match a single pass")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Memory and CPU of the two runtimes of main.py on the same replayed sensor
+data: one supervised process per sensor (supervisor.py) and one asyncio
+process (async_runtime.py). Each run is main.main() with SLUMBER_RUNTIME
+set, so it includes the rings, the metrics endpoint and the profiler;
+only the BLE server is replaced by a consumer that drains the queue, as
+the Bluetooth stack is not needed for the comparison. Do not run it next
+to a running main.py, whose rings and metrics block it would replace.
+
+Replay files are generated from the synthetic backends, then each runtime
+runs in a fresh interpreter for `seconds` of replayed time at SLUMBER_SPEED
+`speed`. Memory is sampled every half second over the whole process tree:
+RSS counts pages shared between forked processes once per process, PSS
+splits them between the processes, so it is the fairer total.
+
+    python benchmarks/bench_runtime.py [seconds] [speed]
+"""
+import csv
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path[:0] = [ROOT] + [os.path.join(ROOT, folder) for folder in ('Temperature', 'mpu9250', 'MAX30102')]
+
+import sensor_backend
+import temperature_backends
+import imu_backends
+import ppg_backends
+from max30102 import SAMPLE_RATE
+
+IMU_RATE = 100
+SAMPLE_INTERVAL = 0.5  # seconds between two memory samples
+START = 1.7e9
+
+RUNNER = '''
+import sys, threading, queue as queue_module
+sys.path.insert(0, {root!r})
+import main
+
+stopping = threading.Event()
+
+def consume(queue, heartbeat=None):
+    # stands in for the BLE server
+    while not stopping.is_set():
+        if heartbeat:
+            heartbeat.beat()
+        try:
+            queue.get(timeout=0.5)
+        except queue_module.Empty:
+            pass
+
+main.main(consume, stopping.set)
+'''
+
+
+def write_replay_files(directory, seconds):
+    clock = sensor_backend.ScaledClock(0, START)
+    thermometer = temperature_backends.SyntheticThermometer(clock)
+    with open(os.path.join(directory, temperature_backends.REPLAY_FILE), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Time', 'Probe 1', 'Probe 2'])
+        for n in range(int(seconds)):
+            writer.writerow([START + n] + thermometer.read_all())
+
+    clock = sensor_backend.ScaledClock(0, START)
+    stream = imu_backends.SyntheticImu(clock).stream(IMU_RATE)
+    with open(os.path.join(directory, imu_backends.REPLAY_FILE), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Time', 'ax', 'ay', 'az', 'temp', 'gx', 'gy', 'gz'])
+        for _ in range(int(seconds * IMU_RATE)):
+            timestamp, sample = next(stream)
+            writer.writerow([timestamp] + list(sample))
+
+    clock = sensor_backend.ScaledClock(0, START)
+    red, ir = ppg_backends.SyntheticPulseOximeter(clock).read_sequential(int(seconds * SAMPLE_RATE))
+    with open(os.path.join(directory, ppg_backends.REPLAY_FILE), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Time', 'Red', 'IR'])
+        for n, (r, i) in enumerate(zip(red, ir)):
+            writer.writerow([START + n / float(SAMPLE_RATE), r, i])
+
+
+def process_tree(pid):
+    """
+    `pid` and all its descendants.
+    """
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    tree = [pid]
+    for parent in tree:
+        tree.extend(children.get(parent, []))
+    return tree
+
+
+def memory_kb(pids):
+    """
+    Summed (RSS, PSS) in kB of `pids`.
+    """
+    rss = pss = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/smaps_rollup') as f:
+                for line in f:
+                    if line.startswith('Rss:'):
+                        rss += int(line.split()[1])
+                    elif line.startswith('Pss:'):
+                        pss += int(line.split()[1])
+        except OSError:
+            pass
+    return rss, pss
+
+
+def run(mode, replay_dir, seconds, speed):
+    env = dict(os.environ, SLUMBER_BACKEND='replay', SLUMBER_REPLAY_DIR=replay_dir, SLUMBER_SPEED=str(speed),
+               SLUMBER_RUNTIME=mode)
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    with tempfile.TemporaryDirectory() as log_dir:
+        process = subprocess.Popen([sys.executable, '-c', RUNNER.format(root=ROOT)],
+                                   cwd=log_dir, env=env, stdout=subprocess.DEVNULL)
+        samples = []
+        deadline = time.monotonic() + seconds / speed
+        while time.monotonic() < deadline:
+            time.sleep(SAMPLE_INTERVAL)
+            pids = process_tree(process.pid)
+            samples.append((len(pids),) + memory_kb(pids))
+        process.terminate()
+        process.wait()
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+
+    # skip the first seconds of start-up
+    steady = samples[len(samples) // 4:]
+    return {
+        'processes': max(s[0] for s in steady),
+        'rss_kb': sum(s[1] for s in steady) / len(steady),
+        'pss_kb': sum(s[2] for s in steady) / len(steady),
+        'cpu_s': cpu,
+    }
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 60
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    with tempfile.TemporaryDirectory() as replay_dir:
+        # longer than the run, so the replay does not end before it
+        write_replay_files(replay_dir, seconds + 60)
+        print(f"{seconds:.0f} s of replayed data at speed {speed:g}")
+        print(f"{'':<11}{'processes':>10}{'RSS MiB':>10}{'PSS MiB':>10}{'CPU s':>8}{'CPU %':>8}")
+        for mode in ('processes', 'asyncio'):
+            result = run(mode, replay_dir, seconds, speed)
+            print(f"{mode:<11}{result['processes']:>10}{result['rss_kb'] / 1024:>10.1f}"
+                  f"{result['pss_kb'] / 1024:>10.1f}{result['cpu_s']:>8.2f}"
+                  f"{100 * result['cpu_s'] / (seconds / speed):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
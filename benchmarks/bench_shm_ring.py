@@ -0,0 +1,125 @@
+"""
+Moving raw IMU samples from a collector process to another process:
+a multiprocessing.Queue with one pickled message per sample (as the
+alerts go), one per batch, and the shared-memory SampleRing (shm_ring.py).
+Reports samples/s and the CPU time each side spends per sample.
+
+    python benchmarks/bench_shm_ring.py [samples]
+"""
+import os
+import sys
+import time
+from multiprocessing import Process, Queue, Pipe
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from shm_ring import SampleRing
+
+IMU_DTYPE = [('time', 'f8')] + [(field, 'f4') for field in ('ax', 'ay', 'az', 'temp', 'gx', 'gy', 'gz')]
+BATCH = 25
+RING_NAME = 'slumber_bench_ring'
+RING_CAPACITY = 1 << 16
+
+
+def cpu_time():
+    times = os.times()
+    return times.user + times.system
+
+
+def make_samples(count):
+    samples = np.zeros(count, dtype=IMU_DTYPE)
+    samples['time'] = np.arange(count) / 1000.0
+    for field in ('ax', 'ay', 'az', 'gx', 'gy', 'gz'):
+        samples[field] = np.random.standard_normal(count)
+    return samples
+
+
+def queue_producer(queue, samples, batch, cpu):
+    start = cpu_time()
+    if batch == 1:
+        for sample in samples.tolist():
+            queue.put(sample)
+    else:
+        rows = samples.tolist()
+        for i in range(0, len(rows), batch):
+            queue.put(rows[i:i + batch])
+    queue.put(None)
+    cpu.send(cpu_time() - start)
+
+
+def ring_producer(samples, batch, cpu):
+    ring = SampleRing.attach(RING_NAME, IMU_DTYPE)
+    start = cpu_time()
+    for i in range(0, len(samples), batch):
+        ring.write(samples[i:i + batch])
+        # stay within the ring like a real collector, which is far slower
+        # than the consumer
+        while ring.available() > RING_CAPACITY - batch:
+            time.sleep(0)
+    cpu.send(cpu_time() - start)
+    ring.close()
+
+
+def run_queue(samples, batch):
+    queue = Queue()
+    cpu_recv, cpu_send = Pipe(duplex=False)
+    producer = Process(target=queue_producer, args=(queue, samples, batch, cpu_send))
+    start, cpu_start = time.perf_counter(), cpu_time()
+    producer.start()
+    received = 0
+    while True:
+        item = queue.get()
+        if item is None:
+            break
+        received += 1 if batch == 1 else len(item)
+    elapsed, consumer_cpu = time.perf_counter() - start, cpu_time() - cpu_start
+    producer_cpu = cpu_recv.recv()
+    producer.join()
+    return received, elapsed, producer_cpu, consumer_cpu
+
+
+def run_ring(samples, batch):
+    ring = SampleRing.create(RING_NAME, IMU_DTYPE, RING_CAPACITY)
+    cpu_recv, cpu_send = Pipe(duplex=False)
+    producer = Process(target=ring_producer, args=(samples, batch, cpu_send))
+    start, cpu_start = time.perf_counter(), cpu_time()
+    producer.start()
+    received = 0
+    checksum = 0.0
+    while received < len(samples):
+        view, lost = ring.read()
+        if lost:
+            raise RuntimeError(f"consumer lost {lost} samples")
+        if len(view):
+            # touch the data like a consumer would
+            checksum += float(view['ax'].sum())
+            received += len(view)
+        else:
+            time.sleep(0)
+    elapsed, consumer_cpu = time.perf_counter() - start, cpu_time() - cpu_start
+    producer_cpu = cpu_recv.recv()
+    producer.join()
+    ring.close()
+    return received, elapsed, producer_cpu, consumer_cpu
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    samples = make_samples(count)
+
+    print(f"{count} samples of {np.dtype(IMU_DTYPE).itemsize} bytes")
+    print(f"{'':<20}{'samples/s':>12}{'producer us':>14}{'consumer us':>14}")
+    for name, run, batch in (('queue per sample', run_queue, 1),
+                             (f'queue per {BATCH}', run_queue, BATCH),
+                             (f'ring per {BATCH}', run_ring, BATCH)):
+        received, elapsed, producer_cpu, consumer_cpu = run(samples, batch)
+        assert received == count
+        print(f"{name:<20}{count / elapsed:>12.0f}{producer_cpu / count * 1e6:>14.2f}"
+              f"{consumer_cpu / count * 1e6:>14.2f}")
+    print("us: CPU microseconds per sample (the ring consumer also busy-polls)")
+
+
+if __name__ == "__main__":
+    main()
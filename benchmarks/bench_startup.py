@@ -0,0 +1,124 @@
+"""
+Time from starting a fresh interpreter to the first sample of each sensor,
+split into importing the collector module (what main.py does before it
+starts the processes), opening the sensor and reading the first sample.
+The last column is a collector restart: a process forked from a parent
+that already imported the module, so it only opens the sensor and reads.
+Also times importing main.py itself, which fails loudly if its imports
+are broken.
+
+    python benchmarks/bench_startup.py [runs]
+
+Uses the backend from SLUMBER_BACKEND (see sensor_backend.py), so run it
+on the Pi for the real sensors, or off-device with e.g.
+    SLUMBER_BACKEND=synthetic SLUMBER_SPEED=0 python benchmarks/bench_startup.py
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# sensor: (collector folder, module, opener, first sample from the opened sensor)
+SENSORS = {
+    'temperature': ('Temperature', 'temperature', 'get_thermometer', 'sensor.read_all()'),
+    'gyroscope': ('mpu9250', 'accel_gyro', 'get_imu', 'next(sensor.stream())'),
+    'hr_spo2': ('MAX30102', 'hr_spo2', 'get_sensor', 'sensor.read_sequential(1)'),
+}
+
+PROBE = '''
+import json, os, sys, time
+t0 = float(sys.argv[1])
+sys.path[:0] = [{root!r}, os.path.join({root!r}, {folder!r})]
+start = time.time()
+import {module}
+imported = time.time()
+
+def first_sample():
+    begin = time.time()
+    sensor, clock = {module}.{opener}()
+    opened = time.time()
+    {sample}
+    return opened - begin, time.time() - opened
+
+open_time, sample_time = first_sample()
+done = time.time()
+
+# restart: a forked child of this process, which has the module imported
+# but not the sensor (that is cached per process)
+r, w = os.pipe()
+fork_start = time.time()
+pid = os.fork()
+if pid == 0:
+    os.close(r)
+    first_sample()
+    os.write(w, b'x')
+    os._exit(0)
+os.close(w)
+os.read(r, 1)
+restart = time.time() - fork_start
+os.waitpid(pid, 0)
+
+print(json.dumps({{
+    'interpreter': start - t0,
+    'import': imported - start,
+    'open': open_time,
+    'first_sample': sample_time,
+    'total': done - t0,
+    'restart': restart,
+}}))
+'''
+
+
+MAIN_PROBE = '''
+import sys, time
+sys.path.insert(0, {root!r})
+start = time.time()
+import main
+print(time.time() - start)
+'''
+
+
+def measure_main():
+    """
+    Seconds to import main.py (the collectors, supervisor, metrics and
+    profiler; the BLE server is imported when it starts).
+    """
+    result = subprocess.run([sys.executable, '-c', MAIN_PROBE.format(root=ROOT)],
+                            capture_output=True, text=True, cwd=ROOT)
+    if result.returncode != 0:
+        raise RuntimeError(f"importing main.py failed:\n{result.stderr.strip()}")
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def measure(folder, module, opener, sample):
+    code = PROBE.format(root=ROOT, folder=folder, module=module, opener=opener, sample=sample)
+    result = subprocess.run([sys.executable, '-c', code, repr(time.time())],
+                            capture_output=True, text=True, cwd=ROOT)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    columns = ['interpreter', 'import', 'open', 'first_sample', 'total', 'restart']
+
+    print(f"backend: {os.environ.get('SLUMBER_BACKEND', 'real')}, best of {runs} runs, ms")
+    print(f"{'sensor':<12}" + ''.join(f"{c:>14}" for c in columns))
+    for name, (folder, module, opener, sample) in SENSORS.items():
+        try:
+            results = [measure(folder, module, opener, sample) for _ in range(runs)]
+        except RuntimeError as e:
+            print(f"{name:<12}  failed: {e}")
+            continue
+        best = min(results, key=lambda r: r['total'])
+        print(f"{name:<12}" + ''.join(f"{best[c] * 1000:>14.1f}" for c in columns))
+
+    print(f"\nimport main.py: {min(measure_main() for _ in range(runs)) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
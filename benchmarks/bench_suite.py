@@ -0,0 +1,539 @@
+"""
+Regression suite for the hot paths: the HR/SpO2 estimation (hrcalc.py),
+the sensor decoding (MAX30102 FIFO, MPU-9250 registers), the monitors,
+and the latency from a sample to its alert on the BLE characteristic.
+
+Every function runs over deterministic synthetic fixtures (clean, noisy,
+motion artifacts and, for the PPG, low perfusion) and reports latency
+percentiles per call, throughput and the memory allocated per call
+(tracemalloc, in a separate pass as it slows every allocation down).
+The end-to-end runs read from stub hardware (fake_smbus.FakeSMBus, a
+register stub of the MPU-9250 and SyntheticThermometer), put the alerts
+on a multiprocessing queue and send them through ble_queue.send_from_queue
+to a stub characteristic that encodes and fragments them as
+ble_server.py does, without D-Bus.
+
+Results go to a JSON file; with a baseline file from an earlier run, the
+change of each median and throughput is printed as well.
+
+    python benchmarks/bench_suite.py [output.json] [baseline.json] [repeat]
+"""
+import contextlib
+import ctypes
+import datetime
+import io
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import struct
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from multiprocessing import Queue
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path[:0] = [ROOT] + [os.path.join(ROOT, folder) for folder in ('MAX30102', 'mpu9250', 'Temperature', 'BLE')]
+
+import sensor_backend
+import hrcalc
+import max30102
+import hr_spo2
+import accel_gyro
+import imu_backends
+import temperature
+import temperature_backends
+import ble_queue
+import ble_wire
+from fake_smbus import FakeSMBus
+from ppg_backends import synthetic_ppg
+from bench_ble_queue import ThreadLoop
+
+PPG_FIXTURES = ('clean', 'noisy', 'motion', 'low_perfusion')
+IMU_FIXTURES = ('clean', 'noisy', 'motion')
+TEMPERATURE_FIXTURES = ('clean', 'noisy')
+
+PPG_SECONDS = 120
+IMU_SECONDS = 60
+TEMPERATURE_READINGS = 600
+START = 1.7e9
+
+# alerts per sensor in the end-to-end runs, and how long to wait for one
+E2E_ALERTS = 20
+EMIT_TIMEOUT = 5.0  # seconds
+
+# 18-bit ADC of the MAX30102
+PPG_MAX = 0x3FFFF
+
+
+# --- fixtures ---
+
+def ppg_fixture(kind, seconds=PPG_SECONDS, seed=0):
+    """
+    (red, ir) int64 arrays of a 72 BPM PPG signal at the sensor's sample rate.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * max30102.SAMPLE_RATE)
+    if kind == 'low_perfusion':
+        # AC about 0.15% of DC instead of 1%
+        signal = synthetic_ppg(ir_ac=150, red_ac=90)
+    else:
+        signal = synthetic_ppg()
+    red, ir = (np.array(column, dtype=np.float64) for column in zip(*itertools.islice(signal, n)))
+
+    noise = 300 if kind == 'noisy' else 20
+    red += rng.normal(0, noise, n)
+    ir += rng.normal(0, noise, n)
+
+    if kind == 'motion':
+        # a 2 s movement every 10 s or so: large slow swings and a baseline shift
+        t = np.arange(n) / float(max30102.SAMPLE_RATE)
+        onsets = np.arange(5, seconds - 2, 10)
+        for onset in onsets + rng.uniform(-2, 2, len(onsets)):
+            part = (t >= onset) & (t < onset + 2)
+            swing = rng.uniform(3000, 8000) * np.sin(2 * np.pi * rng.uniform(1, 3) * (t[part] - onset))
+            red[part] += 0.8 * swing
+            ir[part] += swing
+            shift = t >= onset + 2
+            red[shift] += rng.normal(0, 500)
+            ir[shift] += rng.normal(0, 500)
+
+    return (np.clip(red, 0, PPG_MAX).astype(np.int64), np.clip(ir, 0, PPG_MAX).astype(np.int64))
+
+
+def imu_fixture(kind, seconds=IMU_SECONDS, seed=0, **settings):
+    """
+    (timestamp, sample) pairs of SyntheticImu at STREAM_RATE, in accel_gyro.Sample units.
+    """
+    if kind == 'noisy':
+        settings.update(accel_noise=0.5, gyro_noise=2.0)
+    imu = imu_backends.SyntheticImu(sensor_backend.ScaledClock(0, START), seed=seed, **settings)
+    samples = accel_gyro.take(imu.stream(accel_gyro.STREAM_RATE), int(seconds * accel_gyro.STREAM_RATE))
+
+    if kind == 'motion':
+        # a 0.2 s jolt every 3 s or so, on the accelerometer and the gyro
+        rng = random.Random(seed)
+        jolted = []
+        next_jolt = samples[0][0] + rng.uniform(1, 3)
+        for timestamp, sample in samples:
+            if timestamp >= next_jolt + 0.2:
+                next_jolt = timestamp + rng.uniform(2, 4)
+            if timestamp >= next_jolt:
+                sample = tuple(value + rng.uniform(-6, 6) for value in sample[0:3]) + (sample[3],) + \
+                    tuple(value + rng.uniform(-60, 60) for value in sample[4:7])
+            jolted.append((timestamp, sample))
+        samples = jolted
+    return samples
+
+
+def raw_imu_sample(sample):
+    """
+    accel_gyro.Sample units to the raw int16 register values.
+    """
+    ax, ay, az, temp, gx, gy, gz = sample
+    raw = [a / accel_gyro.GRAVITY * accel_gyro.ACCEL_SCALE for a in (ax, ay, az)]
+    raw.append((temp - accel_gyro.TEMP_OFFSET) * accel_gyro.TEMP_SCALE)
+    raw += [g * accel_gyro.GYRO_SCALE for g in (gx, gy, gz)]
+    return tuple(max(-32768, min(32767, int(round(value)))) for value in raw)
+
+
+def temperature_fixture(kind, readings=TEMPERATURE_READINGS, seed=0, **settings):
+    """
+    `readings` read_all() results of SyntheticThermometer.
+    """
+    if kind == 'noisy':
+        settings.update(noise=0.3, drift=0.05)
+    thermometer = temperature_backends.SyntheticThermometer(sensor_backend.ScaledClock(0, START), seed=seed,
+                                                             **settings)
+    return [thermometer.read_all() for _ in range(readings)]
+
+
+# --- stub hardware ---
+
+class MpuBus():
+    """
+    Stand-in for the smbus2.SMBus of accel_gyro: every combined read
+    returns the registers of the next raw sample in `raw_samples`
+    (accel, temp, gyro from ACCEL_XOUT_H), over and over.
+    """
+    def __init__(self, raw_samples):
+        self.images = itertools.cycle([struct.pack(accel_gyro.SAMPLE_FORMAT, *raw) for raw in raw_samples])
+
+    def i2c_rdwr(self, *i2c_msgs):
+        reg = None
+        for msg in i2c_msgs:
+            if msg.flags & 0x0001:  # I2C_M_RD
+                offset = reg - accel_gyro.ACCEL_XOUT_H
+                ctypes.memmove(msg.buf, next(self.images)[offset:offset + msg.len], msg.len)
+            else:
+                reg = list(msg)[0]
+
+
+class BusClock():
+    """
+    time() of a FakeSMBus, for the monitors.
+    """
+    def __init__(self, bus):
+        self.bus = bus
+
+    def time(self):
+        return START + self.bus.time
+
+
+class NullQueue():
+    def put(self, msg):
+        pass
+
+
+def ppg_bus(red, ir):
+    bus = FakeSMBus(source=itertools.cycle(list(zip(red.tolist(), ir.tolist()))))
+    return bus, max30102.MAX30102(bus=bus, sleep=bus.sleep)
+
+
+# --- harness ---
+
+def percentiles(values, scale):
+    values = np.asarray(values, dtype=np.float64) * scale
+    p50, p90, p99 = np.percentile(values, (50, 90, 99))
+    return {'p50': round(p50, 3), 'p90': round(p90, 3), 'p99': round(p99, 3), 'max': round(values.max(), 3),
+            'mean': round(values.mean(), 3)}
+
+
+def measure(name, fixture, setup, inputs, repeat, items=1, unit='calls'):
+    """
+    Time the function that setup() returns on every args tuple of
+    `inputs`, `repeat` times (after one warm-up pass), each pass with a
+    fresh setup() for functions with state. Returns the result dict.
+    """
+    clock = time.perf_counter_ns
+    latencies = []
+    for n in range(repeat + 1):
+        function = setup()
+        for args in inputs:
+            start = clock()
+            function(*args)
+            elapsed = clock() - start
+            if n:
+                latencies.append(elapsed)
+
+    function = setup()
+    peaks = []
+    retained = []
+    tracemalloc.start()
+    for args in inputs:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        function(*args)
+        current, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - before)
+        retained.append(current - before)
+    tracemalloc.stop()
+
+    calls_per_s = len(latencies) / (sum(latencies) / 1e9)
+    return {
+        'name': name,
+        'fixture': fixture,
+        'calls': len(latencies),
+        'latency_us': percentiles(latencies, 1e-3),
+        'calls_per_s': round(calls_per_s, 1),
+        'throughput': round(calls_per_s * items, 1),
+        'throughput_unit': unit + '/s',
+        'alloc_peak_bytes': round(float(np.mean(peaks)), 1),
+        'alloc_retained_bytes': round(float(np.mean(retained)), 1),
+    }
+
+
+def stateless(function):
+    return lambda: function
+
+
+def ppg_benchmarks(kind, repeat):
+    red, ir = ppg_fixture(kind)
+    size = hrcalc.BUFFER_SIZE
+    hop = hr_spo2.hop_size
+    windows = [(ir[i:i + size], red[i:i + size]) for i in range(0, len(ir) - size + 1, hop)]
+    filtered = [hrcalc._inverted_moving_average(ir_window) for ir_window, _ in windows]
+    thresholds = [hrcalc._valley_threshold(x) for x in filtered]
+    candidates = [hrcalc.find_peaks_above_min_height(x, size, n_th, hrcalc.MAX_NUM_PEAKS)
+                  for x, n_th in zip(filtered, thresholds)]
+    hops = [(red[i:i + hop], ir[i:i + hop]) for i in range(0, len(ir) - hop + 1, hop)]
+    fifo = bytearray()
+    for r, i in zip(red.tolist(), ir.tolist()):
+        fifo += r.to_bytes(3, 'big') + i.to_bytes(3, 'big')
+    fifo_bytes = max30102.FIFO_DEPTH * max30102.BYTES_PER_SAMPLE
+    fifo_reads = [(bytes(fifo[i:i + fifo_bytes]),) for i in range(0, len(fifo) - fifo_bytes + 1, fifo_bytes)]
+
+    def read_fifo():
+        bus, sensor = ppg_bus(red, ir)
+        def read():
+            # one sample period, so there is a new sample in the FIFO
+            bus.sleep(1.0 / max30102.SAMPLE_RATE)
+            return sensor.read_fifo()
+        return read
+
+    def read_sequential():
+        _, sensor = ppg_bus(red, ir)
+        return sensor.read_sequential
+
+    yield measure('hrcalc.calc_hr_and_spo2', kind, stateless(hrcalc.calc_hr_and_spo2), windows, repeat,
+                  size, 'samples')
+    yield measure('hrcalc.find_peaks', kind, stateless(hrcalc.find_peaks),
+                  [(x, size, n_th, hrcalc.MIN_PEAK_DIST, hrcalc.MAX_NUM_PEAKS) for x, n_th in zip(filtered, thresholds)],
+                  repeat)
+    yield measure('hrcalc.remove_close_peaks', kind, stateless(hrcalc.remove_close_peaks),
+                  [(n_peaks, locs, x, hrcalc.MIN_PEAK_DIST) for (locs, n_peaks), x in zip(candidates, filtered)],
+                  repeat)
+    yield measure('hrcalc.HrSpo2Stream.update', kind, lambda: hrcalc.HrSpo2Stream(hop_size=hop).update, hops,
+                  repeat, hop, 'samples')
+    yield measure('max30102.decode_samples', kind, stateless(max30102.decode_samples), fifo_reads, repeat,
+                  max30102.FIFO_DEPTH, 'samples')
+    yield measure('MAX30102.read_fifo (FakeSMBus)', kind, read_fifo, [()] * len(hops), repeat, 1, 'samples')
+    yield measure('MAX30102.read_sequential (FakeSMBus)', kind, read_sequential, [(hop,)] * len(hops), repeat,
+                  hop, 'samples')
+
+
+def imu_benchmarks(kind, repeat):
+    samples = imu_fixture(kind)
+    raw_samples = [raw_imu_sample(sample) for _, sample in samples]
+
+    def on_bus(function):
+        def setup():
+            accel_gyro.i2c = MpuBus(raw_samples)
+            return function
+        return setup
+
+    reads = [()] * len(samples)
+    yield measure('accel_gyro.read_word_2c', kind, on_bus(accel_gyro.read_word_2c),
+                  [(accel_gyro.ACCEL_XOUT_H + 4,)] * len(samples), repeat)
+    yield measure('accel_gyro.read_raw_sample', kind, on_bus(accel_gyro.read_raw_sample), reads, repeat)
+    yield measure('accel_gyro.read_sample', kind, on_bus(accel_gyro.read_sample), reads, repeat)
+    yield measure('accel_gyro.TiltMonitor.add', kind, lambda: accel_gyro.TiltMonitor(samples[0], NullQueue()).add,
+                  samples[1:], repeat)
+
+
+def temperature_benchmarks(kind, repeat):
+    readings = [(temps,) for temps in temperature_fixture(kind)]
+
+    def setup():
+        clock = sensor_backend.ScaledClock(0, START)
+        return temperature.TemperatureMonitor(clock, NullQueue()).add
+
+    yield measure('temperature.TemperatureMonitor.add', kind, setup, readings, repeat)
+
+
+# --- end to end ---
+
+class TimedQueue():
+    """
+    The multiprocessing queue to the BLE consumer, remembering when the
+    last alert was put on it.
+    """
+    def __init__(self):
+        self.queue = Queue()
+        self.alert_put = None
+
+    def put(self, msg):
+        if msg.get('alert'):
+            self.alert_put = time.perf_counter()
+        self.queue.put(msg)
+
+
+class StubCharacteristic():
+    """
+    Encodes and fragments each notification as ble_server.py's
+    Characteristic does, and records when the last one was emitted.
+    """
+    def __init__(self, mtu=ble_wire.DEFAULT_MTU):
+        self.mtu = mtu
+        self.seq = 0
+        self.frame_seq = 0
+        self.emit_time = None
+        self.emitted = threading.Event()
+
+    def send_notification(self, message):
+        frames = ble_wire.fragment(ble_wire.encode_message(message, self.seq), self.mtu, self.frame_seq)
+        self.seq += 1
+        self.frame_seq += len(frames)
+        self.emit_time = time.perf_counter()
+        self.emitted.set()
+
+
+def heart_path(queue):
+    """
+    One hop per step: FIFO read on a FakeSMBus, estimate, HrSpo2Monitor.
+    72 BPM is below hr_low, so every 10th estimate raises an alert.
+    """
+    red, ir = ppg_fixture('clean')
+    bus, sensor = ppg_bus(red, ir)
+    monitor = hr_spo2.HrSpo2Monitor(BusClock(bus), queue)
+    estimator = hrcalc.HrSpo2Stream(hop_size=hr_spo2.hop_size)
+
+    def step():
+        monitor.last_alert_time = -math.inf  # no spacing between alerts
+        red, ir = sensor.read_sequential(hr_spo2.hop_size)
+        monitor.add_samples(red, ir)
+        monitor.add_estimate(estimator.update(red, ir))
+    return step
+
+
+def tilt_path(queue):
+    """
+    One sample per step: register read on the MPU stub, TiltMonitor.
+    The sensor rolls to 45° for 35 s of every 80 s, longer than TILT_CONFIRM_TIME.
+    """
+    samples = imu_fixture('clean', 80, period=80.0, tilt_duration=35.0)
+    accel_gyro.i2c = MpuBus([raw_imu_sample(sample) for _, sample in samples])
+    times = itertools.count(samples[0][0], 1.0 / accel_gyro.STREAM_RATE)
+    monitor = accel_gyro.TiltMonitor((next(times), accel_gyro.read_sample()), queue)
+    return lambda: monitor.add(next(times), accel_gyro.read_sample())
+
+
+def temperature_path(queue):
+    """
+    One reading per step: SyntheticThermometer at 39.5 °C, TemperatureMonitor.
+    Every 60th reading raises an overheat alert.
+    """
+    clock = sensor_backend.ScaledClock(0, START)
+    thermometer = temperature_backends.SyntheticThermometer(clock, mean=39.5)
+    monitor = temperature.TemperatureMonitor(clock, queue)
+    return lambda: monitor.add(thermometer.read_all())
+
+
+def end_to_end(name, make_step, alerts=E2E_ALERTS):
+    """
+    Sample-to-emit latency of `alerts` alerts, one in flight at a time:
+    from the start of the step that raises the alert to queue.put and
+    on to the stub characteristic.
+    """
+    queue = TimedQueue()
+    characteristic = StubCharacteristic()
+    loop = ThreadLoop()
+    loop.thread.start()
+    stop = threading.Event()
+    consumer = threading.Thread(target=ble_queue.send_from_queue,
+                                args=(queue.queue, characteristic, loop.schedule, stop), daemon=True)
+    step = make_step(queue)
+
+    totals = []
+    computes = []
+    transports = []
+    steps = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        consumer.start()
+        while len(totals) < alerts:
+            queue.alert_put = None
+            start = time.perf_counter()
+            step()
+            steps += 1
+            if queue.alert_put is None:
+                continue
+            if not characteristic.emitted.wait(EMIT_TIMEOUT):
+                raise RuntimeError(f"{name}: alert was not emitted within {EMIT_TIMEOUT} s")
+            characteristic.emitted.clear()
+            totals.append(characteristic.emit_time - start)
+            computes.append(queue.alert_put - start)
+            transports.append(characteristic.emit_time - queue.alert_put)
+        stop.set()
+        consumer.join()
+
+    return {
+        'name': name,
+        'alerts': len(totals),
+        'steps': steps,
+        'latency_ms': percentiles(totals, 1e3),
+        'sample_to_put_ms': percentiles(computes, 1e3),
+        'put_to_emit_ms': percentiles(transports, 1e3),
+    }
+
+
+# --- output ---
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(repeat):
+    return {
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'repeat': repeat,
+    }
+
+
+def change(new, old):
+    if not old:
+        return ''
+    return f"{(new - old) / old * 100:+.0f}%"
+
+
+def print_results(results, baseline=None):
+    old = {(r['name'], r['fixture']): r for r in baseline['functions']} if baseline else {}
+    print(f"{'':<38}{'fixture':<15}{'p50 us':>9}{'p99 us':>9}{'calls/s':>11}{'peak B':>9}"
+          + (f"{'p50':>7}{'thru':>7}" if baseline else ''))
+    for r in results['functions']:
+        line = (f"{r['name']:<38}{r['fixture']:<15}{r['latency_us']['p50']:>9.1f}{r['latency_us']['p99']:>9.1f}"
+                f"{r['calls_per_s']:>11,.0f}{r['alloc_peak_bytes']:>9,.0f}")
+        before = old.get((r['name'], r['fixture']))
+        if before:
+            line += (f"{change(r['latency_us']['p50'], before['latency_us']['p50']):>7}"
+                     f"{change(r['throughput'], before['throughput']):>7}")
+        print(line)
+
+    old = {r['name']: r for r in baseline['end_to_end']} if baseline else {}
+    print(f"\n{'end to end':<14}{'alerts':>7}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'to put p50':>12}"
+          f"{'to emit p50':>13}" + (f"{'p50':>7}" if baseline else ''))
+    for r in results['end_to_end']:
+        line = (f"{r['name']:<14}{r['alerts']:>7}{r['latency_ms']['p50']:>9.2f}{r['latency_ms']['p99']:>9.2f}"
+                f"{r['latency_ms']['max']:>9.2f}{r['sample_to_put_ms']['p50']:>12.3f}"
+                f"{r['put_to_emit_ms']['p50']:>13.3f}")
+        before = old.get(r['name'])
+        if before:
+            line += f"{change(r['latency_ms']['p50'], before['latency_ms']['p50']):>7}"
+        print(line)
+
+
+def main():
+    output = sys.argv[1] if len(sys.argv) > 1 else 'bench_suite.json'
+    baseline_path = sys.argv[2] if len(sys.argv) > 2 and sys.argv[2] != '-' else None
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    functions = []
+    for kind in PPG_FIXTURES:
+        functions += ppg_benchmarks(kind, repeat)
+    for kind in IMU_FIXTURES:
+        functions += imu_benchmarks(kind, repeat)
+    for kind in TEMPERATURE_FIXTURES:
+        functions += temperature_benchmarks(kind, repeat)
+
+    paths = [end_to_end('heart', heart_path), end_to_end('gyroscope', tilt_path),
+             end_to_end('temperature', temperature_path)]
+
+    results = {'meta': metadata(repeat), 'functions': functions, 'end_to_end': paths}
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    print(f"\nresults written to {output}" + (f", compared with {baseline_path}" if baseline else ''))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Tilt alerts of TiltMonitor (fused orientation, TILT_CONFIRM_TIME) against
+the accelerometer-only check it replaced (atan2(ay, az), 30 s), over the
+noisy and motion IMU fixtures of bench_suite.py.
+
+Each fixture runs with the sensor lying still, with short turns (20 s
+over the threshold every minute) and with sustained tilts (60 s every
+3 minutes). An alert is false when the sensor's true roll is not over
+TILT_ANGLE_THRESHOLD at that moment, and short when it comes during a
+turn that stays over it for less than 30 s; the delay is from the roll
+crossing the threshold to the first alert of a sustained tilt.
+
+First checks that a sample stamped at or before the previous one leaves
+the fused orientation where it was instead of restarting it.
+
+    python benchmarks/bench_tilt.py [seconds] [seeds]
+"""
+import math
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'mpu9250'), os.path.dirname(os.path.abspath(__file__))]
+
+import accel_gyro
+import orientation
+import imu_backends
+import sensor_backend
+from bench_suite import imu_fixture, START
+
+FIXTURES = ('noisy', 'motion')
+SCENARIOS = {
+    'still': dict(period=3600.0),
+    'short turns': dict(period=60.0, tilt_duration=20.0),
+    'sustained': dict(period=180.0, tilt_duration=60.0),
+}
+ACCEL_CONFIRM_TIME = 30  # seconds, the accelerometer-only check
+FUSED_CONFIRM_TIMES = (10, 30)
+
+
+class AlertList():
+    """
+    Queue stand-in that keeps the alerts TiltMonitor puts.
+    """
+    def __init__(self):
+        self.alerts = 0
+
+    def put(self, message):
+        if message['alert']:
+            self.alerts += 1
+
+
+def fused_alerts(samples, confirm_time):
+    """
+    Timestamps at which TiltMonitor alerts with TILT_CONFIRM_TIME = confirm_time.
+    """
+    saved = accel_gyro.TILT_CONFIRM_TIME
+    accel_gyro.TILT_CONFIRM_TIME = confirm_time
+    try:
+        queue = AlertList()
+        monitor = accel_gyro.TiltMonitor(samples[0], queue)
+        times = []
+        for timestamp, sample in samples[1:]:
+            alerts = queue.alerts
+            monitor.add(timestamp, sample)
+            if queue.alerts > alerts:
+                times.append(timestamp)
+        return times
+    finally:
+        accel_gyro.TILT_CONFIRM_TIME = saved
+
+
+def accel_alerts(samples, confirm_time=ACCEL_CONFIRM_TIME):
+    """
+    Timestamps at which the accelerometer-only check alerts.
+    """
+    def y_tilt(sample):
+        sample = accel_gyro.calibrate_sample(sample)
+        return math.degrees(math.atan2(sample.ay, sample.az))
+
+    initial_y_tilt = y_tilt(samples[0][1])
+    over_threshold_since = None
+    times = []
+    for timestamp, sample in samples[1:]:
+        if abs(y_tilt(sample) - initial_y_tilt) > accel_gyro.TILT_ANGLE_THRESHOLD:
+            if over_threshold_since is None:
+                over_threshold_since = timestamp
+        else:
+            over_threshold_since = None
+        if over_threshold_since is not None and timestamp - over_threshold_since >= confirm_time:
+            times.append(timestamp)
+            over_threshold_since = None
+    return times
+
+
+def check_jitter():
+    """
+    Zero and negative dt keep a roll the gyro built up, a gap over MAX_DT restarts.
+    """
+    fusion = orientation.OrientationFilter(accel_gyro.FUSION_MODE)
+    fusion.reset((0, 0, 1))
+    for _ in range(100):
+        fusion.update((0, 0, 1), (45, 0, 0), 0.01)
+    rolled = fusion.y_tilt
+    for dt in (0, -0.001):
+        fusion.update((0, 0, 1), (0, 0, 0), dt)
+        assert fusion.y_tilt == rolled, (dt, fusion.y_tilt, rolled)
+    fusion.update((0, 0, 1), (0, 0, 0), 2 * orientation.MAX_DT)
+    assert abs(fusion.y_tilt) < 1e-9, fusion.y_tilt
+    print(f"jitter: roll stays at {rolled:.1f} deg for dt <= 0, restarts after a gap")
+
+
+def score(times, imu, seconds):
+    """
+    (alerts, false alerts, alerts during shorter turns, tilts over the
+    threshold for at least ACCEL_CONFIRM_TIME, those alerted, mean delay
+    of their first alert).
+    """
+    step = 1.0 / accel_gyro.STREAM_RATE
+    over = [abs(imu.roll_at(n * step)[0]) > accel_gyro.TILT_ANGLE_THRESHOLD
+            for n in range(int(seconds * accel_gyro.STREAM_RATE) + 1)]
+    # (start, end) of each stretch over the threshold
+    tilts = []
+    for n, tilted in enumerate(over):
+        if tilted and (n == 0 or not over[n - 1]):
+            tilts.append([START + n * step, None])
+        if not tilted and n and over[n - 1]:
+            tilts[-1][1] = START + n * step
+    tilts = [(start, end) for start, end in tilts if end is not None]
+    short = sum(1 for t in times for start, end in tilts if start <= t < end and end - start < ACCEL_CONFIRM_TIME)
+    tilts = [(start, end) for start, end in tilts if end - start >= ACCEL_CONFIRM_TIME]
+
+    false = sum(1 for t in times if not over[min(int(round((t - START) / step)), len(over) - 1)])
+    delays = []
+    for start, end in tilts:
+        alerted = [t - start for t in times if start <= t < end]
+        if alerted:
+            delays.append(alerted[0])
+    delay = sum(delays) / len(delays) if delays else float('nan')
+    return len(times), false, short, len(tilts), len(delays), delay
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 900
+    seeds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    check_jitter()
+
+    detectors = [(f"accel {ACCEL_CONFIRM_TIME} s", accel_alerts)]
+    detectors += [(f"fused {t} s", lambda samples, t=t: fused_alerts(samples, t)) for t in FUSED_CONFIRM_TIMES]
+
+    print(f"{seconds:.0f} s per fixture, {seeds} seeds, threshold {accel_gyro.TILT_ANGLE_THRESHOLD} deg, "
+          f"TILT_CONFIRM_TIME = {accel_gyro.TILT_CONFIRM_TIME} s")
+    print(f"{'fixture':<8}{'scenario':<13}{'detector':<14}{'alerts':>8}{'false':>7}{'short':>7}"
+          f"{'tilts':>7}{'caught':>8}{'delay s':>9}")
+    for kind in FIXTURES:
+        for scenario, settings in SCENARIOS.items():
+            runs = []
+            for seed in range(seeds):
+                imu = imu_backends.SyntheticImu(sensor_backend.ScaledClock(0, START), **settings)
+                runs.append((imu_fixture(kind, seconds, seed, **settings), imu))
+            for name, detect in detectors:
+                totals = [0, 0, 0, 0, 0]
+                delays = []
+                for samples, imu in runs:
+                    *counts, delay = score(detect(samples), imu, seconds)
+                    totals = [a + b for a, b in zip(totals, counts)]
+                    if counts[-1]:
+                        delays.append(delay)
+                delay = sum(delays) / len(delays) if delays else float('nan')
+                print(f"{kind:<8}{scenario:<13}{name:<14}{totals[0]:>8}{totals[1]:>7}{totals[2]:>7}"
+                      f"{totals[3]:>7}{totals[4]:>8}{delay:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
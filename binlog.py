@@ -0,0 +1,388 @@
+import os
+import json
+import bisect
+import mmap
+import struct
+import time
+from datetime import datetime
+
+import numpy as np
+
+# File layout (little-endian):
+#   header, HEADER_SIZE bytes: MAGIC, then header size, rows per block,
+#   block size and length of the field list, then the field list as JSON
+#   [[name, numpy type], ...]
+#   blocks of block size bytes, each:
+#     block header, BLOCK_HEADER_SIZE bytes: row count (uint32), padding,
+#     time of the first and last row (float64)
+#     one column per field: rows per block values, each column starting
+#     at a multiple of ALIGN bytes
+# Every record type has a float64 'time' field (unix seconds), in order.
+MAGIC = b'SLOG\x00\x01\x00\x00'
+HEADER_FORMAT = '<8sIIII'
+HEADER_SIZE = 4096
+BLOCK_HEADER_SIZE = 64
+ALIGN = 64
+BLOCK_ROWS = 4096
+# Rows are written out when a block is full, and when the oldest unwritten
+# row is this old (so a crash loses at most about this much data)
+FLUSH_INTERVAL = 30.0  # seconds
+
+EXTENSION = '.slog'
+
+# Every log gets rollups at these resolutions, written along with the
+# records: one row per bucket of that many seconds with the count and the min,
+# max and mean of every field, in a binary log of the same name in
+# rollup_<seconds>s/ next to it (see rollup_path())
+ROLLUPS = (1, 60, 600)  # seconds
+ROLLUP_BLOCK_ROWS = 256
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def rollup_path(path, resolution):
+    return os.path.join(os.path.dirname(path), f"rollup_{resolution:g}s", os.path.basename(path))
+
+
+def rollup_dtype(dtype):
+    """
+    The record dtype of the rollups of `dtype`: bucket start time, row
+    count, and <field>_min, <field>_max, <field>_mean for every other field.
+    """
+    fields = [('time', 'f8'), ('count', 'u4')]
+    for name in np.dtype(dtype).names:
+        if name != 'time':
+            fields += [(f"{name}_{stat}", 'f8') for stat in ('min', 'max', 'mean')]
+    return fields
+
+
+def buckets(times, resolution):
+    """
+    (bucket start times, index of the first row of each bucket) of sorted
+    `times`, for np.ufunc.reduceat.
+    """
+    starts = np.floor(times / resolution) * resolution
+    first = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+    return starts[first], first
+
+
+class _Layout():
+    """
+    Where every column of a block is, for a record dtype and block_rows.
+    """
+    def __init__(self, dtype, block_rows):
+        self.dtype = np.dtype(dtype)
+        if 'time' not in self.dtype.names or self.dtype['time'] != np.float64:
+            raise ValueError("records need a float64 'time' field")
+        self.block_rows = block_rows
+        self.offsets = {}
+        offset = BLOCK_HEADER_SIZE
+        for name in self.dtype.names:
+            self.offsets[name] = offset
+            offset += _align(block_rows * self.dtype[name].itemsize)
+        self.block_size = offset
+
+    def fields(self):
+        return [[name, self.dtype[name].str] for name in self.dtype.names]
+
+
+class BinaryLogger():
+    """
+    Writes raw sensor records (a NumPy structured dtype) to a columnar
+    binary log in `log_dir`, next to the CSVLogger of the same collector.
+    The filename includes the current timestamp, as the CSV logs.
+
+    Records are kept in memory until their block is full or the oldest
+    one is FLUSH_INTERVAL seconds old; only the new part of each column is
+    then written, with an fsync. Read the logs back with BinaryLog.
+
+    The rollups of the records (see ROLLUPS) are written alongside, as
+    the records are written out; a bucket is written once a later record
+    starts the next one, or on close().
+    `path` names the file instead of a new timestamped one in `log_dir`.
+    """
+    def __init__(self, log_dir, dtype, clock=None, block_rows=BLOCK_ROWS,
+                 flush_interval=FLUSH_INTERVAL, fsync=True, rollups=ROLLUPS, path=None):
+        self.layout = _Layout(dtype, block_rows)
+        self.dtype = self.layout.dtype
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        os.makedirs(log_dir, exist_ok=True)
+
+        if path is not None:
+            self.log_path = path
+        else:
+            now = datetime.fromtimestamp(clock.time()) if clock is not None else datetime.now()
+            timestamp_str = now.strftime("%Y-%m-%d_%H-%M-%S")
+            self.log_path = os.path.join(log_dir, f"raw_{timestamp_str}{EXTENSION}")
+            n = 0
+            while os.path.exists(self.log_path):
+                n += 1
+                self.log_path = os.path.join(log_dir, f"raw_{timestamp_str}_{n}{EXTENSION}")
+
+        fields = json.dumps(self.layout.fields()).encode('utf-8')
+        header = struct.pack(HEADER_FORMAT, MAGIC, HEADER_SIZE, block_rows, self.layout.block_size, len(fields))
+        if len(header) + len(fields) > HEADER_SIZE:
+            raise ValueError("too many fields for the header")
+
+        self.fd = os.open(self.log_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.pwrite(self.fd, (header + fields).ljust(HEADER_SIZE, b'\0'), 0)
+
+        self._block = np.zeros(block_rows, dtype=self.dtype)
+        self._blocks = 0    # blocks started, the last one is self._block
+        self._count = 0     # rows in self._block
+        self._written = 0   # rows of self._block already in the file
+        self._pending_since = None
+        self.rows = 0
+        self._start_block()
+        self._rollups = [_Rollup(self, resolution) for resolution in rollups]
+
+    def write(self, records):
+        """
+        Append records (a structured array of the logger's dtype, or tuples).
+        """
+        records = np.asarray(records, dtype=self.dtype)
+        while len(records):
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            n = min(len(records), self.layout.block_rows - self._count)
+            self._block[self._count:self._count + n] = records[:n]
+            self._count += n
+            self.rows += n
+            records = records[n:]
+            if self._count == self.layout.block_rows:
+                self.flush()
+                self._start_block()
+        if self._pending_since is not None and time.monotonic() - self._pending_since >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the rows that are not in the file yet, and add them to the rollups.
+        """
+        if self._written < self._count:
+            # in the batches of rows that are written, rather than per write()
+            for rollup in self._rollups:
+                rollup.add(self._block[self._written:self._count])
+        for rollup in self._rollups:
+            rollup.log.flush()
+        if self._written == self._count:
+            return
+        base = HEADER_SIZE + (self._blocks - 1) * self.layout.block_size
+        for name, offset in self.layout.offsets.items():
+            column = self._block[name][self._written:self._count]
+            os.pwrite(self.fd, column.tobytes(), base + offset + self._written * column.itemsize)
+        # the row count goes last, so a reader never sees rows that are not written
+        os.pwrite(self.fd, struct.pack('<I4xdd', self._count, self._block['time'][0],
+                                       self._block['time'][self._count - 1]), base)
+        if self.fsync:
+            os.fsync(self.fd)
+        self._written = self._count
+        self._pending_since = None
+
+    def _start_block(self):
+        self._blocks += 1
+        self._count = 0
+        self._written = 0
+        # the block is allocated (sparse) up front, so the file always holds whole blocks
+        os.ftruncate(self.fd, HEADER_SIZE + self._blocks * self.layout.block_size)
+
+    def close(self):
+        self.flush()
+        for rollup in self._rollups:
+            rollup.close()
+        os.close(self.fd)
+
+
+class _Rollup():
+    """
+    The rollup of a BinaryLogger at one resolution. The bucket that is
+    still open is kept with the sum of every field in <field>_mean, which
+    becomes the mean when it is written.
+    """
+    def __init__(self, logger, resolution):
+        self.resolution = resolution
+        self.fields = [name for name in logger.dtype.names if name != 'time']
+        path = rollup_path(logger.log_path, resolution)
+        self.log = BinaryLogger(os.path.dirname(path), rollup_dtype(logger.dtype), block_rows=ROLLUP_BLOCK_ROWS,
+                                flush_interval=logger.flush_interval, fsync=logger.fsync, rollups=(), path=path)
+        self._open = None
+
+    def add(self, records):
+        starts, first = buckets(records['time'], self.resolution)
+        rows = np.zeros(len(starts), dtype=self.log.dtype)
+        rows['time'] = starts
+        rows['count'] = np.diff(np.r_[first, len(records)])
+        for name in self.fields:
+            values = records[name].astype(np.float64)
+            rows[f"{name}_min"] = np.minimum.reduceat(values, first)
+            rows[f"{name}_max"] = np.maximum.reduceat(values, first)
+            rows[f"{name}_mean"] = np.add.reduceat(values, first)
+
+        if self._open is not None:
+            if self._open['time'][0] == rows['time'][0]:
+                merged = rows[:1]
+                merged['count'] += self._open['count']
+                for name in self.fields:
+                    merged[f"{name}_min"] = np.minimum(merged[f"{name}_min"], self._open[f"{name}_min"])
+                    merged[f"{name}_max"] = np.maximum(merged[f"{name}_max"], self._open[f"{name}_max"])
+                    merged[f"{name}_mean"] += self._open[f"{name}_mean"]
+            else:
+                rows = np.concatenate([self._open, rows])
+        self._write(rows[:-1])
+        self._open = rows[-1:].copy()
+
+    def _write(self, rows):
+        if len(rows):
+            for name in self.fields:
+                rows[f"{name}_mean"] /= rows['count']
+            self.log.write(rows)
+
+    def close(self):
+        if self._open is not None:
+            self._write(self._open)
+            self._open = None
+        self.log.close()
+
+
+class BinaryLog():
+    """
+    A binary log written by BinaryLogger, memory-mapped read-only.
+
+    blocks(name) is a zero-copy (blocks, block_rows) view of a column;
+    the rows past block_counts[b] of block b are not used. column(name)
+    returns the used rows as one array, optionally only those between two
+    times, found through the per-block first/last times without reading
+    the other blocks. Rows from a single block are a zero-copy view, rows
+    spanning blocks are copied once.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_size, block_rows, block_size, fields_len = struct.unpack_from(HEADER_FORMAT, self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a binary log")
+        start = struct.calcsize(HEADER_FORMAT)
+        fields = json.loads(bytes(self._mmap[start:start + fields_len]).decode('utf-8'))
+        self.layout = _Layout([tuple(field) for field in fields], block_rows)
+        self.dtype = self.layout.dtype
+        if self.layout.block_size != block_size:
+            raise ValueError(f"{path}: unexpected block size {block_size}")
+        self.header_size = header_size
+
+        n_blocks = (len(self._mmap) - header_size) // block_size
+        self.block_counts = self._block_header('<u4', 0, n_blocks)
+        self.block_first = self._block_header('<f8', 8, n_blocks)
+        self.block_last = self._block_header('<f8', 16, n_blocks)
+        # only the last block can have been started but not written to yet;
+        # looking at the others would read a page of the file per block
+        if n_blocks and self.block_counts[n_blocks - 1] == 0:
+            n_blocks -= 1
+        self.n_blocks = n_blocks
+
+    def _block_header(self, dtype, offset, n_blocks):
+        return np.ndarray(n_blocks, dtype=dtype, buffer=self._mmap,
+                          offset=self.header_size + offset, strides=(self.layout.block_size,))
+
+    def __len__(self):
+        # every block but the last one is full
+        if not self.n_blocks:
+            return 0
+        return (self.n_blocks - 1) * self.layout.block_rows + int(self.block_counts[self.n_blocks - 1])
+
+    def blocks(self, name):
+        dtype = self.dtype[name]
+        return np.ndarray((self.n_blocks, self.layout.block_rows), dtype=dtype, buffer=self._mmap,
+                          offset=self.header_size + self.layout.offsets[name],
+                          strides=(self.layout.block_size, dtype.itemsize))
+
+    def block_range(self, start=None, end=None):
+        """
+        Indices (first, stop) of the blocks with rows in [start, end).
+        """
+        first_times = self.block_first[:self.n_blocks]
+        last_times = self.block_last[:self.n_blocks]
+        # bisect rather than np.searchsorted, which would copy the strided
+        # times and so read a page of the file per block
+        first = 0 if start is None else bisect.bisect_left(last_times, start)
+        stop = self.n_blocks if end is None else bisect.bisect_left(first_times, end)
+        return first, max(first, stop)
+
+    def column(self, name, start=None, end=None):
+        """
+        The rows of field `name` (with time in [start, end) if given).
+        """
+        first, stop = self.block_range(start, end)
+        if first == stop:
+            return np.empty(0, dtype=self.dtype[name])
+        values = self._used_rows(self.blocks(name), first, stop)
+        if start is None and end is None:
+            return values
+        times = self._used_rows(self.blocks('time'), first, stop)
+        lo = 0 if start is None else np.searchsorted(times, start, side='left')
+        hi = len(times) if end is None else np.searchsorted(times, end, side='left')
+        return values[lo:hi]
+
+    def row_range(self, start=None, end=None):
+        """
+        Row numbers (first, stop) of the rows with time in [start, end), for rows().
+        """
+        first = 0 if start is None else self._rows_before(start)
+        stop = len(self) if end is None else self._rows_before(end)
+        return first, max(first, stop)
+
+    def _rows_before(self, t):
+        # the first block ending at or after t holds the boundary
+        block, _ = self.block_range(t, None)
+        if block == self.n_blocks:
+            return len(self)
+        times = self.blocks('time')[block, :int(self.block_counts[block])]
+        return block * self.layout.block_rows + int(np.searchsorted(times, t, side='left'))
+
+    def rows(self, name, start=0, stop=None):
+        """
+        Rows start..stop-1 of field `name`, by row number.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return np.empty(0, dtype=self.dtype[name])
+        rows = self.layout.block_rows
+        first = start // rows
+        values = self._used_rows(self.blocks(name), first, (stop - 1) // rows + 1)
+        return values[start - first * rows:stop - first * rows]
+
+    def read(self, start=None, end=None):
+        """
+        Every field, as a dict of arrays (see column()).
+        """
+        return {name: self.column(name, start, end) for name in self.dtype.names}
+
+    def _used_rows(self, view, first, stop):
+        counts = self.block_counts[first:stop]
+        if stop - first == 1:
+            # within one block the rows are contiguous: no copy
+            return view[first, :int(counts[0])]
+        rows = self.layout.block_rows
+        out = np.empty(int(counts.sum(dtype=np.int64)), dtype=view.dtype)
+        if counts[:-1].min() == rows:
+            # only the last block is partly used: copy the full ones in one go
+            full = stop - first - 1
+            out[:full * rows].reshape(full, rows)[...] = view[first:stop - 1]
+            out[full * rows:] = view[stop - 1, :int(counts[-1])]
+        else:
+            pos = 0
+            for b in range(first, stop):
+                count = int(counts[b - first])
+                out[pos:pos + count] = view[b, :count]
+                pos += count
+        return out
+
+    def close(self):
+        """
+        Unmap the file; arrays from blocks() must not be used afterwards.
+        """
+        self.block_counts = self.block_first = self.block_last = None
+        self._mmap.close()
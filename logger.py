@@ -1,31 +1,236 @@
 import os
+import io
 import csv
+import gzip
+import shutil
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import metrics
+
+# Buffered rows are written out when there are this many, when the oldest
+# is this old (so a crash loses at most about FLUSH_INTERVAL seconds of
+# rows), and on close()
+FLUSH_ROWS = 1024
+FLUSH_INTERVAL = 30.0  # seconds
+# At most this many rows are buffered; while the disk does not keep up,
+# newer rows are dropped (and counted in CSVLogger.dropped)
+MAX_BUFFERED_ROWS = 16 * FLUSH_ROWS
+# A new file is started when the current one reaches this size or age
+MAX_FILE_BYTES = 8 * 1024 * 1024
+MAX_FILE_AGE = 24 * 3600  # seconds
+# Every log file has a sparse time index next to it (path + INDEX_EXTENSION):
+# one entry per written batch, the time of its first row (unix seconds)
+# and its byte offset in the uncompressed file
+INDEX_EXTENSION = '.idx'
+INDEX_FORMAT = '<dQ'
+
 class CSVLogger:
-    def __init__(self, log_dir: str, field_name="Value"):
+    def __init__(self, log_dir: str, field_name="Value", clock=None,
+                 flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL, max_buffered=MAX_BUFFERED_ROWS,
+                 max_bytes=MAX_FILE_BYTES, max_age=MAX_FILE_AGE, compress=False, fsync=True):
         """
         Create a new CSV log file in the given directory.
         The filename includes the current timestamp.
+        Times come from `clock` (see sensor_backend.py) if given, else the system time.
+
+        log() only adds the row to a buffer in memory; a background thread
+        writes the buffer out (see FLUSH_ROWS / FLUSH_INTERVAL), with an
+        fsync so the rows survive a power cut, and starts a new file when
+        the current one is larger than max_bytes or older than max_age
+        seconds (None for no limit). With `compress`, finished files are
+        gzipped in the background. Every batch gets an entry in the index
+        file (see INDEX_EXTENSION), which logquery.py uses to find a time
+        range without reading the rows before it.
+
+        If the background thread fails to write (a full disk, a rotation
+        that fails), it stops, and log(), flush() and close() raise a
+        RuntimeError from its exception.
         """
+        self.clock = clock
+        self.log_dir = log_dir
+        self.field_name = field_name
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_buffered = max(max_buffered, flush_rows)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fsync = fsync
         os.makedirs(log_dir, exist_ok=True)
-        timestamp_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        self.log_path = os.path.join(log_dir, f"log_{timestamp_str}.csv")
 
-        self.file = open(self.log_path, mode='w', newline='')
-        self.writer = csv.writer(self.file)
-        self.writer.writerow(['Time', field_name])  # Write header
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._pending = 0
+        self._pending_since = None
+        self._batch_time = None
+        self._second = None
+        self._time_str = None
+        self.rows = 0
+        self.bytes = 0
+        self.dropped = 0
+        self._error = None
+        # the series of this log, if metrics.py declares them
+        name = os.path.basename(os.path.normpath(log_dir))
+        self._rows_metric = metrics.CSV_ROWS.get(name, metrics.NO_METRIC)
+        self._write_metric = metrics.CSV_WRITE_SECONDS.get(name, metrics.NO_METRIC)
+
+        self._compressor = ThreadPoolExecutor(1, thread_name_prefix='log-compress') if compress else None
+        self._open_file()
+
+        self._closed = False
+        self._cond = threading.Condition()
+        # taken before _cond by whoever writes to the file, so batches stay in order
+        self._io_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run_writer, name='log-writer', daemon=True)
+        self._thread.start()
 
     def log(self, value):
         """
         Log the current time and the provided value to the CSV.
         """
-        time_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.writer.writerow([time_now, value])
-        self.file.flush()
+        with self._cond:
+            self._check_writer()
+            if self._pending >= self.max_buffered:
+                if not self.dropped:
+                    print(f"[logger] {self.log_dir}: {self._pending} rows not written yet, dropping new rows")
+                self.dropped += 1
+                return
+            self._writer.writerow([self._now_str(), value])
+            self._pending += 1
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+                self._batch_time = self._second
+                self._cond.notify()
+            elif self._pending >= self.flush_rows:
+                self._cond.notify()
 
-    def close(self):
+    def flush(self):
+        """
+        Write the buffered rows out now.
+        """
+        self._check_writer()
+        with self._io_lock:
+            self._write(*self._take())
+
+    def _check_writer(self):
+        if self._error is not None:
+            raise RuntimeError(f"writing the log in {self.log_dir} failed") from self._error
+
+    def _now_str(self):
+        now = self.clock.time() if self.clock is not None else time.time()
+        # rows come many to a second, format each second once
+        second = int(now)
+        if second != self._second:
+            self._time_str = datetime.fromtimestamp(second).strftime("%Y-%m-%d %H:%M:%S")
+            self._second = second
+        return self._time_str
+
+    def _open_file(self):
+        now = datetime.fromtimestamp(self.clock.time()) if self.clock is not None else datetime.now()
+        timestamp_str = now.strftime("%Y-%m-%d_%H-%M-%S")
+        self.log_path = os.path.join(self.log_dir, f"log_{timestamp_str}.csv")
+        n = 0
+        while os.path.exists(self.log_path) or os.path.exists(self.log_path + '.gz'):
+            n += 1
+            self.log_path = os.path.join(self.log_dir, f"log_{timestamp_str}_{n}.csv")
+
+        self.file = open(self.log_path, mode='w', newline='')
+        self.index = open(self.log_path + INDEX_EXTENSION, mode='wb', buffering=0)
+        self.file_opened = time.monotonic()
+        csv.writer(self.file).writerow(['Time', self.field_name])  # Write header
+
+    def _run_writer(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                if self._pending_since is None:
+                    self._cond.wait()
+                    continue
+                delay = self._pending_since + self.flush_interval - time.monotonic()
+                if self._pending < self.flush_rows and delay > 0:
+                    self._cond.wait(delay)
+                    continue
+            try:
+                self.flush()
+            except Exception as e:
+                # the rows of this batch are lost; log() raises from now on
+                print(f"[logger] {self.log_dir}: writing failed, logging stopped: {e!r}")
+                with self._cond:
+                    self._error = e
+                return
+
+    def _take(self):
         """
-        Close the log file.
+        The buffered rows as text and the time of the first one, leaving
+        the buffer empty.
         """
+        with self._cond:
+            data = self._buffer.getvalue()
+            self._buffer.seek(0)
+            self._buffer.truncate()
+            self.rows += self._pending
+            self._rows_metric.inc(self._pending)
+            self._pending = 0
+            self._pending_since = None
+            return data, self._batch_time
+
+    def _write(self, data, batch_time, rotate=True):
+        # runs without self._cond, so log() never waits for the disk
+        if data:
+            start = time.perf_counter()
+            offset = self.file.tell()
+            self.file.write(data)
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+            self._write_metric.observe(time.perf_counter() - start)
+            self.bytes += len(data)
+            # after the rows, so an entry never points past the end of the file
+            self.index.write(struct.pack(INDEX_FORMAT, batch_time, offset))
+
+        if not rotate:
+            return
+        too_big = self.max_bytes is not None and self.file.tell() >= self.max_bytes
+        too_old = self.max_age is not None and time.monotonic() - self.file_opened >= self.max_age
+        if too_big or too_old:
+            self._close_file()
+            self._open_file()
+
+    def _close_file(self):
+        if self.file.closed:
+            return  # after a rotation that failed to open the next file
         self.file.close()
+        self.index.close()
+        if self._compressor is not None:
+            self._compressor.submit(compress_file, self.log_path)
+
+    def close(self):
+        """
+        Write out the buffered rows and close the log file.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        try:
+            self._check_writer()
+            with self._io_lock:
+                self._write(*self._take(), rotate=False)
+        finally:
+            self._close_file()
+            if self._compressor is not None:
+                self._compressor.shutdown(wait=True)
+
+
+def compress_file(path):
+    """
+    Replace `path` with a gzipped `path`.gz. The index of the file stays
+    as it is (at `path` + INDEX_EXTENSION).
+    """
+    with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(path)
@@ -0,0 +1,375 @@
+import os
+import sys
+import csv
+import glob
+import gzip
+import json
+import math
+import time
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+from binlog import EXTENSION, ROLLUPS, BinaryLog, buckets, rollup_path
+from logger import INDEX_EXTENSION
+
+# Where the collectors log, relative to their working directory
+LOG_ROOT = 'logs'
+# Raw binary logs (RAW_LOG_DIR of each collector) and CSV logs, by sensor
+RAW_LOG_DIRS = {
+    'ppg': 'raw/HR_SpO2',
+    'imu': 'raw/IMU',
+    'temperature': 'raw/Temperature',
+}
+CSV_LOG_DIRS = {
+    'hr_spo2': 'HR_SpO2',
+    'temperature': 'Temperature',
+}
+# Buckets series() aims for when no number is given, about a plot's width
+SERIES_POINTS = 500
+CSV_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# logger.INDEX_FORMAT as a dtype
+INDEX_DTYPE = np.dtype([('time', '<f8'), ('offset', '<u8')])
+
+
+class RawLogs():
+    """
+    The raw binary logs of one sensor (a RAW_LOG_DIR) and their rollups.
+
+    Files are found by time through a sparse index: the first and last
+    time of every file, kept in memory and updated when a file changes,
+    and within a file the per-block times of its block headers (see
+    binlog.BinaryLog.block_range). stats() and series() only read the
+    rollups, except for the parts of a range that are not whole seconds
+    and the rows that are not in a rollup yet (the newest ones, or those
+    of logs written without rollups), which are read raw.
+    """
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        self._index = {}  # path -> ((size, mtime), first time, last time)
+
+    def files(self, start=None, end=None):
+        """
+        [(path, first time, last time)] of the logs with rows in [start, end), in time order.
+        """
+        found = []
+        for path in glob.glob(os.path.join(self.log_dir, '*' + EXTENSION)):
+            st = os.stat(path)
+            key = (st.st_size, st.st_mtime_ns)
+            entry = self._index.get(path)
+            if entry is None or entry[0] != key:
+                log = BinaryLog(path)
+                if log.n_blocks:
+                    entry = (key, float(log.block_first[0]), float(log.block_last[log.n_blocks - 1]))
+                else:
+                    entry = (key, None, None)
+                log.close()
+                self._index[path] = entry
+            _, first, last = entry
+            if first is None:
+                continue
+            if (start is None or last >= start) and (end is None or first < end):
+                found.append((path, first, last))
+        found.sort(key=lambda f: f[1])
+        return found
+
+    def time_range(self):
+        """
+        (first, last) time of all the logs, or None if there are none.
+        """
+        files = self.files()
+        if not files:
+            return None
+        return files[0][1], max(last for _, _, last in files)
+
+    def raw(self, field, start=None, end=None):
+        """
+        (times, values) of `field` in [start, end), from the raw rows.
+        """
+        times, values = [], []
+        for path, _, _ in self.files(start, end):
+            log = BinaryLog(path)
+            # copies, so the file can be unmapped
+            times.append(np.array(log.column('time', start, end)))
+            values.append(np.array(log.column(field, start, end)))
+            log.close()
+        if not times:
+            return np.empty(0), np.empty(0)
+        return np.concatenate(times), np.concatenate(values)
+
+    def rollup(self, field, resolution, start=None, end=None):
+        """
+        The `resolution`-second buckets of `field` starting in [start, end),
+        as a dict of arrays 'time', 'count', 'min', 'max' and 'mean'.
+        """
+        parts = []
+        for path, _, last in self.files(start, end):
+            rolled_until = None
+            if os.path.exists(rollup_path(path, resolution)):
+                log = BinaryLog(rollup_path(path, resolution))
+                if log.n_blocks:
+                    parts.append({stat: np.array(log.column(stat if stat in ('time', 'count') else f"{field}_{stat}",
+                                                            start, end))
+                                  for stat in ('time', 'count', 'min', 'max', 'mean')})
+                    rolled_until = float(log.block_last[log.n_blocks - 1]) + resolution
+                log.close()
+            # the newest buckets are written after their rows (and lost in a
+            # crash), the rows past the last one are aggregated here
+            tail = start if rolled_until is None else rolled_until if start is None else max(start, rolled_until)
+            if (tail is None or last >= tail) and (end is None or tail is None or tail < end):
+                log = BinaryLog(path)
+                parts.append(_aggregate(log.column('time', tail, end), log.column(field, tail, end), resolution))
+                log.close()
+        if not parts:
+            return _aggregate(np.empty(0), np.empty(0), resolution)
+        return {stat: np.concatenate([part[stat] for part in parts]) for stat in parts[0]}
+
+    def stats(self, field, start=None, end=None):
+        """
+        {'count', 'min', 'max', 'mean'} of `field` in [start, end).
+
+        The range is split into the coarsest whole rollup buckets that fit,
+        so an hour takes a few 600 s rows and the 60 s and 1 s rows at its ends.
+        """
+        time_range = self.time_range()
+        if time_range is None:
+            return _combine([])
+        start = time_range[0] if start is None else start
+        end = math.nextafter(time_range[1], math.inf) if end is None else end
+        parts = []
+        for resolution, lo, hi in _split(start, end, sorted(ROLLUPS, reverse=True)):
+            if resolution is None:
+                times, values = self.raw(field, lo, hi)
+                parts.append(_aggregate(times, values, hi - lo))
+            else:
+                parts.append(self.rollup(field, resolution, lo, hi))
+        return _combine(parts)
+
+    def series(self, field, start=None, end=None, points=SERIES_POINTS):
+        """
+        `field` in [start, end) downsampled for plotting to about `points`
+        buckets (as rollup() returns them), merged from the coarsest
+        rollup that is fine enough.
+        """
+        time_range = self.time_range()
+        if time_range is None:
+            return self.rollup(field, min(ROLLUPS), start, end)
+        span = (time_range[1] if end is None else end) - (time_range[0] if start is None else start)
+        width = span / points
+        resolution = max([r for r in ROLLUPS if r <= width], default=min(ROLLUPS))
+        # whole rollup buckets per series bucket
+        width = max(1, math.ceil(width / resolution)) * resolution
+        series = self.rollup(field, resolution, start, end)
+        if width == resolution or not len(series['time']):
+            return series
+        starts, first = buckets(series['time'], width)
+        count = np.add.reduceat(series['count'], first)
+        return {'time': starts, 'count': count,
+                'min': np.minimum.reduceat(series['min'], first), 'max': np.maximum.reduceat(series['max'], first),
+                'mean': np.add.reduceat(series['mean'] * series['count'], first) / count}
+
+
+class CSVLogs():
+    """
+    The CSV logs of one collector (logger.CSVLogger), gzipped or not.
+
+    rows() seeks to the time range through the index file of every log
+    (see logger.INDEX_EXTENSION) and only parses the batches in it; logs
+    without an index are read whole.
+    """
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+
+    def files(self):
+        paths = glob.glob(os.path.join(self.log_dir, 'log_*.csv')) + glob.glob(os.path.join(self.log_dir, 'log_*.csv.gz'))
+        # the names start with the creation time
+        return sorted(paths, key=os.path.basename)
+
+    def rows(self, start=None, end=None):
+        """
+        [(time, value)] of the rows in [start, end); values as logged (text).
+        """
+        found = []
+        for path in self.files():
+            index = _read_index(path)
+            lo, hi = 0, None
+            if len(index):
+                if (end is not None and index['time'][0] >= end):
+                    continue
+                if start is not None:
+                    # batches before the last one starting before `start` only have earlier rows
+                    n = int(np.searchsorted(index['time'], start, side='left'))
+                    lo = int(index['offset'][n - 1]) if n else 0
+                if end is not None:
+                    # batches from the first one starting at `end` on only have later rows
+                    n = int(np.searchsorted(index['time'], end, side='left'))
+                    hi = int(index['offset'][n]) if n < len(index) else None
+            found.extend(_read_rows(path, lo, hi, start, end))
+        return found
+
+
+def _read_index(path):
+    index_path = (path[:-len('.gz')] if path.endswith('.gz') else path) + INDEX_EXTENSION
+    try:
+        with open(index_path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        data = b''
+    # a partly written last entry is ignored
+    size = len(data) // INDEX_DTYPE.itemsize * INDEX_DTYPE.itemsize
+    return np.frombuffer(data[:size], dtype=INDEX_DTYPE)
+
+
+def _read_rows(path, lo, hi, start, end):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        if lo:
+            f.seek(lo)
+        else:
+            f.readline()  # header
+        data = f.read() if hi is None else f.read(hi - lo)
+    rows = []
+    seconds = {}
+    for row in csv.reader(data.decode('utf-8').splitlines()):
+        if len(row) != 2:
+            continue  # a row that was being written
+        t = seconds.get(row[0])
+        if t is None:
+            t = seconds[row[0]] = time.mktime(time.strptime(row[0], CSV_TIME_FORMAT))
+        if (start is None or t >= start) and (end is None or t < end):
+            rows.append((t, row[1]))
+    return rows
+
+
+def _split(start, end, resolutions):
+    """
+    [(resolution, lo, hi)] covering [start, end): the coarsest resolution
+    in the middle where whole buckets fit, finer ones towards the ends,
+    resolution None for what is left over.
+    """
+    if start >= end:
+        return []
+    if not resolutions:
+        return [(None, start, end)]
+    resolution = resolutions[0]
+    lo = math.ceil(start / resolution) * resolution
+    hi = math.floor(end / resolution) * resolution
+    if lo >= hi:
+        return _split(start, end, resolutions[1:])
+    return _split(start, lo, resolutions[1:]) + [(resolution, lo, hi)] + _split(hi, end, resolutions[1:])
+
+
+def _aggregate(times, values, resolution):
+    """
+    Buckets as RawLogs.rollup() returns them, computed from raw rows.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return {'time': np.empty(0), 'count': np.empty(0, dtype=np.uint32),
+                'min': np.empty(0), 'max': np.empty(0), 'mean': np.empty(0)}
+    starts, first = buckets(np.asarray(times), resolution)
+    count = np.diff(np.r_[first, len(values)])
+    return {'time': starts, 'count': count,
+            'min': np.minimum.reduceat(values, first), 'max': np.maximum.reduceat(values, first),
+            'mean': np.add.reduceat(values, first) / count}
+
+
+def _combine(parts):
+    count = sum(int(part['count'].sum()) for part in parts)
+    if not count:
+        return {'count': 0, 'min': None, 'max': None, 'mean': None}
+    parts = [part for part in parts if len(part['count'])]
+    return {
+        'count': count,
+        'min': float(min(part['min'].min() for part in parts)),
+        'max': float(max(part['max'].max() for part in parts)),
+        'mean': float(sum((part['mean'] * part['count']).sum() for part in parts) / count),
+    }
+
+
+def parse_time(text):
+    """
+    Unix seconds, or a local date and time in ISO format ("2026-10-18 02:00").
+    """
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def format_time(t):
+    return datetime.fromtimestamp(t).strftime(CSV_TIME_FORMAT)
+
+
+def main():
+    """
+    python logquery.py info
+    python logquery.py stats temperature temp --start "2026-10-18 02:00" --end "2026-10-18 03:00"
+    python logquery.py series imu az [--points 200] [--json]
+    python logquery.py rows hr_spo2 [--start ...] [--end ...]
+
+    Run it where the collectors run, or give their logs directory with --logs.
+    """
+    parser = argparse.ArgumentParser(description="Query the stored sensor logs.")
+    parser.add_argument('--logs', default=LOG_ROOT, help="logs directory (default: %(default)s)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('info', help="time range and size of the logs of every sensor")
+    for name, sensors, help in (('stats', RAW_LOG_DIRS, "count, min, max and mean of a raw field"),
+                                ('series', RAW_LOG_DIRS, "a raw field downsampled for plotting"),
+                                ('rows', CSV_LOG_DIRS, "rows of a CSV log")):
+        command = commands.add_parser(name, help=help)
+        command.add_argument('sensor', choices=sorted(sensors))
+        if name != 'rows':
+            command.add_argument('field')
+        command.add_argument('--start', type=parse_time)
+        command.add_argument('--end', type=parse_time)
+        command.add_argument('--json', action='store_true', help="print JSON")
+        if name == 'series':
+            command.add_argument('--points', type=int, default=SERIES_POINTS)
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        for sensor, log_dir in sorted(RAW_LOG_DIRS.items()):
+            files = RawLogs(os.path.join(args.logs, log_dir)).files()
+            if files:
+                print(f"raw {sensor:<12}{len(files):>4} files  {format_time(files[0][1])} - "
+                      f"{format_time(max(last for _, _, last in files))}")
+        for sensor, log_dir in sorted(CSV_LOG_DIRS.items()):
+            files = CSVLogs(os.path.join(args.logs, log_dir)).files()
+            if files:
+                print(f"csv {sensor:<12}{len(files):>4} files  {os.path.basename(files[0])} - {os.path.basename(files[-1])}")
+        return
+
+    if args.command == 'rows':
+        rows = CSVLogs(os.path.join(args.logs, CSV_LOG_DIRS[args.sensor])).rows(args.start, args.end)
+        if args.json:
+            json.dump([[t, value] for t, value in rows], sys.stdout)
+            print()
+        else:
+            for t, value in rows:
+                print(f"{format_time(t)}  {value}")
+        return
+
+    logs = RawLogs(os.path.join(args.logs, RAW_LOG_DIRS[args.sensor]))
+    if args.command == 'stats':
+        result = logs.stats(args.field, args.start, args.end)
+        if args.json:
+            json.dump(result, sys.stdout)
+            print()
+        else:
+            for name, value in result.items():
+                print(f"{name:<6}{value}")
+    else:
+        series = logs.series(args.field, args.start, args.end, args.points)
+        if args.json:
+            json.dump({name: values.tolist() for name, values in series.items()}, sys.stdout)
+            print()
+        else:
+            print(f"{'time':<21}{'count':>7}{'min':>12}{'max':>12}{'mean':>12}")
+            for t, count, low, high, mean in zip(*(series[name] for name in ('time', 'count', 'min', 'max', 'mean'))):
+                print(f"{format_time(t):<21}{count:>7}{low:>12.4g}{high:>12.4g}{mean:>12.4g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,115 @@
-from multiprocessing import Process, Queue
-from sensors.Temperature.temperature import collect_temperature_data
-from sensors.MPU9250.accel_gyro import collect_gyro_data
-from sensors.MAX30102.hr_spo2 import collect_hr_spo2_data
-from ble.ble_sender import main as ble_main
+import os
+import sys
+from multiprocessing import Queue
+import queue
 
-def main():
+# The collectors and the BLE server import their neighbours from their own folders
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(ROOT, folder) for folder in ('Temperature', 'mpu9250', 'MAX30102', 'BLE')]
+
+from temperature import collect_temperature_data, collect_temperature_data_async, \
+    TEMP_RING, TEMP_DTYPE, TEMP_RING_CAPACITY
+from accel_gyro import collect_gyro_data, collect_gyro_data_async, \
+    IMU_RING, IMU_DTYPE, IMU_RING_CAPACITY
+from hr_spo2 import collect_hr_spo2_data, collect_hr_spo2_data_async, \
+    PPG_RING, PPG_DTYPE, PPG_RING_CAPACITY
+from shm_ring import SampleRing
+import metrics
+import profiler
+from supervisor import Supervisor
+from async_runtime import AsyncRuntime
+
+# How to run the sensors and the BLE server, from the SLUMBER_RUNTIME
+# environment variable:
+#   processes - one supervised process each (default)
+#   asyncio   - coroutines on one event loop in this process, which uses
+#               less memory (see async_runtime.py)
+RUNTIME_ENV = 'SLUMBER_RUNTIME'
+PROCESSES = 'processes'
+ASYNCIO = 'asyncio'
+
+# Where each process runs (see supervisor.py): CPUs it is pinned to and its
+# nice level. HR/SpO2 gets a core of its own and the highest priority, so the
+# FIFO is read on time; temperature and its logging run at a low priority.
+HR_CPUS, HR_NICE = {2}, -5
+GYRO_CPUS, GYRO_NICE = {1}, 0
+TEMP_CPUS, TEMP_NICE = {0}, 10
+BLE_CPUS, BLE_NICE = {3}, 0
+
+# Port of the local Prometheus scrape endpoint (see metrics.py), None to
+# leave the metrics off (every update is then a no-op)
+METRICS_PORT = metrics.METRICS_PORT
+
+def run_processes(ble_main):
     # Shared queue for sensor data
     data_queue = Queue()
 
     # Define processes
-    processes = [
-        Process(target=collect_temperature_data, args=(data_queue,)),
-        Process(target=collect_gyro_data, args=(data_queue,)),
-        Process(target=collect_hr_spo2_data, args=(data_queue,)),
-        Process(target=ble_main, args=(data_queue,))
+    supervisor = Supervisor()
+    supervisor.add('temperature', collect_temperature_data, args=(data_queue,), cpus=TEMP_CPUS, nice=TEMP_NICE)
+    supervisor.add('gyroscope', collect_gyro_data, args=(data_queue,), cpus=GYRO_CPUS, nice=GYRO_NICE)
+    supervisor.add('hr_spo2', collect_hr_spo2_data, args=(data_queue,), cpus=HR_CPUS, nice=HR_NICE)
+    supervisor.add('ble', ble_main, args=(data_queue,), cpus=BLE_CPUS, nice=BLE_NICE)
+
+    # Start the processes and restart any that fail, until SIGTERM or Ctrl+C
+    supervisor.run()
+
+def run_asyncio(ble_main, ble_stop):
+    # Everything is in this process, so a thread-safe queue is enough
+    data_queue = queue.Queue()
+
+    runtime = AsyncRuntime()
+    runtime.add('temperature', collect_temperature_data_async, args=(data_queue,))
+    runtime.add('gyroscope', collect_gyro_data_async, args=(data_queue,))
+    runtime.add('hr_spo2', collect_hr_spo2_data_async, args=(data_queue,))
+    runtime.add_thread('ble', ble_main, args=(data_queue,), stop=ble_stop)
+    # one process, so one tag: the collectors are told apart by their frames
+    profiler.install('asyncio')
+    runtime.run()
+
+def main(ble_main=None, ble_stop=None):
+    """
+    Run the sensors and the BLE server: ble_server.main, stopped with
+    ble_server.stop, unless others are given (e.g. by a benchmark that
+    does without Bluetooth).
+    """
+    if ble_main is None:
+        # D-Bus and GLib are only imported where the BLE server runs
+        from ble_server import main as ble_main, stop as ble_stop
+
+    runtime = os.environ.get(RUNTIME_ENV, PROCESSES).lower()
+    if runtime not in (PROCESSES, ASYNCIO):
+        raise ValueError(f"{RUNTIME_ENV} must be {PROCESSES} or {ASYNCIO}, not {runtime!r}")
+
+    # Shared-memory rings for raw samples, for analysis processes to attach to
+    rings = [
+        SampleRing.create(TEMP_RING, TEMP_DTYPE, TEMP_RING_CAPACITY),
+        SampleRing.create(IMU_RING, IMU_DTYPE, IMU_RING_CAPACITY),
+        SampleRing.create(PPG_RING, PPG_DTYPE, PPG_RING_CAPACITY),
     ]
 
-    # Start processes
-    for p in processes:
-        p.start()
+    # Metrics of every process, before they start (see metrics.py)
+    server = None
+    if METRICS_PORT is not None:
+        metrics.create()
+        try:
+            server = metrics.serve(port=METRICS_PORT)
+        except OSError as e:
+            # the sensors matter more than their metrics
+            print(f"Metrics endpoint not started on port {METRICS_PORT}: {e}")
 
-    # Wait for all processes to complete
-    for p in processes:
-        p.join()
+    try:
+        if runtime == ASYNCIO:
+            run_asyncio(ble_main, ble_stop)
+        else:
+            run_processes(ble_main)
+    finally:
+        for ring in rings:
+            ring.close()
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        metrics.close()
 
 if __name__ == "__main__":
     main()
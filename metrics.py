@@ -0,0 +1,321 @@
+from bisect import bisect_left
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import shared_memory
+
+# Every metric is a few float64 slots in one shared-memory block, so the
+# collectors update them in their own processes and main.py serves them
+# all from one endpoint. Until a process binds the metrics to the block
+# (create() in main.py, attach() in the collectors) they are no-ops, so
+# a collector run on its own, reprocess.py and the benchmarks pay
+# nothing more than a call for them.
+METRICS_SHM = 'slumber_metrics'
+
+# Scrape endpoint in the Prometheus text format (GET /metrics),
+# on the loopback interface only
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9101
+
+# Histogram bucket upper bounds (a +Inf bucket is always added)
+READ_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0, 1.1, 1.25, 1.5, 2.0, 5.0)  # seconds
+COMPUTE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)  # seconds
+IO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)  # seconds
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)  # messages
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+# Slot 0 of the block holds its number of slots, to check on attach()
+_HEADER_SLOTS = 1
+
+# Every declared metric, in declaration order, and the slots they take
+_metrics = []
+_slots = _HEADER_SLOTS
+
+_shm = None
+_owner = False
+_values = None
+
+
+def _noop(*args):
+    pass
+
+
+class _Metric():
+    """
+    One series (a name and fixed labels) of `slots` float64 values in the
+    metrics block. Only one process (and thread) updates a series, so the
+    updates are plain stores without locks. They are functions set on the
+    instance, closures over the block once bound and no-ops until then,
+    so an update costs one plain function call.
+    """
+    kind = None
+
+    def __init__(self, name, help, slots=1, **labels):
+        global _slots
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.offset = _slots
+        self.slots = slots
+        _slots += slots
+        _metrics.append(self)
+        self._unbind()
+
+    def _updaters(self, values):
+        """
+        The update functions over `values`, by name.
+        """
+        return {}
+
+    def _bind(self, values):
+        self._values = values
+        self.__dict__.update(self._updaters(values))
+
+    def _unbind(self):
+        self._values = None
+        self.__dict__.update(dict.fromkeys(self._updaters(None), _noop))
+
+    def _read(self, slot=0):
+        return self._values[self.offset + slot] if self._values is not None else 0.0
+
+    def _label_text(self, extra=None):
+        labels = dict(self.labels, **(extra or {}))
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+    def samples(self):
+        """
+        The lines of this series in the text format.
+        """
+        return [f"{self.name}{self._label_text()} {_format(self._read())}"]
+
+
+class Counter(_Metric):
+    """
+    inc(amount=1) adds to the count.
+    """
+    kind = COUNTER
+
+    def _updaters(self, values):
+        offset = self.offset
+
+        def inc(amount=1):
+            values[offset] += amount
+        return {'inc': inc}
+
+
+class Gauge(_Metric):
+    """
+    set(value) sets the value, inc(amount=1) adds to it.
+    """
+    kind = GAUGE
+
+    def _updaters(self, values):
+        offset = self.offset
+
+        def set(value):
+            values[offset] = value
+
+        def inc(amount=1):
+            values[offset] += amount
+        return {'set': set, 'inc': inc}
+
+
+class Histogram(_Metric):
+    """
+    observe(value) counts the value in its bucket (value <= bound, then
+    +Inf) and adds it to the sum; the count is the sum of the buckets.
+    """
+    kind = HISTOGRAM
+
+    def __init__(self, name, help, buckets, **labels):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, len(self.buckets) + 2, **labels)
+
+    def _updaters(self, values):
+        offset = self.offset
+        buckets = self.buckets
+        total = offset + len(buckets) + 1
+
+        def observe(value):
+            values[offset + bisect_left(buckets, value)] += 1
+            values[total] += value
+        return {'observe': observe}
+
+    def samples(self):
+        lines = []
+        count = 0
+        for n, bound in enumerate(self.buckets + (float('inf'),)):
+            count += self._read(n)
+            le = '+Inf' if n == len(self.buckets) else _format(bound)
+            lines.append(f"{self.name}_bucket{self._label_text({'le': le})} {_format(count)}")
+        lines.append(f"{self.name}_sum{self._label_text()} {_format(self._read(len(self.buckets) + 1))}")
+        lines.append(f"{self.name}_count{self._label_text()} {_format(count)}")
+        return lines
+
+
+class _NoMetric():
+    """
+    Stands in for a series that is not declared: every method is a no-op.
+    """
+    def __getattr__(self, name):
+        return _noop
+
+
+NO_METRIC = _NoMetric()
+
+
+def _format(value):
+    value = float(value)
+    if value.is_integer() and abs(value) < 2 ** 53:
+        return str(int(value))
+    return repr(value)
+
+
+# --- the metrics ---
+
+PPG_READ_SECONDS = Histogram('slumber_sensor_read_seconds', "Time a collector blocked on one sensor read",
+                             READ_BUCKETS, sensor='ppg')
+TEMPERATURE_READ_SECONDS = Histogram('slumber_sensor_read_seconds', "Time a collector blocked on one sensor read",
+                                     READ_BUCKETS, sensor='temperature')
+PPG_SAMPLES = Counter('slumber_samples_total', "Raw samples read", sensor='ppg')
+IMU_SAMPLES = Counter('slumber_samples_total', "Raw samples read", sensor='imu')
+TEMPERATURE_SAMPLES = Counter('slumber_samples_total', "Raw samples read", sensor='temperature')
+
+HR_ESTIMATE_SECONDS = Histogram('slumber_hr_estimate_seconds', "Time of one sliding-window HR/SpO2 estimate",
+                                COMPUTE_BUCKETS)
+HR_ESTIMATES = Counter('slumber_hrcalc_estimates_total', "HR/SpO2 estimates made by hrcalc")
+HR_INVALID = Counter('slumber_hrcalc_invalid_total', "hrcalc estimates with an invalid value", value='hr')
+SPO2_INVALID = Counter('slumber_hrcalc_invalid_total', "hrcalc estimates with an invalid value", value='spo2')
+
+# the CSVLogger series, by the last part of the log directory
+CSV_LOGS = ('HR_SpO2', 'Temperature')
+CSV_ROWS = {log: Counter('slumber_csv_rows_total', "Rows written by CSVLogger", log=log) for log in CSV_LOGS}
+CSV_WRITE_SECONDS = {log: Histogram('slumber_csv_write_seconds', "Time to write (and fsync) one batch of CSV rows",
+                                    IO_BUCKETS, log=log) for log in CSV_LOGS}
+
+QUEUE_DEPTH = Gauge('slumber_queue_depth', "Messages waiting in the sensor queue, as the BLE consumer last saw it")
+BLE_BATCH_SIZE = Histogram('slumber_ble_batch_size', "Messages the BLE consumer took off the sensor queue at once",
+                           BATCH_BUCKETS)
+BLE_SEND_SECONDS = Histogram('slumber_ble_send_seconds', "Time to send one alert notification", COMPUTE_BUCKETS)
+BLE_SEND_ERRORS = Counter('slumber_ble_send_errors_total', "Alert notifications that failed to send")
+
+
+# --- the shared-memory block ---
+
+def _bind_all(shm, owner):
+    global _shm, _owner, _values
+    _shm = shm
+    _owner = owner
+    _values = shm.buf[:_slots * 8].cast('d')
+    for metric in _metrics:
+        metric._bind(_values)
+
+
+def create(name=METRICS_SHM):
+    """
+    Create the metrics block `name` (replacing a stale one), all zero,
+    and bind the metrics of this process to it. main.py does this before
+    starting the collectors.
+    """
+    size = _slots * 8
+    try:
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        # left behind by a process that did not shut down cleanly
+        stale = shared_memory.SharedMemory(name=name)
+        stale.close()
+        stale.unlink()
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    shm.buf[:size] = bytes(size)
+    _bind_all(shm, True)
+    _values[0] = _slots
+
+
+def attach(name=METRICS_SHM):
+    """
+    Bind the metrics of this process to the block created by main.py.
+    Returns False, leaving them no-ops, if there is none. Processes forked
+    after create() are bound already.
+    """
+    if _values is not None:
+        return True
+    try:
+        try:
+            # only the creator removes the block (Python 3.13+)
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    slots = int(shm.buf[:8].cast('d')[0])
+    if slots != _slots:
+        shm.close()
+        raise ValueError(f"metrics block {name} has {slots} slots, this process declares {_slots}")
+    _bind_all(shm, False)
+    return True
+
+
+def close():
+    """
+    Unbind the metrics (they are no-ops again) and close the block;
+    the process that created it also removes it.
+    """
+    global _shm, _values
+    if _shm is None:
+        return
+    for metric in _metrics:
+        metric._unbind()
+    _values.release()
+    _shm.close()
+    if _owner:
+        _shm.unlink()
+    _shm = None
+    _values = None
+
+
+# --- exposition ---
+
+def render():
+    """
+    Every metric in the Prometheus text format (version 0.0.4).
+    """
+    families = {}
+    for metric in _metrics:
+        families.setdefault(metric.name, []).append(metric)
+    lines = []
+    for name, series in families.items():
+        lines.append(f"# HELP {name} {series[0].help}")
+        lines.append(f"# TYPE {name} {series[0].kind}")
+        for metric in series:
+            lines += metric.samples()
+    return '\n'.join(lines) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # no line per scrape
+
+
+def serve(host=METRICS_HOST, port=METRICS_PORT):
+    """
+    Serve GET /metrics from a daemon thread. Returns the server; its
+    shutdown() stops it.
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
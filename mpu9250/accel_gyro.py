@@ -1,22 +1,71 @@
 from smbus2 import SMBus, i2c_msg
+from collections import namedtuple
+import struct
 import time
 import math
+import itertools
+import asyncio
+
+import sys
+import os
+sys.path.append(os.path.dirname(__file__))
+
+from orientation import OrientationFilter, MADGWICK
+import imu_backends
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import sensor_backend
+from shm_ring import SampleRing
+from binlog import BinaryLogger
+import metrics
 
 
 # MPU-9250 I2C address
 MPU_ADDR = 0x68
 
 # MPU-9250 Register addresses
-PWR_MGMT_1   = 0x6B
+SMPLRT_DIV   = 0x19
+CONFIG       = 0x1A
+ACCEL_CONFIG2 = 0x1D
+FIFO_EN      = 0x23
+INT_STATUS   = 0x3A
 ACCEL_XOUT_H = 0x3B
+TEMP_OUT_H   = 0x41
 GYRO_XOUT_H  = 0x43
-
-# I2C setup
-i2c = SMBus(1)  # On Raspberry Pi, I2C bus 1 is used
-
-# Wake up MPU-9250
-write = i2c_msg.write(MPU_ADDR, [PWR_MGMT_1, 0x00])
-i2c.i2c_rdwr(write)
+USER_CTRL    = 0x6A
+PWR_MGMT_1   = 0x6B
+FIFO_COUNTH  = 0x72
+FIFO_R_W     = 0x74
+
+# Register bits
+CONFIG_FIFO_MODE = 0x40     # stop writing to a full FIFO instead of overwriting
+FIFO_EN_SAMPLE = 0xF8       # TEMP_OUT, GYRO_XOUT/YOUT/ZOUT and ACCEL go into the FIFO
+USER_CTRL_FIFO_EN = 0x40
+USER_CTRL_FIFO_RST = 0x04
+INT_STATUS_FIFO_OFLOW = 0x10
+
+# FIFO
+FIFO_SIZE = 512             # bytes
+INTERNAL_RATE = 1000        # Hz, with the DLPF enabled
+STREAM_RATE = 100           # Hz, default streaming sample rate
+FIFO_WAKE_FILL = 2 / 3.0    # drain the FIFO when it is about this full
+# DLPF_CFG / A_DLPFCFG for the largest bandwidth below half the sample rate
+DLPF_SETTINGS = [(184, 1), (92, 2), (41, 3), (20, 4), (10, 5), (5, 6)]
+
+# accel x/y/z, temp, gyro x/y/z as big-endian int16 (0x3B - 0x48)
+SAMPLE_FORMAT = '>7h'
+SAMPLE_LEN = struct.calcsize(SAMPLE_FORMAT)
+
+# Scale factors
+ACCEL_SCALE = 16384.0   # LSB/g (±2g scale)
+GYRO_SCALE = 131.0      # LSB/(deg/s) (±250°/s scale)
+TEMP_SCALE = 333.87     # LSB/°C
+TEMP_OFFSET = 21.0      # °C at 0 LSB
+GRAVITY = 9.81          # m/s² per g
+
+# I2C bus, opened by open_bus()
+i2c = None
 
 # Global offsets
 accel_offset = [0.0, 0.0, 0.0]
@@ -25,70 +74,201 @@ gyro_offset = [0.0, 0.0, 0.0]
 # Thresholds
 GYRO_THRESHOLD = 2          # deg/s
 TILT_ANGLE_THRESHOLD = 30   # deg
+TILT_CONFIRM_TIME = 30      # seconds the fused tilt must stay above threshold, see benchmarks/bench_tilt.py
+
+# Orientation fusion mode, see orientation.py
+FUSION_MODE = MADGWICK
+
+# Seconds between two tilt values for the BLE vitals stream
+VITALS_INTERVAL = 1
+
+# Raw samples are published to this shared-memory ring (see shm_ring.py)
+# when main.py has created it, RING_BATCH samples at a time
+IMU_RING = 'slumber_imu'
+IMU_DTYPE = [('time', 'f8')] + [(field, 'f4') for field in ('ax', 'ay', 'az', 'temp', 'gx', 'gy', 'gz')]
+IMU_RING_CAPACITY = 60 * STREAM_RATE  # 1 minute at the default rate
+RING_BATCH = 25
+
+# Raw samples are also kept in a binary log (see binlog.py)
+LOG_RAW = True
+RAW_LOG_DIR = 'logs/raw/IMU'
 
+# One accel + temp + gyro reading: accel in m/s², temp in °C, gyro in deg/s
+Sample = namedtuple('Sample', ['ax', 'ay', 'az', 'temp', 'gx', 'gy', 'gz'])
+
+
+# Helper to read consecutive registers in one I2C transaction
+def read_block(reg, length):
+    write = i2c_msg.write(MPU_ADDR, [reg])
+    read = i2c_msg.read(MPU_ADDR, length)
+    i2c.i2c_rdwr(write, read)
+    return bytes(read)
+
+def open_bus(channel=1):
+    """
+    Open the I2C bus (on Raspberry Pi, I2C bus 1 is used) and wake up the MPU-9250.
+    """
+    global i2c
+    i2c = SMBus(channel)
+
+    # Wake up MPU-9250
+    write = i2c_msg.write(MPU_ADDR, [PWR_MGMT_1, 0x00])
+    i2c.i2c_rdwr(write)
+
+# Helper to write one register
+def write_register(reg, value):
+    i2c.i2c_rdwr(i2c_msg.write(MPU_ADDR, [reg, value]))
 
 # Helper to read 16-bit signed value from register
 def read_word_2c(reg):
-    high = i2c.read_byte_data(MPU_ADDR, reg)
-    low = i2c.read_byte_data(MPU_ADDR, reg + 1)
-    val = (high << 8) + low
-    if val >= 0x8000:
-        val -= 0x10000
-    return val
+    # high and low byte in one read, so they can not tear
+    return struct.unpack('>h', read_block(reg, 2))[0]
+
+def read_raw_sample():
+    """
+    Read accel, temp and gyro registers (0x3B - 0x48) in one transaction.
+    Returns the 7 raw int16 values; all of them come from the same sample.
+    """
+    return struct.unpack(SAMPLE_FORMAT, read_block(ACCEL_XOUT_H, SAMPLE_LEN))
+
+def convert_sample(raw):
+    """
+    Convert the raw values of read_raw_sample() to a Sample.
+    """
+    ax, ay, az, temp, gx, gy, gz = raw
+    return Sample(ax / ACCEL_SCALE * GRAVITY, ay / ACCEL_SCALE * GRAVITY, az / ACCEL_SCALE * GRAVITY,
+                  temp / TEMP_SCALE + TEMP_OFFSET,
+                  gx / GYRO_SCALE, gy / GYRO_SCALE, gz / GYRO_SCALE)
+
+def read_sample():
+    return convert_sample(read_raw_sample())
+
+def configure_fifo(sample_rate=STREAM_RATE):
+    """
+    Sample accel, temp and gyro at `sample_rate` Hz (4 - 1000) into the
+    on-chip FIFO, one SAMPLE_LEN record per sample. Returns the actual rate.
+    """
+    divider = min(max(int(round(INTERNAL_RATE / float(sample_rate))) - 1, 0), 255)
+    actual_rate = INTERNAL_RATE / float(divider + 1)
+    dlpf = next((cfg for bandwidth, cfg in DLPF_SETTINGS if bandwidth < actual_rate / 2), DLPF_SETTINGS[-1][1])
+
+    write_register(USER_CTRL, 0x00)
+    write_register(FIFO_EN, 0x00)
+    write_register(SMPLRT_DIV, divider)
+    write_register(CONFIG, CONFIG_FIFO_MODE | dlpf)
+    write_register(ACCEL_CONFIG2, dlpf)
+    reset_fifo()
+    write_register(FIFO_EN, FIFO_EN_SAMPLE)
+    return actual_rate
+
+def reset_fifo():
+    write_register(USER_CTRL, USER_CTRL_FIFO_RST)
+    write_register(USER_CTRL, USER_CTRL_FIFO_EN)
+
+def read_fifo_samples():
+    """
+    Drain every complete record from the FIFO in one block read.
+    Returns a list of raw 7-value tuples (as read_raw_sample), oldest first,
+    or None if the FIFO overflowed and was reset.
+    """
+    if read_block(INT_STATUS, 1)[0] & INT_STATUS_FIFO_OFLOW:
+        reset_fifo()
+        return None
+
+    count = struct.unpack('>H', read_block(FIFO_COUNTH, 2))[0] & 0x1FFF
+    count -= count % SAMPLE_LEN
+    if count == 0:
+        return []
+    return list(struct.iter_unpack(SAMPLE_FORMAT, read_block(FIFO_R_W, count)))
+
+def stream_samples(sample_rate=STREAM_RATE):
+    """
+    Generator of (timestamp, Sample) at `sample_rate` Hz from the hardware FIFO.
+    Sleeps until the FIFO is about FIFO_WAKE_FILL full, then drains it in one
+    burst; timestamps count back from the drain time at the sample rate.
+    Samples lost to an overflow are skipped.
+    """
+    sample_rate = configure_fifo(sample_rate)
+    period = 1.0 / sample_rate
+    wake_interval = FIFO_WAKE_FILL * (FIFO_SIZE // SAMPLE_LEN) * period
+
+    try:
+        while True:
+            time.sleep(wake_interval)
+            records = read_fifo_samples()
+            now = time.time()
+            if not records:
+                continue
+            first = now - (len(records) - 1) * period
+            for k, raw in enumerate(records):
+                yield first + k * period, convert_sample(raw)
+    finally:
+        write_register(FIFO_EN, 0x00)
+        write_register(USER_CTRL, 0x00)
 
 def read_accel():
-    ax = read_word_2c(ACCEL_XOUT_H)
-    ay = read_word_2c(ACCEL_XOUT_H + 2)
-    az = read_word_2c(ACCEL_XOUT_H + 4)
+    ax, ay, az = struct.unpack('>3h', read_block(ACCEL_XOUT_H, 6))
 
     # Convert raw to g (±2g scale)
-    ax_g = ax / 16384.0
-    ay_g = ay / 16384.0
-    az_g = az / 16384.0
+    ax_g = ax / ACCEL_SCALE
+    ay_g = ay / ACCEL_SCALE
+    az_g = az / ACCEL_SCALE
 
     # Convert to m/s²
-    ax_ms2 = ax_g * 9.81
-    ay_ms2 = ay_g * 9.81
-    az_ms2 = az_g * 9.81
+    ax_ms2 = ax_g * GRAVITY
+    ay_ms2 = ay_g * GRAVITY
+    az_ms2 = az_g * GRAVITY
 
     return [ax_ms2, ay_ms2, az_ms2]
 
 def read_gyro():
-    gx = read_word_2c(GYRO_XOUT_H)
-    gy = read_word_2c(GYRO_XOUT_H + 2)
-    gz = read_word_2c(GYRO_XOUT_H + 4)
-    return [gx / 131.0, gy / 131.0, gz / 131.0]  # ±250°/s scale
+    gx, gy, gz = struct.unpack('>3h', read_block(GYRO_XOUT_H, 6))
+    return [gx / GYRO_SCALE, gy / GYRO_SCALE, gz / GYRO_SCALE]  # ±250°/s scale
+
+# Calibration reads the sensor every 10 ms, or takes samples from a stream_samples() generator
 
-def calibrate_accelerometer(samples=100):
+def calibrate_accelerometer(samples=100, stream=None):
     global accel_offset
     print('Calibrating accelerometer ... keep flat')
     acc_sum = [0.0, 0.0, 0.0]
 
     for _ in range(samples):
-        ax, ay, az = read_accel()
+        if stream is not None:
+            ax, ay, az = next(stream)[1][0:3]
+        else:
+            ax, ay, az = read_accel()
+            time.sleep(0.01)
         acc_sum[0] += ax
         acc_sum[1] += ay
         acc_sum[2] += az
-        time.sleep(0.01)
 
     accel_offset = [acc_sum[i] / samples for i in range(3)]
     accel_offset[2] -= 9.81  # Remove gravity once
     print("Accelerometer calibration:", accel_offset)
 
-def gyro_calibration(calibration_time=5):
+def gyro_calibration(calibration_time=5, stream=None):
     global gyro_offset
     print("Beginning Gyro calibration (keep still)...")
     offsets = [0.0, 0.0, 0.0]
     num_samples = 0
-    end_time = time.time() + calibration_time
-
-    while time.time() < end_time:
-        gx, gy, gz = read_gyro()
+    now = time.time()
+    end_time = now + calibration_time
+
+    while now < end_time:
+        if stream is not None:
+            # go by sample time, so synthetic and replayed data calibrate over the same span
+            now, sample = next(stream)
+            gx, gy, gz = sample[4:7]
+            if num_samples == 0:
+                end_time = now + calibration_time
+        else:
+            gx, gy, gz = read_gyro()
+            time.sleep(0.01)
+            now = time.time()
         offsets[0] += gx
         offsets[1] += gy
         offsets[2] += gz
         num_samples += 1
-        time.sleep(0.01)
 
         if num_samples % 100 == 0:
             print("Still calibrating Gyro...", num_samples)
@@ -107,6 +287,14 @@ def read_calibrated_gyro():
     gx, gy, gz = read_gyro()
     return [gx - gyro_offset[0], gy - gyro_offset[1], gz - gyro_offset[2]]
 
+def read_calibrated_sample():
+    return calibrate_sample(read_sample())
+
+def calibrate_sample(sample):
+    ax, ay, az, temp, gx, gy, gz = sample
+    return Sample(ax - accel_offset[0], ay - accel_offset[1], az - accel_offset[2], temp,
+                  gx - gyro_offset[0], gy - gyro_offset[1], gz - gyro_offset[2])
+
 def get_y_tilt_angle():
     _, ay, az = read_calibrated_accel()
     return math.degrees(math.atan2(ay, az))
@@ -117,55 +305,201 @@ def get_pitch_roll_angles():
     return pitch
 
 
-# Main function to be called by main.py
-
-def collect_gyro_data(queue=None, verbose=False):
-    calibrate_accelerometer()
-    gyro_calibration()
-    initial_y_tilt = get_y_tilt_angle()
-
-    if verbose:
-        print("\nMonitoring tilt and roll...\n")
-
-    over_threshold_count = 0
-    samples = 30
-    tilt_sum = 0
+class HardwareImu():
+    """
+    The MPU-9250 on the I2C bus; stream() yields (timestamp, Sample)
+    through the hardware FIFO (see stream_samples).
+    """
+    def __init__(self, channel=1):
+        open_bus(channel)
+
+    def stream(self, sample_rate=STREAM_RATE):
+        return stream_samples(sample_rate)
+
+def open_imu(kind=None, clock=None):
+    """
+    Create the IMU for the backend `kind` (default: SLUMBER_BACKEND),
+    see sensor_backend.py.
+    """
+    kind = kind or sensor_backend.backend_kind()
+    clock = clock or sensor_backend.make_clock(kind)
+
+    if kind == sensor_backend.SYNTHETIC:
+        return imu_backends.SyntheticImu(clock)
+    if kind == sensor_backend.REPLAY:
+        return imu_backends.ReplayImu(sensor_backend.replay_path(imu_backends.REPLAY_FILE), clock)
+    return HardwareImu()
+
+# Opened on first use by get_imu(), once per process
+_imu = None
+_clock = None
+_imu_pid = None
+
+def get_imu():
+    """
+    The (imu, clock) of this process, opened on the first call,
+    so importing this module does not open the I2C bus.
+    """
+    global _imu, _clock, _imu_pid
+    if _imu is None or _imu_pid != os.getpid():
+        _clock = sensor_backend.make_clock()
+        _imu = open_imu(clock=_clock)
+        _imu_pid = os.getpid()
+    return _imu, _clock
+
+
+class TiltMonitor():
+    """
+    What the collector does with each sample after the calibration:
+    publishes it (ring, binary log, BLE vitals), fuses it into the orientation and
+    alerts when the tilt stays above TILT_ANGLE_THRESHOLD for
+    TILT_CONFIRM_TIME seconds. Starts from the (timestamp, sample) `first`.
+    Shared by collect_gyro_data and its asyncio version.
+    """
+    def __init__(self, first, queue=None, ring=None, verbose=False, raw_log=None):
+        self.queue = queue
+        self.ring = ring
+        self.raw_log = raw_log
+        self.verbose = verbose
+        self.batch = []
+
+        # Tilt is taken from the fused orientation, so short jolts that
+        # only move the accelerometer do not count as tilt
+        self.fusion = OrientationFilter(FUSION_MODE)
+        self.last_timestamp, sample = first
+        self.fusion.reset(calibrate_sample(sample)[0:3])
+        self.initial_y_tilt = self.fusion.y_tilt
+
+        self.over_threshold_since = None
+        self.tilt_sum = 0
+        self.tilt_count = 0
+        self.next_vitals_time = self.last_timestamp
+
+    def add(self, timestamp, sample):
+        """
+        Handle one raw sample.
+        """
+        if self.ring is not None or self.raw_log is not None:
+            self.batch.append((timestamp,) + tuple(sample))
+            if len(self.batch) >= RING_BATCH:
+                if self.ring is not None:
+                    self.ring.write(self.batch)
+                if self.raw_log is not None:
+                    self.raw_log.write(self.batch)
+                self.batch = []
+
+        sample = calibrate_sample(sample)
+        self.fusion.update(sample[0:3], sample[4:7], timestamp - self.last_timestamp)
+        self.last_timestamp = timestamp
+
+        current_y_tilt = self.fusion.y_tilt
+        tilt_change = abs(current_y_tilt - self.initial_y_tilt)
+
+        # Live value for the BLE vitals stream
+        if self.queue and timestamp >= self.next_vitals_time:
+            self.queue.put({'sensor': 'gyroscope', 'value': round(tilt_change, 2), 'alert': None})
+            self.next_vitals_time = timestamp + VITALS_INTERVAL
 
-    while True:
-        alert = None 
-
-        accel = read_calibrated_accel()
-        gyro = read_calibrated_gyro()
-        _, ay, az = accel
-        gx, _, _ = gyro
-
-        current_y_tilt = math.degrees(math.atan2(ay, az))
-        tilt_change = abs(current_y_tilt - initial_y_tilt)
-        
         if tilt_change > TILT_ANGLE_THRESHOLD:
-            over_threshold_count += 1
-            tilt_sum += tilt_change
+            if self.over_threshold_since is None:
+                self.over_threshold_since = timestamp
+            self.tilt_sum += tilt_change
+            self.tilt_count += 1
         else:
-            over_threshold_count = 0
-            tilt_sum = 0
+            self.over_threshold_since = None
+            self.tilt_sum = 0
+            self.tilt_count = 0
 
-        if over_threshold_count >= samples:  # 30 consecutive seconds above threshold
-            avg_tilt = round(tilt_sum / samples, 2)
+        if self.over_threshold_since is not None and timestamp - self.over_threshold_since >= TILT_CONFIRM_TIME:
+            avg_tilt = round(self.tilt_sum / self.tilt_count, 2)
 
             alert = f"Y Tilt Warning: Y tilt = {avg_tilt:.2f} deg"
-            if verbose:
+            if self.verbose:
                 print(alert)
-            if queue:
+            if self.queue:
                 message = {
                     'sensor': 'gyroscope',
                     'value': avg_tilt,
                     'alert': alert
                 }
-                queue.put(message)
-            over_threshold_count = 0
-            tilt_sum = 0
+                self.queue.put(message)
+            self.over_threshold_since = None
+            self.tilt_sum = 0
+            self.tilt_count = 0
+
+
+def calibrate_stream(stream):
+    """
+    Calibrate accelerometer and gyro from `stream`, then return its next
+    (timestamp, sample) to start a TiltMonitor from.
+    """
+    calibrate_accelerometer(stream=stream)
+    gyro_calibration(stream=stream)
+    return next(stream)
+
+
+def take(stream, count):
+    """
+    The next `count` (timestamp, sample) of `stream`, fewer at its end.
+    """
+    return list(itertools.islice(stream, count))
+
+
+# Main function to be called by main.py
+
+def collect_gyro_data(queue=None, verbose=False, sample_rate=STREAM_RATE, heartbeat=None):
+    metrics.attach()
+    imu, clock = get_imu()
+    stream = imu.stream(sample_rate)
+    first = calibrate_stream(stream)
+
+    if verbose:
+        print("\nMonitoring tilt and roll...\n")
+
+    raw_log = BinaryLogger(RAW_LOG_DIR, IMU_DTYPE, clock=clock) if LOG_RAW else None
+    monitor = TiltMonitor(first, queue, SampleRing.attach(IMU_RING, IMU_DTYPE), verbose, raw_log)
+
+    try:
+        for timestamp, sample in stream:
+            if heartbeat:
+                heartbeat.beat()
+            metrics.IMU_SAMPLES.inc()
+            monitor.add(timestamp, sample)
+    finally:
+        if raw_log:
+            raw_log.close()
+
+
+async def collect_gyro_data_async(queue=None, verbose=False, sample_rate=STREAM_RATE,
+                                  io_pool=None, compute_pool=None):
+    """
+    collect_gyro_data as a coroutine for async_runtime.py: the stream is
+    read in `io_pool`, RING_BATCH samples at a time (about one FIFO drain),
+    and the samples are fused on the event loop.
+    """
+    metrics.attach()
+    loop = asyncio.get_running_loop()
+    imu, clock = get_imu()
+    stream = imu.stream(sample_rate)
+    first = await loop.run_in_executor(io_pool, calibrate_stream, stream)
+
+    if verbose:
+        print("\nMonitoring tilt and roll...\n")
 
-        time.sleep(1.0)
+    raw_log = BinaryLogger(RAW_LOG_DIR, IMU_DTYPE, clock=clock) if LOG_RAW else None
+    monitor = TiltMonitor(first, queue, SampleRing.attach(IMU_RING, IMU_DTYPE), verbose, raw_log)
+
+    try:
+        while True:
+            samples = await loop.run_in_executor(io_pool, take, stream, RING_BATCH)
+            metrics.IMU_SAMPLES.inc(len(samples))
+            for timestamp, sample in samples:
+                monitor.add(timestamp, sample)
+            if len(samples) < RING_BATCH:
+                break  # end of replayed data
+    finally:
+        if raw_log:
+            raw_log.close()
 
 
 # Test function for unit testing
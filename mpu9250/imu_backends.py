@@ -0,0 +1,101 @@
+import os
+import sys
+import math
+import random
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+import sensor_backend
+
+# Replay file with one raw sample per row:
+# Time (unix seconds), ax, ay, az (m/s²), temp (°C), gx, gy, gz (deg/s)
+REPLAY_FILE = 'imu.csv'
+
+# Simulated time between two FIFO drains
+WAKE_INTERVAL = 0.25  # seconds
+
+GRAVITY = 9.81
+
+
+class SyntheticImu():
+    """
+    Same stream() as accel_gyro.HardwareImu for a sensor lying flat that rolls
+    over to `tilt` degrees for `tilt_duration` seconds in the middle of every
+    `period` seconds, taking `roll_time` seconds to turn each way.
+    Samples are 7-tuples in accel_gyro.Sample order.
+    """
+    def __init__(self, clock, tilt=45.0, period=600.0, tilt_duration=60.0, roll_time=2.0,
+                 accel_noise=0.05, gyro_noise=0.1, seed=0):
+        self.clock = clock
+        self.tilt = tilt
+        self.period = period
+        self.tilt_duration = tilt_duration
+        self.roll_time = roll_time
+        self.accel_noise = accel_noise
+        self.gyro_noise = gyro_noise
+        self._rng = random.Random(seed)
+
+    def roll_at(self, elapsed):
+        """
+        Roll angle (deg) and roll rate (deg/s) `elapsed` seconds into the stream.
+        """
+        phase = elapsed % self.period - self.period / 2
+        turn_rate = self.tilt / self.roll_time
+        if phase < 0:
+            return 0.0, 0.0
+        if phase < self.roll_time:
+            return turn_rate * phase, turn_rate
+        phase -= self.roll_time
+        if phase < self.tilt_duration:
+            return self.tilt, 0.0
+        phase -= self.tilt_duration
+        if phase < self.roll_time:
+            return self.tilt - turn_rate * phase, -turn_rate
+        return 0.0, 0.0
+
+    def stream(self, sample_rate=100):
+        period = 1.0 / sample_rate
+        start = self.clock.time()
+        n = 0
+        gauss = self._rng.gauss
+        while True:
+            # one FIFO drain worth of samples
+            batch = []
+            for _ in range(max(int(WAKE_INTERVAL * sample_rate), 1)):
+                timestamp = start + n * period
+                roll, roll_rate = self.roll_at(n * period)
+                r = math.radians(roll)
+                sample = (gauss(0, self.accel_noise),
+                          GRAVITY * math.sin(r) + gauss(0, self.accel_noise),
+                          GRAVITY * math.cos(r) + gauss(0, self.accel_noise),
+                          30.0,
+                          roll_rate + gauss(0, self.gyro_noise),
+                          gauss(0, self.gyro_noise),
+                          gauss(0, self.gyro_noise))
+                batch.append((timestamp, sample))
+                n += 1
+
+            sensor_backend.wait_until(self.clock, batch[-1][0])
+            for item in batch:
+                yield item
+
+
+class ReplayImu():
+    """
+    Same stream() as accel_gyro.HardwareImu over raw samples recorded in a
+    CSV file, paced by the recorded timestamps on `clock`. The recorded rate
+    is used whatever sample_rate is asked for; the stream ends with the file.
+    """
+    def __init__(self, path, clock):
+        self.path = path
+        self.clock = clock
+
+    def stream(self, sample_rate=None):
+        started = False
+        for row in sensor_backend.read_csv(self.path):
+            timestamp = row[0]
+            if not started and hasattr(self.clock, 'restart'):
+                self.clock.restart(timestamp)
+            started = True
+            sensor_backend.wait_until(self.clock, timestamp, batch=WAKE_INTERVAL)
+            yield timestamp, tuple(row[1:8])
@@ -0,0 +1,162 @@
+import math
+
+# Filter modes
+COMPLEMENTARY = 'complementary'
+MADGWICK = 'madgwick'
+
+# Default gains
+COMPLEMENTARY_ALPHA = 0.98  # weight of the gyro-integrated angle per update
+MADGWICK_BETA = 0.1         # gradient descent step, larger follows the accelerometer faster
+
+# Gaps between samples longer than this restart the filter from the accelerometer;
+# samples stamped at or before the previous one (timestamp jitter) are skipped
+MAX_DT = 0.5  # seconds
+
+
+class OrientationFilter():
+    """
+    Fuses accelerometer and gyroscope samples into an orientation.
+
+    Accel is in any unit (only its direction is used), gyro in deg/s.
+    Both modes keep a quaternion (w, x, y, z); `roll` is the rotation about
+    the x axis and matches atan2(ay, az) when the sensor is at rest, so it is
+    the fused y tilt. Yaw is gyro-only and drifts.
+    """
+    def __init__(self, mode=MADGWICK, alpha=COMPLEMENTARY_ALPHA, beta=MADGWICK_BETA):
+        if mode not in (COMPLEMENTARY, MADGWICK):
+            raise ValueError(f"unknown filter mode: {mode}")
+        self.mode = mode
+        self.alpha = alpha
+        self.beta = beta
+        self.q = (1.0, 0.0, 0.0, 0.0)
+        self.initialized = False
+        self._roll = 0.0
+        self._pitch = 0.0
+        self._yaw = 0.0
+
+    def reset(self, accel):
+        """
+        Start from the tilt given by the accelerometer, with zero yaw.
+        """
+        ax, ay, az = accel
+        self._roll = math.atan2(ay, az)
+        self._pitch = math.atan2(-ax, math.sqrt(ay * ay + az * az))
+        self._yaw = 0.0
+        self.q = _euler_to_quaternion(self._roll, self._pitch, self._yaw)
+        self.initialized = True
+
+    def update(self, accel, gyro, dt):
+        """
+        Advance the filter by one sample taken `dt` seconds after the previous one.
+        Returns the new quaternion.
+        """
+        if not self.initialized or dt > MAX_DT:
+            self.reset(accel)
+            return self.q
+        if dt <= 0:
+            return self.q
+
+        if self.mode == MADGWICK:
+            self._update_madgwick(accel, gyro, dt)
+        else:
+            self._update_complementary(accel, gyro, dt)
+        return self.q
+
+    def _update_complementary(self, accel, gyro, dt):
+        ax, ay, az = accel
+        gx, gy, gz = (math.radians(g) for g in gyro)
+
+        roll_acc = math.atan2(ay, az)
+        pitch_acc = math.atan2(-ax, math.sqrt(ay * ay + az * az))
+
+        # keep the blend continuous where roll wraps around at ±180°
+        roll = self._roll + gx * dt
+        roll_acc += 2 * math.pi * round((roll - roll_acc) / (2 * math.pi))
+
+        self._roll = self.alpha * roll + (1 - self.alpha) * roll_acc
+        self._pitch = self.alpha * (self._pitch + gy * dt) + (1 - self.alpha) * pitch_acc
+        self._yaw += gz * dt
+        self.q = _euler_to_quaternion(self._roll, self._pitch, self._yaw)
+
+    def _update_madgwick(self, accel, gyro, dt):
+        # Madgwick's IMU (accelerometer + gyroscope) update
+        q0, q1, q2, q3 = self.q
+        ax, ay, az = accel
+        gx, gy, gz = (math.radians(g) for g in gyro)
+
+        # rate of change of quaternion from gyroscope
+        q_dot0 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+        q_dot1 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+        q_dot2 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+        q_dot3 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+
+        norm = math.sqrt(ax * ax + ay * ay + az * az)
+        if norm > 0:
+            ax, ay, az = ax / norm, ay / norm, az / norm
+
+            # gradient descent step towards the measured gravity direction
+            _2q0, _2q1, _2q2, _2q3 = 2 * q0, 2 * q1, 2 * q2, 2 * q3
+            _4q0, _4q1, _4q2 = 4 * q0, 4 * q1, 4 * q2
+            _8q1, _8q2 = 8 * q1, 8 * q2
+            q0q0, q1q1, q2q2, q3q3 = q0 * q0, q1 * q1, q2 * q2, q3 * q3
+
+            s0 = _4q0 * q2q2 + _2q2 * ax + _4q0 * q1q1 - _2q1 * ay
+            s1 = _4q1 * q3q3 - _2q3 * ax + 4 * q0q0 * q1 - _2q0 * ay - _4q1 + _8q1 * q1q1 + _8q1 * q2q2 + _4q1 * az
+            s2 = 4 * q0q0 * q2 + _2q0 * ax + _4q2 * q3q3 - _2q3 * ay - _4q2 + _8q2 * q1q1 + _8q2 * q2q2 + _4q2 * az
+            s3 = 4 * q1q1 * q3 - _2q1 * ax + 4 * q2q2 * q3 - _2q2 * ay
+
+            norm = math.sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+            if norm > 0:
+                q_dot0 -= self.beta * s0 / norm
+                q_dot1 -= self.beta * s1 / norm
+                q_dot2 -= self.beta * s2 / norm
+                q_dot3 -= self.beta * s3 / norm
+
+        q0 += q_dot0 * dt
+        q1 += q_dot1 * dt
+        q2 += q_dot2 * dt
+        q3 += q_dot3 * dt
+
+        norm = math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+        self.q = (q0 / norm, q1 / norm, q2 / norm, q3 / norm)
+
+    @property
+    def roll(self):
+        """
+        Rotation about the x axis in degrees.
+        """
+        q0, q1, q2, q3 = self.q
+        return math.degrees(math.atan2(2 * (q0 * q1 + q2 * q3), 1 - 2 * (q1 * q1 + q2 * q2)))
+
+    @property
+    def pitch(self):
+        """
+        Rotation about the y axis in degrees.
+        """
+        q0, q1, q2, q3 = self.q
+        return math.degrees(math.asin(max(-1.0, min(1.0, 2 * (q0 * q2 - q3 * q1)))))
+
+    @property
+    def yaw(self):
+        """
+        Rotation about the z axis in degrees (gyro only, drifts).
+        """
+        q0, q1, q2, q3 = self.q
+        return math.degrees(math.atan2(2 * (q0 * q3 + q1 * q2), 1 - 2 * (q2 * q2 + q3 * q3)))
+
+    @property
+    def y_tilt(self):
+        """
+        Fused equivalent of atan2(ay, az), in degrees.
+        """
+        return self.roll
+
+
+def _euler_to_quaternion(roll, pitch, yaw):
+    cr, sr = math.cos(roll / 2), math.sin(roll / 2)
+    cp, sp = math.cos(pitch / 2), math.sin(pitch / 2)
+    cy, sy = math.cos(yaw / 2), math.sin(yaw / 2)
+    return (cr * cp * cy + sr * sp * sy,
+            sr * cp * cy - cr * sp * sy,
+            cr * sp * cy + sr * cp * sy,
+            cr * cp * sy - sr * sp * cy)
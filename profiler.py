@@ -0,0 +1,300 @@
+import os
+import sys
+import glob
+import argparse
+import signal
+import socket
+import stat
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+# On-demand stack sampling of a running device. Every process that calls
+# install() can be profiled for a number of seconds, by a signal
+# (kill -USR1 <pid>, PROFILE_SECONDS) or through its control socket
+# (python profiler.py [seconds] [tag ...]). Until then it only has a
+# signal handler and a thread blocked in accept().
+PROFILE_SIGNAL = signal.SIGUSR1
+PROFILE_SECONDS = 30
+MAX_PROFILE_SECONDS = 600
+# Seconds between two samples of every thread's stack
+SAMPLE_INTERVAL = 0.01
+
+# Profiles are written here, one collapsed-stack file per process and run
+# ("tag;thread;frame;...;frame weight" lines, for flamegraph.pl, inferno
+# or speedscope); the weight is microseconds of CPU
+PROFILE_DIR = 'logs/profiles'
+PROFILE_EXTENSION = '.collapsed'
+
+# One control socket per process, named after its tag, in a directory
+# only this user can enter; the sockets are 0600 as well
+SOCKET_DIR = (os.path.join(os.environ['XDG_RUNTIME_DIR'], 'slumber-profile')
+              if os.environ.get('XDG_RUNTIME_DIR') else '/run/slumber/profile')
+SOCKET_TIMEOUT = 5.0  # seconds to send the request
+
+
+def thread_cpu_ns(native_id):
+    """
+    CPU nanoseconds a thread of this process has used (from
+    /proc/self/task/<id>/schedstat), None where that is not available.
+    """
+    try:
+        fd = os.open(f'/proc/self/task/{native_id}/schedstat', os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        return int(os.read(fd, 64).split(None, 1)[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    finally:
+        os.close(fd)
+
+
+class StackSampler():
+    """
+    Samples the Python stack of every thread of this process but its own
+    every `interval` seconds. Each stack is weighted by the CPU time its
+    thread used since the previous sample, so threads that wait (on the
+    sensor, the queue, the GLib loop) drop out and what is left is where
+    the CPU went. Without per-thread CPU times every sample weighs 1 µs.
+    """
+    def __init__(self, tag, interval=SAMPLE_INTERVAL):
+        self.tag = tag
+        self.interval = interval
+        self.samples = 0
+        self.stacks = defaultdict(int)
+        self._labels = {}
+        self._cpu = {}
+
+    def _frame_label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def sample(self):
+        """
+        Add the current stack of every other thread.
+        """
+        own = threading.get_ident()
+        # CPU times first: reading them releases the GIL, the stacks
+        # are taken after that in one go
+        names = {}
+        weights = {}
+        for thread in threading.enumerate():
+            names[thread.ident] = thread.name
+            cpu = thread_cpu_ns(thread.native_id)
+            if cpu is not None:
+                weights[thread.ident] = (cpu - self._cpu.get(thread.ident, cpu)) // 1000
+                self._cpu[thread.ident] = cpu
+
+        for ident, frame in sys._current_frames().items():
+            weight = weights.get(ident, 1)
+            if ident == own or weight <= 0:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(self._frame_label(frame.f_code))
+                frame = frame.f_back
+            labels.append(names.get(ident, str(ident)))
+            labels.append(self.tag)
+            self.stacks[';'.join(reversed(labels))] += weight
+        self.samples += 1
+
+    def run(self, seconds):
+        """
+        Sample for `seconds` seconds.
+        """
+        # the CPU times so far, so the first sample does not get them all
+        for thread in threading.enumerate():
+            cpu = thread_cpu_ns(thread.native_id)
+            if cpu is not None:
+                self._cpu[thread.ident] = cpu
+        end = time.monotonic() + seconds
+        next_sample = time.monotonic() + self.interval
+        while next_sample < end:
+            time.sleep(max(next_sample - time.monotonic(), 0))
+            self.sample()
+            next_sample += self.interval
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, weight in sorted(self.stacks.items()):
+                f.write(f"{stack} {weight}\n")
+
+
+# --- in the profiled process ---
+
+_tag = None
+_lock = threading.Lock()
+
+
+def profile(seconds=PROFILE_SECONDS, out_dir=PROFILE_DIR):
+    """
+    Sample this process for `seconds` seconds (at most MAX_PROFILE_SECONDS)
+    and write the collapsed stacks. Returns the absolute path of the
+    file, or None if a profile is already being taken.
+    """
+    if not _lock.acquire(blocking=False):
+        return None
+    try:
+        seconds = min(max(float(seconds), 0.0), MAX_PROFILE_SECONDS)
+        tag = _tag or 'python'
+        started = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        sampler = StackSampler(tag)
+        sampler.run(seconds)
+
+        os.makedirs(out_dir, exist_ok=True)
+        path = os.path.abspath(os.path.join(out_dir, f"{tag}_{os.getpid()}_{started}{PROFILE_EXTENSION}"))
+        sampler.write(path)
+        print(f"[profiler] {tag}: {sampler.samples} samples in {seconds:g} s written to {path}")
+        return path
+    finally:
+        _lock.release()
+
+
+def _on_signal(signum, frame):
+    # the sampling runs in a thread of its own, not in the handler
+    threading.Thread(target=profile, name='profiler', daemon=True).start()
+
+
+def socket_path(tag, sock_dir=SOCKET_DIR):
+    return os.path.join(sock_dir, f"{tag}.sock")
+
+
+def private_dir(sock_dir=SOCKET_DIR):
+    """
+    Create the control socket directory (0700) if needed, and raise OSError
+    unless it is a directory of this user that no one else can enter.
+    """
+    os.makedirs(sock_dir, mode=0o700, exist_ok=True)
+    info = os.lstat(sock_dir)
+    if not stat.S_ISDIR(info.st_mode):
+        raise OSError(f"{sock_dir} is not a directory")
+    if info.st_uid != os.getuid():
+        raise OSError(f"{sock_dir} belongs to uid {info.st_uid}, not {os.getuid()}")
+    if info.st_mode & 0o077:
+        raise OSError(f"{sock_dir} is open to other users (mode {stat.S_IMODE(info.st_mode):o})")
+
+
+def _serve(server):
+    while True:
+        connection, _ = server.accept()
+        threading.Thread(target=_answer, args=(connection,), name='profiler', daemon=True).start()
+
+
+def _answer(connection):
+    with connection:
+        try:
+            connection.settimeout(SOCKET_TIMEOUT)
+            request = connection.makefile('r').readline().split()
+            connection.settimeout(None)
+            path = profile(float(request[0]) if request else PROFILE_SECONDS)
+            connection.sendall(f"{path or 'busy'}\n".encode('utf-8'))
+        except (OSError, ValueError) as e:
+            print(f"[profiler] {_tag}: bad control request: {e}")
+
+
+def install(tag, sock_dir=SOCKET_DIR):
+    """
+    Make this process profilable as `tag` (e.g. the supervisor's name for
+    it): PROFILE_SIGNAL starts a PROFILE_SECONDS profile, and a line with
+    the seconds sent to its control socket starts one and gets back the
+    path of the file. Call it from the main thread.
+    """
+    global _tag
+    _tag = tag
+    signal.signal(PROFILE_SIGNAL, _on_signal)
+
+    path = socket_path(tag, sock_dir)
+    try:
+        private_dir(sock_dir)
+        if os.path.exists(path):
+            os.remove(path)  # left behind by the previous run of this process
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        os.chmod(path, 0o600)
+        server.listen()
+    except OSError as e:
+        print(f"[profiler] {tag}: no control socket at {path}: {e}")
+        return
+    threading.Thread(target=_serve, args=(server,), name='profiler-control', daemon=True).start()
+
+
+# --- command line ---
+
+def request(tag, seconds, sock_dir=SOCKET_DIR):
+    """
+    Profile the process `tag` through its control socket, blocking until
+    it is done. Returns the path of its profile, or None if it was busy.
+    """
+    private_dir(sock_dir)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(SOCKET_TIMEOUT)
+        client.connect(socket_path(tag, sock_dir))
+        client.sendall(f"{seconds}\n".encode('utf-8'))
+        client.settimeout(seconds + SOCKET_TIMEOUT + 60)
+        reply = client.makefile('r').readline().strip()
+    return None if reply in ('', 'busy') else reply
+
+
+def merge(paths, path):
+    """
+    Write the collapsed stacks of several processes into one file
+    (the stacks start with the process tag, so they stay apart).
+    """
+    with open(path, 'w') as out:
+        for part in paths:
+            with open(part) as f:
+                out.write(f.read())
+
+
+def main():
+    """
+    python profiler.py [seconds] [tag ...]
+    """
+    parser = argparse.ArgumentParser(description="Profile running processes through their control sockets.")
+    parser.add_argument('seconds', nargs='?', type=float, default=PROFILE_SECONDS,
+                        help="seconds to sample for (default: %(default)s)")
+    parser.add_argument('tags', nargs='*', help="processes to profile, e.g. hr_spo2 ble (default: all)")
+    parser.add_argument('--sockets', default=SOCKET_DIR, help="control socket directory (default: %(default)s)")
+    args = parser.parse_args()
+
+    seconds = args.seconds
+    tags = args.tags or sorted(os.path.basename(p)[:-len('.sock')] for p in glob.glob(socket_path('*', args.sockets)))
+    if not tags:
+        print(f"No profilable processes (no control sockets in {args.sockets})")
+        return
+
+    print(f"Profiling {', '.join(tags)} for {seconds:g} s")
+    results = {}
+
+    def run(tag):
+        try:
+            results[tag] = request(tag, seconds, args.sockets)
+        except OSError as e:
+            results[tag] = None
+            print(f"{tag}: {e}")
+
+    threads = [threading.Thread(target=run, args=(tag,)) for tag in tags]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    paths = [results[tag] for tag in tags if results.get(tag)]
+    for tag in tags:
+        print(f"{tag}: {results.get(tag) or 'no profile (busy or not running)'}")
+    if len(paths) > 1:
+        merged = os.path.join(os.path.dirname(paths[0]),
+                              f"all_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}{PROFILE_EXTENSION}")
+        merge(paths, merged)
+        print(f"all processes: {merged}")
+    if paths:
+        print("e.g. flamegraph.pl <file> > profile.svg, or open the file in speedscope")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+import os
+import io
+import sys
+import csv
+import ast
+import json
+import time
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(ROOT, folder) for folder in ('MAX30102', 'mpu9250', 'Temperature')]
+
+import hrcalc
+import hr_spo2
+import accel_gyro
+import temperature
+from binlog import BinaryLog
+from logquery import LOG_ROOT, RAW_LOG_DIRS, CSV_TIME_FORMAT, RawLogs, parse_time
+
+# PPG and IMU logs are cut into windows of this many seconds, which are
+# processed in parallel
+WINDOW = 600  # seconds
+# IMU windows start this much earlier, so the orientation filter and the
+# tilt alert state have settled by the start of the window
+TILT_WARMUP = 60  # seconds
+# What accel_gyro.calibrate_stream takes from the IMU stream: this many
+# accelerometer samples, then gyro samples over this many seconds
+CALIBRATION_ACCEL_SAMPLES = 100
+CALIBRATION_GYRO_TIME = 5  # seconds
+OUTPUT_DIR = 'reprocessed'
+# Modules whose settings can be changed for a run (--set module.NAME=value)
+MODULES = {module.__name__: module for module in (hrcalc, hr_spo2, accel_gyro, temperature)}
+
+
+class _Clock():
+    """
+    The clock of a monitor: the time of the sample being processed.
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class _Sink():
+    """
+    Stands in for the BLE queue (put) or the CSV logger (log) of a
+    monitor, keeping what it gets with the time of `clock`.
+    """
+    def __init__(self, clock):
+        self.clock = clock
+        self.items = []
+
+    def put(self, item):
+        self.items.append((self.clock.time(), item))
+
+    log = put
+
+
+def apply_settings(settings):
+    """
+    Set module attributes from [(module, name, value)], in every worker as well.
+    """
+    for module, name, value in settings:
+        setattr(MODULES[module], name, value)
+
+
+def estimate_ppg(path, lo, hi):
+    """
+    The HR/SpO2 estimates of a PPG log whose windows end after sample `lo`
+    and at most at sample `hi` (multiples of hr_spo2.hop_size), the same
+    as the collector makes them: (times, hr, hr_valid, spo2, spo2_valid).
+    """
+    hop = hr_spo2.hop_size
+    ends = np.arange(max(lo + hop, hrcalc.BUFFER_SIZE), hi + 1, hop)
+    if not len(ends):
+        return (np.empty(0),) * 5
+    first = int(ends[0]) - hrcalc.BUFFER_SIZE
+    log = BinaryLog(path)
+    # the windows as rows of a strided view, copied by the fancy index
+    starts = ends - hrcalc.BUFFER_SIZE - first
+    ir = np.lib.stride_tricks.sliding_window_view(log.rows('ir', first, hi), hrcalc.BUFFER_SIZE)[starts]
+    red = np.lib.stride_tricks.sliding_window_view(log.rows('red', first, hi), hrcalc.BUFFER_SIZE)[starts]
+    times = log.rows('time', first, hi)[ends - 1 - first]
+    log.close()
+    return (times,) + hrcalc.calc_hr_and_spo2_batch(ir, red)
+
+
+def tilt_window(path, lo, hi, warmup, calibration):
+    """
+    What the tilt monitor of the collector sends for samples lo..hi-1 of
+    an IMU log, starting `warmup` samples earlier: [(time, message)].
+    """
+    accel_offset, gyro_offset, initial_y_tilt = calibration
+    accel_gyro.accel_offset = list(accel_offset)
+    accel_gyro.gyro_offset = list(gyro_offset)
+
+    start = max(0, lo - warmup)
+    log = BinaryLog(path)
+    times = log.rows('time', start, hi).tolist()
+    samples = list(zip(*(log.rows(name, start, hi).tolist() for name in accel_gyro.Sample._fields)))
+    log.close()
+
+    clock = _Clock()
+    queue = _Sink(clock)
+    monitor = accel_gyro.TiltMonitor((times[0], samples[0]), queue if start == lo else None)
+    monitor.initial_y_tilt = initial_y_tilt
+    for k in range(1, len(times)):
+        if k == lo - start:
+            monitor.queue = queue
+        clock.now = times[k]
+        monitor.add(times[k], samples[k])
+    return queue.items
+
+
+def average_temperature(path, start=None, end=None):
+    """
+    What the temperature monitor of the collector sends and logs for the
+    readings of a temperature log in [start, end): ([(time, message)],
+    [(time, average)]).
+    """
+    log = BinaryLog(path)
+    times = log.column('time', start, end)
+    temps = log.column('temp', start, end).tolist()
+    if not temps:
+        log.close()
+        return [], []
+    # the probes of one reading share its time
+    readings = np.flatnonzero(np.diff(times)) + 1
+    starts = [0] + readings.tolist()
+    stops = readings.tolist() + [len(temps)]
+    times = times[starts].tolist()
+    log.close()
+
+    clock = _Clock()
+    queue = _Sink(clock)
+    logger = _Sink(clock)
+    monitor = temperature.TemperatureMonitor(clock, queue, logger)
+    for t, a, b in zip(times, starts, stops):
+        clock.now = t
+        monitor.add(temps[a:b])
+    return queue.items, logger.items
+
+
+def _rate(log):
+    """
+    Samples per second of an IMU log, from its first two samples.
+    """
+    if len(log) < 2:
+        return accel_gyro.STREAM_RATE
+    first, second = log.rows('time', 0, 2).tolist()
+    return 1.0 / (second - first) if second > first else accel_gyro.STREAM_RATE
+
+
+def calibration_rows(log):
+    """
+    Rows of an IMU log that accel_gyro.calibrate_stream takes, or None if
+    the log is too short to calibrate on.
+    """
+    accel = CALIBRATION_ACCEL_SAMPLES
+    if len(log) <= accel:
+        return None
+    # the gyro takes samples until one is CALIBRATION_GYRO_TIME seconds
+    # after its first, then the stream gives one more to start from
+    gyro_end = float(log.rows('time', accel, accel + 1)[0]) + CALIBRATION_GYRO_TIME
+    count = len(log.column('time', None, gyro_end)) + 2
+    return count if count <= len(log) else None
+
+
+def calibrate_imu(log):
+    """
+    (accel offset, gyro offset, initial y tilt) of an IMU log, or None if
+    it is too short. The collector calibrates on the samples before the
+    first logged one, the first rows of the log stand in for them.
+    """
+    count = calibration_rows(log)
+    if count is None:
+        return None
+    stream = zip(log.rows('time', 0, count).tolist(),
+                 zip(*(log.rows(name, 0, count).tolist() for name in accel_gyro.Sample._fields)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        first = accel_gyro.calibrate_stream(stream)
+    monitor = accel_gyro.TiltMonitor(first)
+    return accel_gyro.accel_offset, accel_gyro.gyro_offset, monitor.initial_y_tilt
+
+
+def _run(task):
+    function, args = task
+    return function(*args)
+
+
+def make_tasks(logs_dir, start=None, end=None, window=WINDOW):
+    """
+    The windows to process, as [(sensor, path, (function, args))], the
+    longest-running (IMU) first.
+    """
+    tasks = []
+    for path, _, _ in RawLogs(os.path.join(logs_dir, RAW_LOG_DIRS['imu'])).files(start, end):
+        log = BinaryLog(path)
+        calibration = calibrate_imu(log)
+        if calibration is None:
+            print(f"{path}: skipped, {len(log)} samples are too few to calibrate on")
+        else:
+            # calibrated on the start of the log and warmed up before the
+            # window, as the collector was, whatever the range
+            first, stop = log.row_range(start, end)
+            rate = _rate(log)
+            size = int(window * rate)
+            for lo in range(max(first, 1), stop, size):
+                args = (path, lo, min(lo + size, stop), int(TILT_WARMUP * rate), calibration)
+                tasks.append(('imu', path, (tilt_window, args)))
+        log.close()
+
+    # windows end on multiples of the hop, as in the collector; the
+    # estimates are those whose last sample is in the range
+    hop = hr_spo2.hop_size
+    size = max(int(window * hrcalc.SAMPLE_FREQ) // hop, 1) * hop
+    for path, _, _ in RawLogs(os.path.join(logs_dir, RAW_LOG_DIRS['ppg'])).files(start, end):
+        log = BinaryLog(path)
+        first, stop = log.row_range(start, end)
+        log.close()
+        first, stop = first - first % hop, stop - stop % hop
+        for lo in range(first, stop, size):
+            tasks.append(('ppg', path, (estimate_ppg, (path, lo, min(lo + size, stop)))))
+
+    for path, _, _ in RawLogs(os.path.join(logs_dir, RAW_LOG_DIRS['temperature'])).files(start, end):
+        tasks.append(('temperature', path, (average_temperature, (path, start, end))))
+    return tasks
+
+
+class _Output():
+    """
+    The CSV files of the derived series and the alerts in `out_dir`. The
+    series come in time order; the alerts of all sensors are sorted by
+    time and written on close().
+    """
+    HEADERS = {
+        'hr_spo2': ['Time', 'HR', 'SpO2'],
+        'temperature': ['Time', 'Temperature (°C)'],
+        'tilt': ['Time', 'Tilt (deg)'],
+        'alerts': ['Time', 'Sensor', 'Value', 'Alert'],
+    }
+
+    def __init__(self, out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+        self.files = {name: open(os.path.join(out_dir, name + '.csv'), 'w', newline='') for name in self.HEADERS}
+        self.writers = {name: csv.writer(f) for name, f in self.files.items()}
+        self.rows = dict.fromkeys(self.HEADERS, 0)
+        self.alerts = []
+        for name, header in self.HEADERS.items():
+            self.writers[name].writerow(header)
+
+    def write(self, name, t, *values):
+        self.writers[name].writerow([datetime.fromtimestamp(t).strftime(CSV_TIME_FORMAT)] + list(values))
+        self.rows[name] += 1
+
+    def messages(self, name, items):
+        """
+        Messages a monitor put on its queue: alerts, and values for the series `name` (None to skip them).
+        """
+        for t, message in items:
+            if message['alert']:
+                self.alerts.append((t, message['sensor'], json.dumps(message['value']), message['alert']))
+            elif name is not None:
+                self.write(name, t, message['value'])
+
+    def close(self):
+        for alert in sorted(self.alerts, key=lambda alert: alert[0]):
+            self.write('alerts', *alert)
+        for f in self.files.values():
+            f.close()
+
+
+def reprocess(logs_dir=LOG_ROOT, out_dir=OUTPUT_DIR, start=None, end=None, workers=None,
+              window=WINDOW, settings=()):
+    """
+    Run the HR/SpO2, tilt and temperature processing of the collectors
+    over the raw samples in [start, end), in `workers` processes,
+    and write the series they log and the alerts they send to `out_dir`.
+
+    The windows only depend on their raw samples; the HR/SpO2 averaging
+    and alert timing, which carry over from window to window, run here
+    over the estimates in order. Returns the number of rows per output file.
+    """
+    apply_settings(settings)
+    tasks = make_tasks(logs_dir, start, end, window)
+    output = _Output(out_dir)
+    monitor_path = None
+    try:
+        with ProcessPoolExecutor(workers, initializer=apply_settings, initargs=(settings,)) as pool:
+            for (sensor, path, _), result in zip(tasks, pool.map(_run, [task for _, _, task in tasks])):
+                if sensor == 'imu':
+                    output.messages('tilt', result)
+                elif sensor == 'temperature':
+                    messages, averages = result
+                    output.messages(None, messages)
+                    for t, value in averages:
+                        output.write('temperature', t, value)
+                else:
+                    if path != monitor_path:
+                        # a new log is a new run of the collector
+                        clock = _Clock()
+                        queue = _Sink(clock)
+                        logger = _Sink(clock)
+                        monitor = hr_spo2.HrSpo2Monitor(clock, queue, logger)
+                        monitor_path = path
+                    for estimate in zip(*(values.tolist() for values in result)):
+                        clock.now = estimate[0]
+                        monitor.add_estimate(estimate[1:])
+                    output.messages(None, queue.items)
+                    for t, value in logger.items:
+                        value = json.loads(value)
+                        output.write('hr_spo2', t, value['hr'], value['spo2'])
+                    queue.items = []
+                    logger.items = []
+    finally:
+        output.close()
+    return output.rows
+
+
+def parse_setting(text):
+    """
+    "module.NAME=value" -> (module, NAME, value), value as a Python literal.
+    """
+    target, value = text.split('=', 1)
+    module, name = target.split('.', 1)
+    if module not in MODULES or not hasattr(MODULES[module], name):
+        raise argparse.ArgumentTypeError(f"unknown setting {target}")
+    return module, name, ast.literal_eval(value)
+
+
+def main():
+    """
+    python reprocess.py [--start "2026-10-18 22:00"] [--end ...] [--workers N]
+                        [--set hr_spo2.hr_high=150 ...] [--out reprocessed]
+    """
+    parser = argparse.ArgumentParser(description="Re-run the sensor processing over the raw logs.")
+    parser.add_argument('--logs', default=LOG_ROOT, help="logs directory (default: %(default)s)")
+    parser.add_argument('--out', default=OUTPUT_DIR, help="output directory (default: %(default)s)")
+    parser.add_argument('--start', type=parse_time, help="only samples from this time on")
+    parser.add_argument('--end', type=parse_time, help="only samples before this time")
+    parser.add_argument('--workers', type=int, help="processes (default: one per CPU)")
+    parser.add_argument('--window', type=float, default=WINDOW, help="seconds per window (default: %(default)s)")
+    parser.add_argument('--set', dest='settings', type=parse_setting, action='append', default=[],
+                        metavar='MODULE.NAME=VALUE', help="change a setting, e.g. hr_spo2.hr_high=150")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    rows = reprocess(args.logs, args.out, args.start, args.end, args.workers, args.window, args.settings)
+    for name, count in rows.items():
+        print(f"{os.path.join(args.out, name + '.csv')}: {count} rows")
+    print(f"{time.perf_counter() - started:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
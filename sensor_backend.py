@@ -0,0 +1,128 @@
+import os
+import csv
+import time
+import asyncio
+
+# Data source behind the sensor collectors, chosen with the SLUMBER_BACKEND
+# environment variable (inherited by every process main.py starts):
+#   real      - the sensors on the Pi (default)
+#   synthetic - generated signals
+#   replay    - recorded CSV files from SLUMBER_REPLAY_DIR
+REAL = 'real'
+SYNTHETIC = 'synthetic'
+REPLAY = 'replay'
+BACKENDS = (REAL, SYNTHETIC, REPLAY)
+
+BACKEND_ENV = 'SLUMBER_BACKEND'
+REPLAY_DIR_ENV = 'SLUMBER_REPLAY_DIR'
+# Speed of synthetic and replayed time: 1 = real time, 60 = a minute per second,
+# 0 = as fast as possible (time only moves when a collector sleeps)
+SPEED_ENV = 'SLUMBER_SPEED'
+
+DEFAULT_REPLAY_DIR = 'replay'
+
+
+def backend_kind():
+    kind = os.environ.get(BACKEND_ENV, REAL).lower()
+    if kind not in BACKENDS:
+        raise ValueError(f"{BACKEND_ENV} must be one of {', '.join(BACKENDS)}, not {kind!r}")
+    return kind
+
+
+def replay_path(file_name):
+    return os.path.join(os.environ.get(REPLAY_DIR_ENV, DEFAULT_REPLAY_DIR), file_name)
+
+
+def make_clock(kind=None, start=None):
+    """
+    Clock for the given backend kind: wall-clock time for real sensors,
+    a ScaledClock running at SLUMBER_SPEED otherwise.
+    """
+    kind = kind or backend_kind()
+    if kind == REAL:
+        return RealClock()
+    return ScaledClock(float(os.environ.get(SPEED_ENV, 1.0)), start)
+
+
+class RealClock():
+    """
+    time.time() and time.sleep().
+    """
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class ScaledClock():
+    """
+    Clock that runs `speed` times faster than real time.
+    With speed 0 it is purely virtual and only moves forward on sleep(),
+    so sleeping costs nothing.
+    """
+    def __init__(self, speed=1.0, start=None):
+        self.speed = speed
+        self._start = time.time() if start is None else start
+        self._real_start = time.monotonic()
+        self._virtual = 0.0
+
+    def time(self):
+        if self.speed == 0:
+            return self._start + self._virtual
+        return self._start + (time.monotonic() - self._real_start) * self.speed
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        if self.speed == 0:
+            self._virtual += seconds
+        else:
+            time.sleep(seconds / self.speed)
+
+    def restart(self, start):
+        """
+        Move the clock to `start`, e.g. the first timestamp of a replay file.
+        """
+        self._start = start
+        self._real_start = time.monotonic()
+        self._virtual = 0.0
+
+
+def wait_until(clock, timestamp, batch=0.0):
+    """
+    Sleep until `timestamp` on `clock`. With `batch`, sleep that much longer,
+    so samples that become due while sleeping are handled in one wake-up.
+    """
+    delay = timestamp - clock.time()
+    if delay > 0:
+        clock.sleep(delay + batch)
+
+
+async def sleep_async(clock, seconds):
+    """
+    clock.sleep() for coroutines: waits on the event loop instead of blocking it.
+    """
+    if seconds <= 0:
+        await asyncio.sleep(0)
+    elif isinstance(clock, ScaledClock):
+        if clock.speed == 0:
+            # virtual time, nothing to wait for; still let the other tasks run
+            clock.sleep(seconds)
+            await asyncio.sleep(0)
+        else:
+            await asyncio.sleep(seconds / clock.speed)
+    else:
+        await asyncio.sleep(seconds)
+
+
+def read_csv(path):
+    """
+    Rows of a replay CSV file as lists of floats, header skipped.
+    """
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if row:
+                yield [float(value) for value in row]
@@ -0,0 +1,181 @@
+import threading
+import numpy as np
+from multiprocessing import shared_memory
+
+# Header: write counter, then the read counter on its own cache line,
+# then capacity and record size for readers that attach
+HEADER_SIZE = 128
+_WRITE = 0
+_READ = 8
+_CAPACITY = 9
+_ITEMSIZE = 10
+
+
+class SampleRing():
+    """
+    Single-producer / single-consumer ring of fixed-dtype records in
+    multiprocessing shared memory, so raw samples go from a collector to
+    another process without pickling.
+
+    The producer never waits: write() copies records in and then publishes
+    the new write counter. A consumer that falls more than `capacity`
+    records behind loses the oldest ones (read() reports how many).
+    Every record is stored twice, at i and i + capacity, so any window of
+    up to `capacity` records is one contiguous NumPy view (as hrcalc._Ring).
+
+    Views returned by read() and latest() point into shared memory; they
+    stay valid until the producer writes about `capacity` more records,
+    copy them (np.array(view)) to keep them longer.
+
+    The counters are plain aligned 64-bit stores, and the processes never
+    lock: the producer only writes the write counter and the consumer only
+    the read counter. On a weakly ordered CPU (the Pi's ARM cores) a plain
+    store of the counter could be seen before the records, so write()
+    fences between the records and the counter, and read() and latest()
+    between the counter and the records. Python has no fences; _fence()
+    takes a lock of this process twice, so a release (store-release) is
+    followed by an acquire (load-acquire), which together are a full
+    barrier on ARMv8 and x86, with no system call and no waiting on the
+    other process.
+    """
+    def __init__(self, shm, dtype, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self.dtype = np.dtype(dtype)
+        self._header = np.ndarray(HEADER_SIZE // 8, dtype=np.uint64, buffer=shm.buf)
+        self.capacity = int(self._header[_CAPACITY])
+        if int(self._header[_ITEMSIZE]) != self.dtype.itemsize:
+            raise ValueError(f"ring {shm.name} holds {int(self._header[_ITEMSIZE])}-byte records, "
+                             f"not {self.dtype.itemsize}-byte {self.dtype}")
+        self._data = np.ndarray(2 * self.capacity, dtype=self.dtype, buffer=shm.buf, offset=HEADER_SIZE)
+        self._barrier = threading.Lock()
+
+    @classmethod
+    def create(cls, name, dtype, capacity):
+        """
+        Create the ring `name` for `capacity` records (replacing a stale one).
+        """
+        dtype = np.dtype(dtype)
+        size = HEADER_SIZE + 2 * capacity * dtype.itemsize
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # left behind by a process that did not shut down cleanly
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray(HEADER_SIZE // 8, dtype=np.uint64, buffer=shm.buf)
+        header[:] = 0
+        header[_CAPACITY] = capacity
+        header[_ITEMSIZE] = dtype.itemsize
+        del header
+        return cls(shm, dtype, owner=True)
+
+    @classmethod
+    def attach(cls, name, dtype):
+        """
+        Attach to an existing ring, without copying, or None if there is none.
+        """
+        try:
+            try:
+                # only the creator removes the ring (Python 3.13+)
+                shm = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                # older Pythons track it in every process that attaches; that is
+                # fine for processes forked from the creator, which share its
+                # resource tracker, but an unrelated process removes the ring on exit
+                shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return None
+        return cls(shm, dtype)
+
+    # --- producer ---
+
+    def write(self, records):
+        """
+        Append records (a structured array or a sequence of tuples).
+        """
+        records = np.asarray(records, dtype=self.dtype)
+        count = len(records)
+        if count > self.capacity:
+            records = records[-self.capacity:]
+        write = int(self._header[_WRITE])
+        start = (write + count - len(records)) % self.capacity
+        first = min(len(records), self.capacity - start)
+        rest = len(records) - first
+
+        self._data[start:start + first] = records[:first]
+        self._data[start + self.capacity:start + self.capacity + first] = records[:first]
+        if rest:
+            self._data[0:rest] = records[first:]
+            self._data[self.capacity:self.capacity + rest] = records[first:]
+
+        # publish after the data is in place
+        self._fence()
+        self._header[_WRITE] = write + count
+
+    # --- readers ---
+
+    @property
+    def written(self):
+        """
+        Records written since the ring was created.
+        """
+        return int(self._header[_WRITE])
+
+    def available(self):
+        """
+        Records written but not read yet (may exceed capacity if lost).
+        """
+        return int(self._header[_WRITE]) - int(self._header[_READ])
+
+    def read(self, max_count=None):
+        """
+        Consumer: (view, lost) with the unread records, oldest first, and
+        the number of records lost because the consumer fell behind.
+        Marks the records as read.
+        """
+        write = int(self._header[_WRITE])
+        self._fence()
+        read = int(self._header[_READ])
+        lost = 0
+        if write - read > self.capacity:
+            lost = write - read - self.capacity
+            read = write - self.capacity
+        count = write - read
+        if max_count is not None:
+            count = min(count, max_count)
+        start = read % self.capacity
+        view = self._data[start:start + count]
+        self._header[_READ] = read + count
+        return view, lost
+
+    def latest(self, count):
+        """
+        View of the newest `count` records (fewer if not written yet),
+        without consuming them; any number of readers can do this.
+        """
+        write = int(self._header[_WRITE])
+        self._fence()
+        count = min(count, write, self.capacity)
+        # the second copy ends at the newest record and has `capacity` before it
+        end = write % self.capacity + self.capacity
+        return self._data[end - count:end]
+
+    def _fence(self):
+        # never contended but by another thread of this process fencing too
+        with self._barrier:
+            pass
+        with self._barrier:
+            pass
+
+    def close(self):
+        """
+        Detach; the creator also removes the ring.
+        """
+        self._header = None
+        self._data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
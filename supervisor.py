@@ -0,0 +1,304 @@
+import os
+import signal
+import time
+from multiprocessing import Process, Value
+from multiprocessing.connection import wait
+
+import profiler
+
+# Seconds between two checks of the children
+CHECK_INTERVAL = 0.5
+# A child that has beaten once and then not for this long is restarted
+HEARTBEAT_TIMEOUT = 10
+# Restart delay, doubled after every failure up to the maximum; a child that
+# ran at least STABLE_TIME seconds restarts after the minimum delay again
+RESTART_MIN_DELAY = 1
+RESTART_MAX_DELAY = 60
+STABLE_TIME = 60
+# Seconds a child gets to exit after SIGTERM before it is killed
+STOP_TIMEOUT = 5
+# Seconds between two statistics reports
+STATS_INTERVAL = 60
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def process_cpu_time(pid):
+    """
+    User + system CPU seconds used by `pid` (from /proc), or None if it is gone.
+    """
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # the fields after the command name start at field 3 (state);
+            # utime and stime are fields 14 and 15
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class Heartbeat():
+    """
+    Time of a child's latest beat(), in shared memory. time.monotonic() is
+    the same clock in every process. It stays 0 until the first beat, so a
+    slow start (e.g. the gyro calibration) is not taken for a hang.
+    """
+    def __init__(self):
+        self._time = Value('d', 0.0, lock=False)
+
+    def beat(self):
+        self._time.value = time.monotonic()
+
+    def reset(self):
+        self._time.value = 0.0
+
+    def age(self):
+        """
+        Seconds since the latest beat, None before the first one.
+        """
+        last = self._time.value
+        return None if last == 0.0 else time.monotonic() - last
+
+
+def _exit_on_signal(signum, frame):
+    # unwinds the collector, so its finally blocks close the logs
+    raise SystemExit(128 + signum)
+
+
+def _run_child(name, target, args, kwargs, cpus, nice):
+    # Ctrl+C reaches the whole process group; the supervisor stops the children
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _exit_on_signal)
+    # profiles tagged with the child's name (see profiler.py)
+    profiler.install(name)
+
+    if cpus is not None:
+        usable = set(cpus) & os.sched_getaffinity(0)
+        if usable:
+            os.sched_setaffinity(0, usable)
+        else:
+            print(f"[supervisor] {name}: CPUs {sorted(cpus)} not available, not pinned")
+    if nice:
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, nice)
+        except PermissionError:
+            # a negative nice level needs root (or CAP_SYS_NICE)
+            print(f"[supervisor] {name}: not allowed to set nice level {nice}")
+
+    target(*args, **kwargs)
+
+
+class Child():
+    """
+    One supervised process: how to start it and what happened to it.
+    """
+    def __init__(self, name, target, args=(), kwargs=None, cpus=None, nice=0,
+                 heartbeat_timeout=HEARTBEAT_TIMEOUT):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.kwargs = dict(kwargs or {})
+        self.cpus = cpus
+        self.nice = nice
+        self.heartbeat_timeout = heartbeat_timeout
+        self.heartbeat = Heartbeat() if heartbeat_timeout else None
+
+        self.process = None
+        self.starts = 0
+        self.hangs = 0
+        self.exitcode = None
+        self.started = None
+        self.restart_at = None
+        self.terminated_at = None
+        self.delay = RESTART_MIN_DELAY
+        self.cpu_time = 0.0     # of the runs that have ended
+        self.current_cpu = 0.0  # of the running process, at the latest check
+
+    @property
+    def restarts(self):
+        return max(self.starts - 1, 0)
+
+    def total_cpu_time(self):
+        return self.cpu_time + self.current_cpu
+
+
+class Supervisor():
+    """
+    Starts the sensor collectors and the BLE server as child processes and
+    keeps them running.
+
+    A child that exits with an error, or stops calling heartbeat.beat()
+    for heartbeat_timeout seconds, is restarted after an exponential
+    backoff. A child that returns normally (e.g. at the end of replayed
+    data) is not restarted; run() returns when no child is left.
+    Each child can be pinned to `cpus` and given a `nice` level.
+
+    SIGTERM or Ctrl+C stops the children with SIGTERM, so their finally
+    blocks close the logs, and kills those still running after
+    STOP_TIMEOUT seconds.
+    """
+    def __init__(self, stats_interval=STATS_INTERVAL):
+        self.children = []
+        self.stats_interval = stats_interval
+        self.stopping = False
+        self._report_time = time.monotonic()
+        self._reported_cpu = {}
+
+    def add(self, name, target, args=(), kwargs=None, cpus=None, nice=0,
+            heartbeat_timeout=HEARTBEAT_TIMEOUT):
+        """
+        Supervise target(*args, **kwargs, heartbeat=...) as `name`.
+        heartbeat_timeout=None disables the heartbeat check (and the argument).
+        """
+        child = Child(name, target, args, kwargs, cpus, nice, heartbeat_timeout)
+        if child.heartbeat is not None:
+            child.kwargs['heartbeat'] = child.heartbeat
+        self.children.append(child)
+        return child
+
+    def run(self):
+        handlers = {sig: signal.signal(sig, self._on_signal) for sig in (signal.SIGTERM, signal.SIGINT)}
+        handlers[profiler.PROFILE_SIGNAL] = signal.signal(profiler.PROFILE_SIGNAL, self._on_profile_signal)
+        try:
+            for child in self.children:
+                self._start(child)
+            next_stats = time.monotonic() + self.stats_interval
+
+            while not self.stopping:
+                running = [child.process.sentinel for child in self.children if child.process is not None]
+                if not running and all(child.restart_at is None for child in self.children):
+                    break
+                # returns as soon as a child exits
+                wait(running, timeout=CHECK_INTERVAL)
+
+                now = time.monotonic()
+                for child in self.children:
+                    self._check(child, now)
+                if now >= next_stats:
+                    self.print_stats()
+                    next_stats = now + self.stats_interval
+        finally:
+            self.stop()
+            for sig, handler in handlers.items():
+                signal.signal(sig, handler)
+            self.print_stats()
+
+    def stop(self):
+        """
+        Stop every child: SIGTERM, then SIGKILL after STOP_TIMEOUT seconds.
+        """
+        self.stopping = True
+        running = [child for child in self.children if child.process is not None]
+        for child in running:
+            self._sample_cpu(child)
+            child.process.terminate()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for child in running:
+            child.process.join(max(deadline - time.monotonic(), 0))
+            if child.process.is_alive():
+                print(f"[supervisor] {child.name} did not stop, killing it")
+                child.process.kill()
+                child.process.join()
+            self._ended(child)
+
+    def report(self):
+        """
+        Per child: pid, restarts, hangs, last exit code, CPU seconds in
+        total and CPU percent since the last report.
+        """
+        now = time.monotonic()
+        elapsed = max(now - self._report_time, 1e-9)
+        self._report_time = now
+        report = {}
+        for child in self.children:
+            if child.process is not None:
+                self._sample_cpu(child)
+            cpu = child.total_cpu_time()
+            report[child.name] = {
+                'pid': child.process.pid if child.process is not None else None,
+                'restarts': child.restarts,
+                'hangs': child.hangs,
+                'exitcode': child.exitcode,
+                'cpu_seconds': cpu,
+                'cpu_percent': 100 * (cpu - self._reported_cpu.get(child.name, 0.0)) / elapsed,
+            }
+            self._reported_cpu[child.name] = cpu
+        return report
+
+    def print_stats(self):
+        for name, stats in self.report().items():
+            state = f"pid {stats['pid']}" if stats['pid'] is not None else f"exited {stats['exitcode']}"
+            print(f"[supervisor] {name}: {state}, {stats['restarts']} restarts ({stats['hangs']} hung), "
+                  f"CPU {stats['cpu_seconds']:.1f} s, {stats['cpu_percent']:.1f}%")
+
+    def _on_signal(self, signum, frame):
+        self.stopping = True
+
+    def _on_profile_signal(self, signum, frame):
+        # profile every child at once
+        for child in self.children:
+            if child.process is not None and child.process.pid is not None:
+                try:
+                    os.kill(child.process.pid, signum)
+                except ProcessLookupError:
+                    pass  # exited, the supervisor restarts it
+
+    def _start(self, child):
+        if child.heartbeat is not None:
+            child.heartbeat.reset()
+        child.process = Process(target=_run_child, name=child.name,
+                                args=(child.name, child.target, child.args, child.kwargs, child.cpus, child.nice))
+        child.process.start()
+        child.starts += 1
+        child.started = time.monotonic()
+        child.restart_at = None
+        child.terminated_at = None
+        child.current_cpu = 0.0
+
+    def _check(self, child, now):
+        if child.process is None:
+            if child.restart_at is not None and now >= child.restart_at and not self.stopping:
+                print(f"[supervisor] restarting {child.name}")
+                self._start(child)
+            return
+
+        # before is_alive(), which reaps an exited child and its /proc entry
+        self._sample_cpu(child)
+        if not child.process.is_alive():
+            hung = child.terminated_at is not None
+            self._ended(child)
+            if child.exitcode == 0 and not hung:
+                print(f"[supervisor] {child.name} finished")
+            elif not self.stopping:
+                self._schedule_restart(child, now)
+            return
+
+        if child.terminated_at is not None:
+            if now - child.terminated_at > STOP_TIMEOUT:
+                child.process.kill()
+            return
+
+        age = child.heartbeat.age() if child.heartbeat is not None else None
+        if age is not None and age > child.heartbeat_timeout:
+            print(f"[supervisor] {child.name}: no heartbeat for {age:.1f} s, stopping it")
+            child.hangs += 1
+            child.process.terminate()
+            child.terminated_at = now
+
+    def _schedule_restart(self, child, now):
+        if now - child.started >= STABLE_TIME:
+            child.delay = RESTART_MIN_DELAY
+        child.restart_at = now + child.delay
+        print(f"[supervisor] {child.name} exited with code {child.exitcode}, restarting in {child.delay} s")
+        child.delay = min(child.delay * 2, RESTART_MAX_DELAY)
+
+    def _sample_cpu(self, child):
+        cpu = process_cpu_time(child.process.pid)
+        if cpu is not None:
+            child.current_cpu = cpu
+
+    def _ended(self, child):
+        child.exitcode = child.process.exitcode
+        child.cpu_time += child.current_cpu
+        child.current_cpu = 0.0
+        child.process = None